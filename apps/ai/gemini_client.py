@@ -1,14 +1,16 @@
-import google.generativeai as genai
-import os
 import logging
+import time
 
-logger = logging.getLogger(__name__)
+from apps.ai.llm_backends import get_backend
+from apps.monitoring.metrics import record_llm_call
+from apps.monitoring.tracing import span
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+logger = logging.getLogger(__name__)
 
 async def get_api_response(messages: list) -> str:
     """
-    Obtiene una respuesta del modelo Gemini de Google AI.
+    Obtiene una respuesta del LLM configurado (Gemini por defecto; ver apps/ai/llm_backends.py
+    para grabar y reproducir respuestas sin red).
 
     Args:
         messages: Una lista de diccionarios, donde cada diccionario representa
@@ -17,8 +19,6 @@ async def get_api_response(messages: list) -> str:
         La respuesta de texto del modelo.
     """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-
         if not messages:
             logger.warning("Lista de mensajes vacía para get_api_response.")
             return "Lo siento, no recibí ningún mensaje para procesar."
@@ -27,15 +27,21 @@ async def get_api_response(messages: list) -> str:
             logger.error(f"El último mensaje en el historial no tiene la clave 'parts': {messages[-1]}")
             return "Lo siento, hubo un problema interno al entender tu último mensaje."
 
-        last_user_message_parts = messages[-1]["parts"]
-        chat_history = messages[:-1]
-
-        chat_session = model.start_chat(history=chat_history)
-
-        response = chat_session.send_message(last_user_message_parts)
+        backend = get_backend()
+        started = time.perf_counter()
+        try:
+            with span("llm.generate", backend=backend.name, history_messages=len(messages) - 1) as llm_span:
+                response = await backend.generate(messages)
+                if llm_span is not None and response.prompt_tokens is not None:
+                    # Solo conteos de tokens: el contenido del prompt no se registra.
+                    llm_span.set(prompt_tokens=response.prompt_tokens, output_tokens=response.output_tokens or 0)
+        except Exception:
+            record_llm_call(time.perf_counter() - started, "error")
+            raise
+        record_llm_call(time.perf_counter() - started, "ok", response.prompt_tokens, response.output_tokens)
 
         return response.text
 
     except Exception as e:
         logger.error(f"Error al generar respuesta con Gemini: {e}", exc_info=True)
-        return "Lo siento, hubo un problema al procesar tu solicitud con la IA. Por favor, inténtalo de nuevo."
\ No newline at end of file
+        return "Lo siento, hubo un problema al procesar tu solicitud con la IA. Por favor, inténtalo de nuevo."
@@ -0,0 +1,236 @@
+"""
+Backends del LLM detrás de apps/ai/gemini_client.get_api_response.
+
+- GeminiBackend: la API real de Gemini. genai.configure se llama en la primera llamada, no al
+  importar, para que el resto de apps/ai pueda importarse sin credenciales ni red.
+- RecordingBackend: delega en otro backend (Gemini) y guarda cada prompt con su respuesta,
+  latencia y tokens en un archivo JSONL.
+- ReplayBackend: responde desde ese archivo sin red, con la latencia original, escalada o fija.
+  Las respuestas se buscan por el hash del historial de mensajes completo; si un mismo prompt
+  se grabó varias veces, se devuelven en el orden en que se grabaron (y luego la última).
+
+Todos los backends cuentan llamadas, errores y tokens (calls, errors, prompt_tokens,
+output_tokens), así que las regresiones en cantidad de prompts o de tokens se pueden medir
+con grabaciones en lugar de con la API real.
+
+Variables:
+  LLM_BACKEND         gemini (por defecto) | record | replay
+  LLM_STORE           archivo JSONL de grabaciones (llm_recordings.jsonl)
+  LLM_REPLAY_LATENCY  original (por defecto) | none | scaled:<factor> | fixed:<ms>
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from db.json_codec import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = 'gemini-1.5-flash'
+DEFAULT_STORE = "llm_recordings.jsonl"
+
+
+@dataclass(slots=True)
+class LLMResponse:
+    text: str
+    prompt_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    latency_ms: Optional[float] = None
+
+
+class LLMReplayMissError(Exception):
+    """El prompt no está en las grabaciones del ReplayBackend."""
+
+
+def prompt_key(messages: List[Dict[str, Any]]) -> str:
+    """Hash estable del historial de mensajes (rol y partes) enviado al LLM."""
+    canonical = json.dumps(messages, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMBackend(ABC):
+    """Interfaz común: generate() recibe el historial en formato Gemini (role, parts)."""
+
+    name = "base"
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    async def generate(self, messages: List[Dict[str, Any]]) -> LLMResponse:
+        self.calls += 1
+        try:
+            response = await self._generate(messages)
+        except Exception:
+            self.errors += 1
+            raise
+        self.prompt_tokens += response.prompt_tokens or 0
+        self.output_tokens += response.output_tokens or 0
+        return response
+
+    @abstractmethod
+    async def _generate(self, messages: List[Dict[str, Any]]) -> LLMResponse:
+        """Llamada propia del backend; generate() la envuelve con los contadores."""
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model: str = GEMINI_MODEL, api_key: Optional[str] = None):
+        super().__init__()
+        self.model = model
+        self._api_key = api_key
+        self._configured = False
+
+    def _configure(self):
+        import google.generativeai as genai
+
+        if not self._configured:
+            genai.configure(api_key=self._api_key or os.getenv("GEMINI_API_KEY"))
+            self._configured = True
+        return genai
+
+    async def _generate(self, messages: List[Dict[str, Any]]) -> LLMResponse:
+        genai = self._configure()
+        model = genai.GenerativeModel(self.model)
+        chat_session = model.start_chat(history=messages[:-1])
+        started = time.perf_counter()
+        response = chat_session.send_message(messages[-1]["parts"])
+        latency_ms = (time.perf_counter() - started) * 1000
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=response.text,
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            latency_ms=latency_ms,
+        )
+
+
+class RecordingBackend(LLMBackend):
+    """Graba en `path` cada intercambio con el backend real."""
+
+    name = "record"
+
+    def __init__(self, inner: LLMBackend, path: str = DEFAULT_STORE):
+        super().__init__()
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    async def _generate(self, messages: List[Dict[str, Any]]) -> LLMResponse:
+        started = time.perf_counter()
+        response = await self.inner.generate(messages)
+        if response.latency_ms is None:
+            response.latency_ms = (time.perf_counter() - started) * 1000
+        record = {
+            "key": prompt_key(messages),
+            "messages": messages,
+            "text": response.text,
+            "latency_ms": round(response.latency_ms, 2),
+            "prompt_tokens": response.prompt_tokens,
+            "output_tokens": response.output_tokens,
+            "backend": self.inner.name,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+        }
+        line = dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return response
+
+
+class ReplayBackend(LLMBackend):
+    """Responde desde las grabaciones de RecordingBackend, sin red."""
+
+    name = "replay"
+
+    def __init__(self, path: str = DEFAULT_STORE, latency: str = "original"):
+        super().__init__()
+        self.path = path
+        self.latency = latency
+        self.misses = 0
+        self._mode, self._value = self.parse_latency(latency)
+        self._records: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = loads(line)
+                    self._records.setdefault(record["key"], []).append(record)
+        logger.info("Replay del LLM: %d prompts grabados en %s (latencia %s).", len(self._records), path, latency)
+
+    @staticmethod
+    def parse_latency(spec: str):
+        mode, _, value = spec.partition(":")
+        if mode in ("original", "none"):
+            return mode, None
+        if mode in ("scaled", "fixed") and value:
+            return mode, float(value)
+        raise ValueError(f"LLM_REPLAY_LATENCY inválido: {spec!r} (original, none, scaled:<factor> o fixed:<ms>)")
+
+    def _delay_seconds(self, record: Dict[str, Any]) -> float:
+        if self._mode == "none":
+            return 0.0
+        if self._mode == "fixed":
+            return self._value / 1000
+        original = (record.get("latency_ms") or 0.0) / 1000
+        return original * self._value if self._mode == "scaled" else original
+
+    async def _generate(self, messages: List[Dict[str, Any]]) -> LLMResponse:
+        key = prompt_key(messages)
+        records = self._records.get(key)
+        if not records:
+            self.misses += 1
+            raise LLMReplayMissError(f"Prompt sin grabación (clave {key[:12]})")
+        index = self._served.get(key, 0)
+        self._served[key] = index + 1
+        record = records[min(index, len(records) - 1)]
+        delay = self._delay_seconds(record)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return LLMResponse(
+            text=record["text"],
+            prompt_tokens=record.get("prompt_tokens"),
+            output_tokens=record.get("output_tokens"),
+            latency_ms=delay * 1000,
+        )
+
+
+_backend: Optional[LLMBackend] = None
+
+
+def create_backend(kind: Optional[str] = None) -> LLMBackend:
+    """Crea el backend según LLM_BACKEND (o `kind`)."""
+    kind = (kind or os.getenv("LLM_BACKEND", "gemini")).lower()
+    store = os.getenv("LLM_STORE", DEFAULT_STORE)
+    if kind == "gemini":
+        return GeminiBackend()
+    if kind == "record":
+        return RecordingBackend(GeminiBackend(), store)
+    if kind == "replay":
+        return ReplayBackend(store, os.getenv("LLM_REPLAY_LATENCY", "original"))
+    raise ValueError(f"LLM_BACKEND inválido: {kind!r} (gemini, record o replay)")
+
+
+def get_backend() -> LLMBackend:
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend: Optional[LLMBackend]) -> None:
+    """Reemplaza el backend del proceso (pruebas de carga, benchmarks). None vuelve a LLM_BACKEND."""
+    global _backend
+    _backend = backend
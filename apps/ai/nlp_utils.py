@@ -1,7 +1,13 @@
+import logging
 import re
+import time
 from datetime import datetime
 import dateparser
 from apps.ai.response_generator import gemini_simple_prompt
+from apps.monitoring.metrics import observe_stage, track_stage
+from apps.monitoring.tracing import span
+
+logger = logging.getLogger(__name__)
 
 COMMON_WORDS = {
     "cita", "citas", "agendar", "agendamiento", "reservar", "reserva", "cancelar", "cancelación",
@@ -17,6 +23,20 @@ def clean_for_dateparser(text):
     return text.strip()
 
 async def detect_intent(message_text, session_data=None):
+    intent, _source = await detect_intent_with_source(message_text, session_data)
+    return intent
+
+async def detect_intent_with_source(message_text, session_data=None):
+    """Como detect_intent, pero indica también quién la resolvió: "keywords" o "llm" (el fallback)."""
+    started = time.perf_counter()
+    intent = _detect_intent_by_keywords(message_text)
+    observe_stage("intent_keyword", time.perf_counter() - started)
+    if intent:
+        return intent, "keywords"
+    with track_stage("intent_llm"):
+        return await _detect_intent_with_llm(message_text, session_data), "llm"
+
+def _detect_intent_by_keywords(message_text):
     greetings = ["hola", "buenos días", "buenas tardes", "buenas noches"]
     farewells = ["adiós", "gracias", "hasta luego", "nos vemos"]
 
@@ -37,7 +57,9 @@ async def detect_intent(message_text, session_data=None):
         return "reschedule_appointment"
     if "información" in text:
         return "ask_information"
+    return None
 
+async def _detect_intent_with_llm(message_text, session_data=None):
     # Fallback a Gemini si no hay match rápido
     gemini_prompt = (
         f"Dada la conversación y el siguiente mensaje: '{message_text}', "
@@ -80,7 +102,8 @@ async def extract_info(message_text, session_data=None, user_phone=None, slot=No
             f"- Si hay varias opciones mencionadas, escoge la que más se parezca a lo que el usuario escribió.\n"
             f"Solo responde con el valor exacto de la opción, o None."
         )
-        gemini_resp = await gemini_simple_prompt(prompt)
+        with track_stage("extract_option_llm"):
+            gemini_resp = await gemini_simple_prompt(prompt)
         value = gemini_resp.strip().replace('"', '').replace("'", "")
         if value.lower() == "none":
             return {slot: None}
@@ -92,7 +115,8 @@ async def extract_info(message_text, session_data=None, user_phone=None, slot=No
         f"No incluyas frases adicionales, solo el nombre. Si el mensaje no contiene nombre, responde únicamente con 'NO'.\n"
         f"Mensaje: '{message_text}'"
     )
-    gemini_name = (await gemini_simple_prompt(gemini_name_prompt)).strip().replace('"', '').replace("'", "")
+    with track_stage("extract_name_llm"):
+        gemini_name = (await gemini_simple_prompt(gemini_name_prompt)).strip().replace('"', '').replace("'", "")
     if gemini_name.upper() != "NO":
         result["name"] = " ".join([part.capitalize() for part in gemini_name.split()])
 
@@ -101,15 +125,16 @@ async def extract_info(message_text, session_data=None, user_phone=None, slot=No
 
     # EXTRACCIÓN DE FECHA Y HORA
     cleaned_text_for_dateparser = clean_for_dateparser(text)
-    parsed_dt = dateparser.parse(
-        cleaned_text_for_dateparser,
-        languages=['es'],
-        settings={
-            'PREFER_DATES_FROM': 'future',
-            'RELATIVE_BASE': datetime.now(),
-            'DATE_ORDER': 'DMY'
-        }
-    )
+    with track_stage("extract_datetime_dateparser"):
+        parsed_dt = dateparser.parse(
+            cleaned_text_for_dateparser,
+            languages=['es'],
+            settings={
+                'PREFER_DATES_FROM': 'future',
+                'RELATIVE_BASE': datetime.now(),
+                'DATE_ORDER': 'DMY'
+            }
+        )
     if parsed_dt:
         result["datetime"] = parsed_dt
     else:
@@ -120,7 +145,8 @@ async def extract_info(message_text, session_data=None, user_phone=None, slot=No
             f"Considera el contexto de la conversación: {session_data}. "
             f"Mensaje: '{message_text}'"
         )
-        gemini_response = await gemini_simple_prompt(gemini_prompt)
+        with track_stage("extract_datetime_llm"):
+            gemini_response = await gemini_simple_prompt(gemini_prompt)
         gemini_response = gemini_response.strip().replace('"', '').replace("'", "")
 
         if gemini_response.upper() != "NO":
@@ -130,18 +156,19 @@ async def extract_info(message_text, session_data=None, user_phone=None, slot=No
                 else:
                     possible_dt = gemini_response
 
-                parsed_from_gemini = dateparser.parse(
-                    possible_dt,
-                    languages=['es'],
-                    settings={
-                        'PREFER_DATES_FROM': 'future',
-                        'RELATIVE_BASE': datetime.now(),
-                        'DATE_ORDER': 'DMY'
-                    }
-                )
+                with span("dateparser.parse", source="llm"):
+                    parsed_from_gemini = dateparser.parse(
+                        possible_dt,
+                        languages=['es'],
+                        settings={
+                            'PREFER_DATES_FROM': 'future',
+                            'RELATIVE_BASE': datetime.now(),
+                            'DATE_ORDER': 'DMY'
+                        }
+                    )
                 if parsed_from_gemini:
                     result["datetime"] = parsed_from_gemini
             except Exception as e:
-                print(f"DEBUG: Error parsing datetime from Gemini response '{gemini_response}': {e}")
+                logger.debug("Error parsing datetime from Gemini response %r: %s", gemini_response, e)
 
     return result
\ No newline at end of file
@@ -20,7 +20,8 @@ async def generate_response(
     """
     try:
         # 1. Obtener historial desde la base de datos (formato: [{"direction": "in"/"out", "body": "..."}, ...])
-        raw_messages = await get_messages_by_session_id(session_id)
+        company_id = company.get("id") if isinstance(company, dict) else getattr(company, "id", None)
+        raw_messages = await get_messages_by_session_id(session_id, company_id)
 
         # 2. Convertir historial al formato Gemini: [{"role": "user"/"model", "parts": [{"text": "..."}]}, ...]
         message_history = []
@@ -1,15 +1,39 @@
+import os
+import secrets
+
 from fastapi import Header, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from db.models.company import Company
-from db.database import get_db_session
+from db.database import engine, get_db_session, get_read_db, read_engine
 from sqlalchemy.future import select
 
+async def _company_by_api_key(db: AsyncSession, api_key: str):
+    result = await db.execute(select(Company).where(Company.api_key == api_key))
+    return result.scalars().first()
+
 async def get_current_company(
     x_api_key: str = Header(...),
-    db: AsyncSession = Depends(get_db_session),
+    db: AsyncSession = Depends(get_read_db),
 ) -> Company:
-    result = await db.execute(select(Company).where(Company.api_key == x_api_key))
-    company = result.scalars().first()
+    """
+    Empresa de la API key, leída de la réplica. Si no está, se confirma en el primario: una
+    empresa recién registrada (/register) puede no haber llegado aún a la réplica.
+    """
+    company = await _company_by_api_key(db, x_api_key)
+    if company is None and read_engine is not engine:
+        async with get_db_session() as primary:
+            company = await _company_by_api_key(primary, x_api_key)
     if not company:
         raise HTTPException(status_code=401, detail="API Key inválida.")
-    return company
\ No newline at end of file
+    return company
+
+async def require_admin_token(x_admin_token: str = Header(None)) -> None:
+    """
+    Autoriza los endpoints de administración con el header X-Admin-Token, comparado con
+    ADMIN_API_TOKEN. Si la variable no está definida, los endpoints quedan deshabilitados.
+    """
+    expected = os.getenv("ADMIN_API_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=401, detail="Token de administración inválido.")
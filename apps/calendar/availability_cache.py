@@ -0,0 +1,197 @@
+"""
+Caché de disponibilidad por recurso con precarga especulativa.
+
+Mientras el flujo de agendamiento sigue pidiendo datos (nombre, fecha), el handler lanza en
+segundo plano la consulta de los eventos del recurso elegido para los próximos días. El paso
+final de confirmación consulta primero esta caché y, si está caliente, solo hace el insert.
+Las entradas viven pocos segundos (CALENDAR_PREFETCH_TTL_SECONDS) para limitar datos obsoletos.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List
+
+from cachetools import TTLCache
+from pytz import timezone as pytz_timezone
+
+from apps.calendar.calendar_integration import (
+    RESOURCE_MATCH_FIELDS,
+    UNTAGGED_FALLBACK,
+    event_blocks_resource,
+    execute_request,
+    get_calendar_service,
+    is_time_slot_available,
+    private_property_filters,
+    resource_key,
+)
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_TTL_SECONDS = int(os.getenv("CALENDAR_PREFETCH_TTL_SECONDS", "60"))
+PREFETCH_WINDOW_DAYS = int(os.getenv("CALENDAR_PREFETCH_WINDOW_DAYS", "14"))
+# Tiempo máximo que la confirmación espera una precarga en curso antes de consultar directamente.
+PREFETCH_WAIT_SECONDS = float(os.getenv("CALENDAR_PREFETCH_WAIT_SECONDS", "2"))
+
+_cache: TTLCache = TTLCache(maxsize=1024, ttl=PREFETCH_TTL_SECONDS)
+_inflight = {}
+
+
+def _cache_key(calendar_id: str, resource_name: Optional[str], company_id: Optional[int]) -> Tuple:
+    if resource_name:
+        return (calendar_id, resource_key(resource_name), company_id)
+    # Sin recurso (no se permiten citas en paralelo) cualquier evento del calendario cuenta.
+    return (calendar_id, None, None)
+
+
+def _parse_event_time(value: dict) -> Optional[datetime]:
+    """
+    Instante de start/end de un evento. Los eventos de día completo solo traen `date` (y el
+    end es exclusivo: el día siguiente), que se toma como la medianoche local de Bogotá.
+    """
+    value = value or {}
+    if value.get("dateTime"):
+        return datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+    if value.get("date"):
+        return pytz_timezone('America/Bogota').localize(datetime.fromisoformat(value["date"]))
+    return None
+
+
+def _list_busy_intervals(calendar_id, resource_name, company_id, window_start, window_end) -> List[Tuple[datetime, datetime]]:
+    """Lista (bloqueante) los intervalos ocupados del recurso en la ventana indicada."""
+    service = get_calendar_service()
+    list_kwargs = {
+        "calendarId": calendar_id,
+        "timeMin": window_start.isoformat(),
+        "timeMax": window_end.isoformat(),
+        "singleEvents": True,
+        "maxResults": 250,
+        "fields": "items(start,end),nextPageToken",
+    }
+    match_untagged = bool(resource_name) and UNTAGGED_FALLBACK
+    if match_untagged:
+        list_kwargs["fields"] = f"items(start,end,{RESOURCE_MATCH_FIELDS}),nextPageToken"
+    elif resource_name:
+        list_kwargs["privateExtendedProperty"] = private_property_filters(
+            resource_name=resource_name, company_id=company_id
+        )
+
+    busy = []
+    page_token = None
+    while True:
+        page = execute_request(service.events().list(pageToken=page_token, **list_kwargs), "prefetch")
+        for event in page.get("items", []):
+            if match_untagged and not event_blocks_resource(event, resource_name, company_id):
+                continue
+            start = _parse_event_time(event.get("start"))
+            end = _parse_event_time(event.get("end"))
+            if start and end:
+                busy.append((start, end))
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return busy
+
+
+async def _prefetch(key, calendar_id, resource_name, company_id) -> None:
+    window_start = datetime.now(pytz_timezone('America/Bogota'))
+    window_end = window_start + timedelta(days=PREFETCH_WINDOW_DAYS)
+    try:
+        busy = await asyncio.to_thread(
+            _list_busy_intervals, calendar_id, resource_name, company_id, window_start, window_end
+        )
+        _cache[key] = {"window_start": window_start, "window_end": window_end, "busy": busy}
+        logger.info(f"Disponibilidad precargada para {key[1] or calendar_id}: {len(busy)} eventos.")
+    except Exception as e:
+        logger.warning(f"No se pudo precargar la disponibilidad de {key[1] or calendar_id}: {e}")
+
+
+def prefetch_availability(calendar_id: str, resource_name: str = None, company_id: int = None) -> None:
+    """
+    Lanza en segundo plano la consulta de eventos del recurso si no hay datos frescos ni una
+    consulta en curso. No bloquea: el resultado queda en la caché para el paso de confirmación.
+    """
+    if not calendar_id:
+        return
+    key = _cache_key(calendar_id, resource_name, company_id)
+    if key in _cache or key in _inflight:
+        return
+    task = asyncio.create_task(_prefetch(key, calendar_id, resource_name, company_id))
+    _inflight[key] = task
+    task.add_done_callback(lambda _: _inflight.pop(key, None))
+
+
+async def _cached_availability(key, start_datetime: datetime, end_datetime: datetime) -> Optional[bool]:
+    """Responde desde la caché, o None si no hay datos que cubran el rango pedido."""
+    entry = _cache.get(key)
+    if entry is None and key in _inflight:
+        try:
+            await asyncio.wait_for(asyncio.shield(_inflight[key]), timeout=PREFETCH_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            return None
+        entry = _cache.get(key)
+    if entry is None:
+        return None
+    if start_datetime < entry["window_start"] or end_datetime > entry["window_end"]:
+        return None
+    return not any(
+        busy_start < end_datetime and start_datetime < busy_end
+        for busy_start, busy_end in entry["busy"]
+    )
+
+
+async def is_time_slot_available_cached(
+    calendar_id: str,
+    start_datetime: datetime,
+    end_datetime: datetime,
+    resource_name: str = None,
+    allow_parallel_appointments: bool = True,
+    company_id: int = None
+) -> bool:
+    """
+    Igual que is_time_slot_available, pero responde desde la caché precargada cuando cubre
+    el rango pedido; si no, consulta Google Calendar directamente.
+    """
+    localized_start, localized_end = start_datetime, end_datetime
+    if localized_start.tzinfo is None:
+        bogota_tz = pytz_timezone('America/Bogota')
+        localized_start = bogota_tz.localize(localized_start)
+        localized_end = bogota_tz.localize(localized_end)
+
+    key = _cache_key(calendar_id, resource_name if allow_parallel_appointments else None, company_id)
+    cached = await _cached_availability(key, localized_start, localized_end)
+    if cached is not None:
+        return cached
+
+    return await is_time_slot_available(
+        calendar_id,
+        start_datetime,
+        end_datetime,
+        resource_name=resource_name,
+        allow_parallel_appointments=allow_parallel_appointments,
+        company_id=company_id
+    )
+
+
+def record_created_event(
+    calendar_id: str,
+    start_datetime: datetime,
+    end_datetime: datetime,
+    resource_name: str = None,
+    company_id: int = None
+) -> None:
+    """Añade un evento recién creado a las entradas en caché afectadas (del recurso y del calendario)."""
+    if start_datetime.tzinfo is None:
+        bogota_tz = pytz_timezone('America/Bogota')
+        start_datetime = bogota_tz.localize(start_datetime)
+        end_datetime = bogota_tz.localize(end_datetime)
+    for key in {_cache_key(calendar_id, resource_name, company_id), _cache_key(calendar_id, None, None)}:
+        entry = _cache.get(key)
+        if entry is not None:
+            entry["busy"].append((start_datetime, end_datetime))
+
+
+def invalidate_calendar(calendar_id: str) -> None:
+    """Descarta todas las entradas en caché de un calendario (p. ej. tras cancelar una cita)."""
+    for key in [k for k in list(_cache.keys()) if k[0] == calendar_id]:
+        _cache.pop(key, None)
@@ -0,0 +1,404 @@
+"""
+Operaciones masivas sobre Google Calendar (cancelar, mover o crear muchos eventos).
+
+Usa el endpoint batch de la API de Calendar: las operaciones se agrupan en lotes de
+hasta BATCH_CHUNK_SIZE peticiones, cada lote viaja en una sola petición HTTP y se
+ejecuta en un hilo para no bloquear el event loop. Cada operación reporta su propio
+resultado, y opcionalmente se notifica por WhatsApp a los usuarios afectados.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, date, time as dt_time, timedelta
+from typing import List, Dict, Any, Optional
+
+from googleapiclient.errors import HttpError
+from pytz import timezone as pytz_timezone
+
+from apps.calendar.calendar_integration import (
+    UNTAGGED_FALLBACK,
+    event_blocks_resource,
+    execute_request,
+    get_calendar_service,
+    build_event_body,
+    private_property_filters,
+)
+
+logger = logging.getLogger(__name__)
+
+# Límite de peticiones por lote que acepta el endpoint batch de Google Calendar.
+BATCH_CHUNK_SIZE = 50
+
+# Mensajes por defecto para notificar a los usuarios afectados.
+DEFAULT_CANCEL_NOTIFICATION = (
+    "Hola, lamentamos informarte que tu cita del {fecha} a las {hora} fue cancelada. "
+    "Escríbenos para reprogramarla."
+)
+DEFAULT_MOVE_NOTIFICATION = (
+    "Hola, tu cita fue reprogramada para el {fecha} a las {hora}. "
+    "Si no te queda bien, escríbenos para buscar otro horario."
+)
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _event_start(event: Dict[str, Any]) -> Optional[datetime]:
+    start = (event or {}).get("start", {})
+    value = start.get("dateTime")
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _event_user_phone(event: Dict[str, Any]) -> Optional[str]:
+    return (event or {}).get("extendedProperties", {}).get("private", {}).get("user_phone")
+
+
+def _error_message(exception: Exception) -> str:
+    if isinstance(exception, HttpError):
+        try:
+            return exception.content.decode()
+        except Exception:
+            pass
+    return str(exception)
+
+
+def _execute_chunk(service, operations: List[Dict[str, Any]]) -> None:
+    """
+    Ejecuta un lote de operaciones en una sola petición batch (bloqueante).
+    Cada operación es un dict con 'request' (HttpRequest sin ejecutar); se le añaden
+    las claves 'response' y 'error' con el resultado individual.
+    """
+    def callback(request_id, response, exception):
+        operation = operations[int(request_id)]
+        operation["response"] = response
+        operation["error"] = exception
+
+    batch = service.new_batch_http_request(callback=callback)
+    for index, operation in enumerate(operations):
+        batch.add(operation["request"], request_id=str(index))
+    execute_request(batch, "batch")
+
+
+async def _run_batched(service, operations: List[Dict[str, Any]]) -> None:
+    """
+    Ejecuta las operaciones en lotes de BATCH_CHUNK_SIZE. Si un lote falla completo
+    (error de red, autenticación, etc.) se marca el error en cada una de sus operaciones.
+    """
+    for chunk in _chunks(operations, BATCH_CHUNK_SIZE):
+        try:
+            await asyncio.to_thread(_execute_chunk, service, chunk)
+        except Exception as e:
+            logger.error(f"Error ejecutando lote de {len(chunk)} operaciones de calendario: {e}")
+            for operation in chunk:
+                if "error" not in operation:
+                    operation["response"] = None
+                    operation["error"] = e
+
+
+def _results(operations: List[Dict[str, Any]], operation_name: str) -> List[Dict[str, Any]]:
+    results = []
+    for operation in operations:
+        error = operation.get("error")
+        response = operation.get("response") or {}
+        event = operation.get("event") or {}
+        results.append({
+            "operation": operation_name,
+            "event_id": response.get("id") or event.get("id"),
+            "status": "error" if error else "success",
+            "message": _error_message(error) if error else "",
+            "user_phone": _event_user_phone(response) or _event_user_phone(event),
+            "start": _event_start(response) or _event_start(event),
+        })
+    return results
+
+
+async def _sync_appointments(results: List[Dict[str, Any]], company_id: int = None) -> None:
+    """Refleja en la tabla appointments las cancelaciones y reprogramaciones exitosas."""
+    from apps.dashboard.rollups import record_appointment_changes
+    from apps.whatsapp.appointment_repository import (
+        cancel_appointments_by_event_ids,
+        reschedule_appointment_by_event_id,
+    )
+    from db.database import get_db_session
+
+    succeeded = [r for r in results if r["status"] == "success" and r.get("event_id")]
+    if not succeeded:
+        return
+    try:
+        async with get_db_session() as session:
+            cancelled = [r["event_id"] for r in succeeded if r["operation"] == "cancel"]
+            cancelled_by_company = await cancel_appointments_by_event_ids(session, cancelled, company_id=company_id)
+            for affected_company in sorted(cancelled_by_company):
+                await record_appointment_changes(
+                    session, affected_company, cancellations=cancelled_by_company[affected_company]
+                )
+            for result in succeeded:
+                if result["operation"] == "move" and result.get("start"):
+                    await reschedule_appointment_by_event_id(session, result["event_id"], result["start"])
+            await session.commit()
+    except Exception as e:
+        logger.error(f"No se pudieron actualizar las citas tras la operación masiva: {e}", exc_info=True)
+
+
+async def list_resource_events(
+    calendar_id: str,
+    resource_name: str,
+    time_min: datetime,
+    time_max: datetime,
+    company_id: int = None
+) -> List[Dict[str, Any]]:
+    """
+    Lista (paginando) los eventos de un recurso en un rango de tiempo, filtrando del lado
+    del servidor por las propiedades privadas que escribe create_calendar_event. Con
+    CALENDAR_UNTAGGED_FALLBACK se listan todos los eventos del rango y se filtran con
+    event_blocks_resource, como la disponibilidad: así se incluyen los eventos sin etiquetar.
+    """
+    service = get_calendar_service()
+    tz = pytz_timezone('America/Bogota')
+    if time_min.tzinfo is None:
+        time_min = tz.localize(time_min)
+    if time_max.tzinfo is None:
+        time_max = tz.localize(time_max)
+
+    list_kwargs = {
+        "calendarId": calendar_id,
+        "timeMin": time_min.isoformat(),
+        "timeMax": time_max.isoformat(),
+        "singleEvents": True,
+        "orderBy": 'startTime',
+        "maxResults": 250,
+    }
+    if not UNTAGGED_FALLBACK:
+        list_kwargs["privateExtendedProperty"] = private_property_filters(
+            resource_name=resource_name, company_id=company_id
+        )
+
+    events = []
+    page_token = None
+    while True:
+        request = service.events().list(pageToken=page_token, **list_kwargs)
+        page = await asyncio.to_thread(execute_request, request, "list")
+        items = page.get('items', [])
+        if UNTAGGED_FALLBACK:
+            items = [event for event in items if event_blocks_resource(event, resource_name, company_id)]
+        events.extend(items)
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return events
+
+
+async def bulk_cancel_events(
+    calendar_id: str,
+    events: List[Any],
+    notify: bool = False,
+    from_number: str = None,
+    notification_message: str = DEFAULT_CANCEL_NOTIFICATION,
+    company_id: int = None
+) -> List[Dict[str, Any]]:
+    """
+    Cancela (elimina) muchos eventos usando peticiones batch.
+
+    Args:
+        events: Eventos tal como los devuelve la API (dicts con 'id') o solo sus IDs.
+                Con los dicts completos se conoce el teléfono del usuario para notificarlo.
+        notify: Si es True, notifica por WhatsApp a los usuarios de las citas canceladas.
+        from_number: Número de WhatsApp de la empresa desde el que se notifica.
+        company_id: Empresa dueña del calendario: acota las citas que se actualizan y queda en
+                    las notificaciones encoladas.
+
+    Returns:
+        Lista con un resultado por evento: {'operation', 'event_id', 'status', 'message', 'user_phone', 'start'}.
+    """
+    service = get_calendar_service()
+    operations = []
+    for event in events:
+        event = event if isinstance(event, dict) else {"id": event}
+        operations.append({
+            "event": event,
+            "request": service.events().delete(calendarId=calendar_id, eventId=event["id"]),
+        })
+
+    await _run_batched(service, operations)
+    results = _results(operations, "cancel")
+    _log_summary("cancelación", results)
+    await _sync_appointments(results, company_id=company_id)
+
+    if notify:
+        await notify_affected_users(results, notification_message, from_number, company_id=company_id)
+    return results
+
+
+async def bulk_move_events(
+    calendar_id: str,
+    moves: List[Dict[str, Any]],
+    notify: bool = False,
+    from_number: str = None,
+    notification_message: str = DEFAULT_MOVE_NOTIFICATION,
+    company_id: int = None
+) -> List[Dict[str, Any]]:
+    """
+    Mueve muchos eventos a un nuevo horario usando peticiones batch.
+
+    Args:
+        moves: Lista de dicts {'event': dict o 'event_id': str, 'start': datetime, 'end': datetime}.
+        notify: Si es True, notifica a cada usuario su nuevo horario.
+        company_id: Como en bulk_cancel_events.
+    """
+    service = get_calendar_service()
+    operations = []
+    for move in moves:
+        event = move.get("event") or {"id": move["event_id"]}
+        body = build_event_body(None, None, move["start"], move["end"])
+        operations.append({
+            "event": event,
+            "request": service.events().patch(
+                calendarId=calendar_id,
+                eventId=event["id"],
+                body={"start": body["start"], "end": body["end"]}
+            ),
+        })
+
+    await _run_batched(service, operations)
+    results = _results(operations, "move")
+    _log_summary("reprogramación", results)
+    await _sync_appointments(results, company_id=company_id)
+
+    if notify:
+        await notify_affected_users(results, notification_message, from_number, company_id=company_id)
+    return results
+
+
+async def bulk_create_events(calendar_id: str, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Crea muchos eventos usando peticiones batch. NO verifica disponibilidad.
+
+    Args:
+        events: Lista de dicts con los argumentos de build_event_body:
+                summary, description, start, end y opcionalmente resource_name, company_id, user_phone.
+    """
+    service = get_calendar_service()
+    operations = []
+    for event in events:
+        body = build_event_body(
+            event.get("summary"),
+            event.get("description"),
+            event["start"],
+            event["end"],
+            resource_name=event.get("resource_name"),
+            company_id=event.get("company_id"),
+            user_phone=event.get("user_phone"),
+        )
+        operations.append({
+            "event": body,
+            "request": service.events().insert(calendarId=calendar_id, body=body),
+        })
+
+    await _run_batched(service, operations)
+    results = _results(operations, "create")
+    _log_summary("creación", results)
+    return results
+
+
+async def cancel_resource_day(
+    calendar_id: str,
+    resource_name: str,
+    day: date,
+    company_id: int = None,
+    notify: bool = False,
+    from_number: str = None,
+    notification_message: str = DEFAULT_CANCEL_NOTIFICATION
+) -> List[Dict[str, Any]]:
+    """
+    Cancela todas las citas de un recurso en un día (p. ej. incapacidad de un doctor).
+    """
+    time_min = datetime.combine(day, dt_time.min)
+    time_max = time_min + timedelta(days=1)
+    events = await list_resource_events(calendar_id, resource_name, time_min, time_max, company_id=company_id)
+    if not events:
+        logger.info(f"No hay citas de '{resource_name}' para cancelar el {day.isoformat()}.")
+        return []
+    return await bulk_cancel_events(
+        calendar_id,
+        events,
+        notify=notify,
+        from_number=from_number,
+        notification_message=notification_message,
+        company_id=company_id
+    )
+
+
+def _log_summary(operation_label: str, results: List[Dict[str, Any]]) -> None:
+    failed = sum(1 for r in results if r["status"] == "error")
+    logger.info(
+        f"Operación masiva de {operation_label}: {len(results) - failed} exitosas, {failed} con error."
+    )
+
+
+async def notify_affected_users(
+    results: List[Dict[str, Any]],
+    message_template: str,
+    from_number: str = None,
+    company_id: int = None
+) -> int:
+    """
+    Encola una notificación por WhatsApp para cada usuario con operación exitosa.
+    El envío lo hace el worker de apps/whatsapp/outbound_sender.py, que respeta el límite de
+    throughput por remitente y reintenta los errores transitorios. Retorna el número de
+    notificaciones encoladas.
+
+    Los eventos sin user_phone (anteriores a las etiquetas) toman el teléfono de la cita
+    guardada con ese event_id. Cada notificación lleva la idempotency_key
+    bulk:<operación>:<event_id>:<inicio>, así que repetir la misma operación masiva no vuelve
+    a notificar (una nueva reprogramación del mismo evento sí, porque cambia el inicio).
+    """
+    from sqlalchemy import select
+
+    from apps.whatsapp.outbound_sender import enqueue_messages, wake_outbound_worker
+    from db.database import get_db_session
+    from db.models.appointment import Appointment
+
+    succeeded = [r for r in results if r["status"] == "success" and r.get("event_id")]
+    if not succeeded:
+        return 0
+
+    async with get_db_session() as session:
+        missing = [r["event_id"] for r in succeeded if not r.get("user_phone")]
+        phones = {}
+        if missing:
+            stmt = select(Appointment.event_id, Appointment.client_phone_number).where(Appointment.event_id.in_(missing))
+            if company_id is not None:
+                stmt = stmt.where(Appointment.company_id == company_id)
+            phones = dict((await session.execute(stmt)).all())
+
+        messages = []
+        for result in succeeded:
+            to_number = result.get("user_phone") or phones.get(result["event_id"])
+            if not to_number:
+                continue
+            start = result.get("start")
+            messages.append({
+                "to_number": to_number,
+                "body": message_template.format(
+                    fecha=start.strftime("%d/%m/%Y") if start else "",
+                    hora=start.strftime("%H:%M") if start else "",
+                ),
+                "from_number": from_number,
+                "company_id": company_id,
+                "idempotency_key": f"bulk:{result['operation']}:{result['event_id']}"
+                                   + (f":{start:%Y%m%dT%H%M}" if start else ""),
+            })
+        if not messages:
+            return 0
+        queued = await enqueue_messages(session, messages)
+        await session.commit()
+    wake_outbound_worker()
+
+    logger.info(f"Notificaciones encoladas para usuarios afectados: {queued}/{len(messages)}.")
+    return queued
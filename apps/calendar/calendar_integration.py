@@ -1,5 +1,6 @@
 import os
 import logging
+import time
 import unicodedata
 from datetime import datetime
 from google.oauth2 import service_account
@@ -7,11 +8,22 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from pytz import timezone as pytz_timezone
 
+from apps.monitoring.metrics import record_calendar_call
+from apps.monitoring.tracing import span
+
 logger = logging.getLogger(__name__)
 
 SCOPES = ['https://www.googleapis.com/auth/calendar.events']
 SERVICE_ACCOUNT_FILE = '/app/google_service_account.json'
 
+# Los eventos creados antes de etiquetarlos con extendedProperties.private no tienen
+# resource_id: mientras no se ejecute tag_calendar_events.py, la disponibilidad por recurso
+# también los compara por nombre en summary/description. Tras el backfill, poner en false
+# para volver al filtro del lado del servidor.
+UNTAGGED_FALLBACK = os.getenv("CALENDAR_UNTAGGED_FALLBACK", "true").strip().lower() in ("1", "true", "yes", "si", "sí", "on")
+# Campos necesarios para decidir con event_blocks_resource.
+RESOURCE_MATCH_FIELDS = "summary,description,extendedProperties/private"
+
 def get_calendar_service():
     try:
         creds = service_account.Credentials.from_service_account_file(
@@ -24,76 +36,205 @@ def get_calendar_service():
         logger.error(f"Error al autenticar con Google Calendar: {e}")
         raise
 
+def execute_request(request, operation: str):
+    """Ejecuta una petición de la API (bloqueante) registrando su latencia y resultado."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(f"calendar.{operation}"):
+            response = request.execute()
+        outcome = "ok"
+        return response
+    finally:
+        record_calendar_call(operation, time.perf_counter() - started, outcome)
+
 def normalize_name(name):
     """Normaliza el nombre eliminando acentos y pasando a minúsculas."""
     if not name:
         return ""
     return unicodedata.normalize('NFD', name).encode('ascii', 'ignore').decode('utf-8').lower().strip()
 
+def resource_key(name):
+    """
+    Identificador estable de un recurso (doctor, estilista, etc.) para etiquetar eventos.
+    Ej: "María Martinez" -> "maria-martinez".
+    """
+    return "-".join(normalize_name(name).split())
+
+def private_property_filters(resource_name=None, company_id=None, user_phone=None) -> list:
+    """
+    Construye los filtros 'privateExtendedProperty' (formato 'clave=valor') para events().list.
+    Google Calendar combina varios filtros con AND.
+    """
+    filters = []
+    if resource_name:
+        filters.append(f"resource_id={resource_key(resource_name)}")
+    if company_id is not None:
+        filters.append(f"company_id={company_id}")
+    if user_phone:
+        filters.append(f"user_phone={user_phone}")
+    return filters
+
+def event_blocks_resource(event: dict, resource_name: str, company_id: int = None) -> bool:
+    """
+    True si el evento ocupa al recurso. Los eventos etiquetados se comparan por resource_id (y
+    company_id); los que no tienen etiqueta, como antes, por el nombre en summary o description.
+    """
+    private = (event.get("extendedProperties") or {}).get("private") or {}
+    if private.get("resource_id"):
+        if company_id is not None and private.get("company_id") not in (None, str(company_id)):
+            return False
+        return private["resource_id"] == resource_key(resource_name)
+    normalized_resource = normalize_name(resource_name)
+    return (
+        normalized_resource in normalize_name(event.get("summary", ""))
+        or normalized_resource in normalize_name(event.get("description", ""))
+    )
+
+def _localize(start_datetime: datetime, end_datetime: datetime):
+    if start_datetime.tzinfo is None:
+        bogota_tz = pytz_timezone('America/Bogota')
+        start_datetime = bogota_tz.localize(start_datetime)
+        end_datetime = bogota_tz.localize(end_datetime)
+    return start_datetime, end_datetime
+
+def build_event_body(
+    summary: str,
+    description: str,
+    start_datetime: datetime,
+    end_datetime: datetime,
+    resource_name: str = None,
+    company_id: int = None,
+    user_phone: str = None
+) -> dict:
+    """
+    Construye el cuerpo de un evento de Google Calendar, incluyendo las propiedades
+    privadas (resource_id, company_id, user_phone) usadas para filtrar del lado del servidor.
+    """
+    start_datetime, end_datetime = _localize(start_datetime, end_datetime)
+    event = {
+        'summary': summary,
+        'description': description,
+        'start': {
+            'dateTime': start_datetime.isoformat(),
+            'timeZone': str(start_datetime.tzinfo),
+        },
+        'end': {
+            'dateTime': end_datetime.isoformat(),
+            'timeZone': str(end_datetime.tzinfo),
+        },
+    }
+    private_properties = {}
+    if resource_name:
+        private_properties["resource_id"] = resource_key(resource_name)
+    if company_id is not None:
+        private_properties["company_id"] = str(company_id)
+    if user_phone:
+        private_properties["user_phone"] = user_phone
+    if private_properties:
+        event['extendedProperties'] = {'private': private_properties}
+    return event
+
 async def is_time_slot_available(
     calendar_id: str,
     start_datetime: datetime,
     end_datetime: datetime,
     resource_name: str = None,
-    allow_parallel_appointments: bool = True
+    allow_parallel_appointments: bool = True,
+    company_id: int = None
 ) -> bool:
     """
     Chequea si hay disponibilidad en el calendario para ese rango de tiempo.
-    Si se permite agendar en paralelo y se pasa resource_name, solo hay conflicto si coincide el recurso.
-    Si no se permite agendar en paralelo, cualquier evento bloquea el horario.
+    Si se permite agendar en paralelo y se pasa resource_name, solo hay conflicto si coincide el recurso:
+    el filtro se hace del lado del servidor con las propiedades privadas que escribe create_calendar_event
+    (con CALENDAR_UNTAGGED_FALLBACK, en el cliente con event_blocks_resource, que también ve los
+    eventos anteriores a las etiquetas). Si no se permite agendar en paralelo, cualquier evento bloquea el horario.
     """
     service = get_calendar_service()
     if not service:
         logger.error("No se pudo conectar con el servicio de calendario.")
         return False
 
-    if start_datetime.tzinfo is None:
-        bogota_tz = pytz_timezone('America/Bogota')
-        start_datetime = bogota_tz.localize(start_datetime)
-        end_datetime = bogota_tz.localize(end_datetime)
+    start_datetime, end_datetime = _localize(start_datetime, end_datetime)
 
-    time_min = start_datetime.isoformat()
-    time_max = end_datetime.isoformat()
+    list_kwargs = {
+        "calendarId": calendar_id,
+        "timeMin": start_datetime.isoformat(),
+        "timeMax": end_datetime.isoformat(),
+        "singleEvents": True,
+        "maxResults": 1,
+        "fields": "items(id)",
+    }
+    by_resource = allow_parallel_appointments and resource_name
+    if by_resource and UNTAGGED_FALLBACK:
+        # Se traen los eventos de la ventana (pocos) para ver también los que no tienen etiqueta.
+        list_kwargs.update(maxResults=250, fields=f"items({RESOURCE_MATCH_FIELDS})")
+    elif by_resource:
+        list_kwargs["privateExtendedProperty"] = private_property_filters(
+            resource_name=resource_name, company_id=company_id
+        )
 
     try:
-        events_result = service.events().list(
-            calendarId=calendar_id,
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        events_result = execute_request(service.events().list(**list_kwargs), "check")
         events = events_result.get('items', [])
-
-        if not events:
-            return True
-
-        if allow_parallel_appointments and resource_name:
-            normalized_resource = normalize_name(resource_name)
-            for event in events:
-                summary = normalize_name(event.get('summary', ''))
-                description = normalize_name(event.get('description', ''))
-                # Compara el nombre del recurso exacto en summary o description
-                if normalized_resource in summary or normalized_resource in description:
-                    return False
-            return True
-        else:
-            # Si no se permiten citas en paralelo, cualquier evento bloquea el horario
-            return False
+        if by_resource and UNTAGGED_FALLBACK:
+            return not any(event_blocks_resource(event, resource_name, company_id) for event in events)
+        return not events
     except Exception as e:
         logger.error(f"Error al comprobar disponibilidad: {e}")
         return False
 
+async def find_user_events(
+    calendar_id: str,
+    user_phone: str,
+    company_id: int = None,
+    time_min: datetime = None,
+    max_results: int = 10
+) -> list:
+    """
+    Busca los próximos eventos agendados por un usuario, filtrando del lado del servidor
+    por las propiedades privadas 'user_phone' (y 'company_id' si se indica).
+    Retorna la lista de eventos ordenada por fecha de inicio (vacía si hay error).
+    """
+    service = get_calendar_service()
+    if not service:
+        logger.error("No se pudo conectar con el servicio de calendario.")
+        return []
+
+    if time_min is None:
+        time_min = datetime.now(pytz_timezone('America/Bogota'))
+    elif time_min.tzinfo is None:
+        time_min = pytz_timezone('America/Bogota').localize(time_min)
+
+    try:
+        events_result = execute_request(service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min.isoformat(),
+            privateExtendedProperty=private_property_filters(company_id=company_id, user_phone=user_phone),
+            singleEvents=True,
+            orderBy='startTime',
+            maxResults=max_results
+        ), "find")
+        return events_result.get('items', [])
+    except Exception as e:
+        logger.error(f"Error al buscar eventos del usuario {user_phone}: {e}")
+        return []
+
 async def create_calendar_event(
     summary: str, 
     description: str, 
     start_datetime: datetime, 
     end_datetime: datetime,
-    company_calendar_email: str 
+    company_calendar_email: str,
+    resource_name: str = None,
+    company_id: int = None,
+    user_phone: str = None
 ) -> dict:
     """
     Crea un evento en el calendario de Google utilizando la cuenta de servicio.
     NO verifica disponibilidad (esto debe hacerse antes con is_time_slot_available).
+    El recurso, la empresa y el teléfono del usuario se guardan en extendedProperties.private
+    para que las búsquedas de disponibilidad y cancelación se filtren del lado del servidor.
 
     Returns:
         dict: {'status': 'success'|'error', 'event_link': str, 'event_id': str, 'message': str}
@@ -111,24 +252,21 @@ async def create_calendar_event(
         bogota_tz = pytz_timezone('America/Bogota')
         start_datetime = bogota_tz.localize(start_datetime)
         end_datetime = bogota_tz.localize(end_datetime)
-        logger.info(f"DEBUG: Datetimes convertidos a {bogota_tz}: {start_datetime}, {end_datetime}")
+        logger.debug("Datetimes convertidos a %s: %s, %s", bogota_tz, start_datetime, end_datetime)
 
     try:
         calendar_id = company_calendar_email
-        event = {
-            'summary': summary,
-            'description': description,
-            'start': {
-                'dateTime': start_datetime.isoformat(),
-                'timeZone': str(start_datetime.tzinfo),
-            },
-            'end': {
-                'dateTime': end_datetime.isoformat(),
-                'timeZone': str(end_datetime.tzinfo),
-            },
-        }
+        event = build_event_body(
+            summary,
+            description,
+            start_datetime,
+            end_datetime,
+            resource_name=resource_name,
+            company_id=company_id,
+            user_phone=user_phone
+        )
 
-        event = service.events().insert(calendarId=calendar_id, body=event).execute()
+        event = execute_request(service.events().insert(calendarId=calendar_id, body=event), "insert")
         logger.info(f"Evento creado: {event.get('htmlLink')}")
         return {
             "status": "success",
@@ -159,7 +297,7 @@ def delete_calendar_event(calendar_id: str, event_id: str) -> bool:
     """
     try:
         service = get_calendar_service()
-        service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
+        execute_request(service.events().delete(calendarId=calendar_id, eventId=event_id), "delete")
         logger.info(f"Evento eliminado correctamente: {event_id}")
         return True
     except Exception as e:
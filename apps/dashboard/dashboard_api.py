@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Literal, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from db.database import get_db_session
+from db.database import get_db, get_read_db, read_engine
 from db.models.company import Company
 from apps.auth.auth import get_current_company
+from apps.dashboard import live_feed
+from apps.dashboard.export import MEDIA_TYPES, export_chunks, export_query, naive_utc
+from apps.dashboard.rollups import daily_stats
 import secrets
 
 router = APIRouter()
@@ -16,7 +24,7 @@ async def register_company(
     industry: str = "",
     catalog_url: str = "",
     schedule: str = "",
-    db: AsyncSession = Depends(get_db_session)
+    db: AsyncSession = Depends(get_db)
 ):
     # Evitar duplicados
     result = await db.execute(select(Company).where(Company.company_number == company_number))
@@ -47,4 +55,60 @@ async def get_company_profile(company: Company = Depends(get_current_company)):
         "catalog_url": company.catalog_url,
         "schedule": company.schedule,
         "company_number": company.company_number
-    }
\ No newline at end of file
+    }
+
+@router.get("/stats")
+async def get_company_stats(
+    days: int = Query(30, ge=1, le=366),
+    tz: str = "America/Bogota",
+    company: Company = Depends(get_current_company),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Mensajes, citas agendadas y canceladas, tasa de fallback al LLM y tiempo de respuesta (promedio y
+    mediana estimada) por día en la zona `tz`, más el total del período. Se lee solo de los
+    agregados por hora (ver apps/dashboard/rollups.py), desde la réplica si está configurada.
+    """
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=422, detail=f"Zona horaria inválida: {tz}")
+    stats = await daily_stats(db, company.id, days, zone)
+    return {"timezone": tz, **stats}
+
+@router.get("/export/{resource}")
+async def export_conversations(
+    resource: Literal["messages", "sessions"],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    session_id: Optional[int] = None,
+    company: Company = Depends(get_current_company),
+):
+    """
+    Descarga los mensajes o las sesiones de la empresa en NDJSON o CSV, filtrados por rango de
+    fechas [start, end) y opcionalmente por sesión. Se transmite con un cursor del servidor
+    sobre la réplica (si está configurada), sin cargar el resultado en memoria.
+    """
+    if start is not None and end is not None and naive_utc(start) >= naive_utc(end):
+        raise HTTPException(status_code=422, detail="start debe ser anterior a end")
+    stmt = export_query(resource, company.id, start, end, session_id)
+    return StreamingResponse(
+        export_chunks(read_engine, stmt, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{resource}-{company.id}.{format}"'},
+    )
+
+@router.get("/live")
+async def live_conversations(company: Company = Depends(get_current_company)):
+    """
+    Mensajes de la empresa en vivo por Server-Sent Events (ver apps/dashboard/live_feed.py).
+    EventSource no envía headers: el navegador debe leer el stream con fetch para pasar X-API-Key.
+    """
+    if not live_feed.LIVE_FEED_ENABLED:
+        raise HTTPException(status_code=503, detail="Feed en vivo desactivado.")
+    return StreamingResponse(
+        live_feed.sse_stream(company.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,109 @@
+"""
+Exportación del historial de conversaciones de una empresa (mensajes o sesiones) en NDJSON o CSV.
+
+Las filas se leen con un cursor del servidor (stream + yield_per) en una conexión propia del
+engine de lectura y se envían por lotes a medida que llegan: la memoria queda acotada por
+EXPORT_BATCH_SIZE y el primer byte sale sin esperar al resto de la consulta, sin importar el
+tamaño de la exportación. La conexión no es la de la dependencia de FastAPI (esa se libera
+antes de enviar la respuesta) y se cierra al terminar o si el cliente corta la descarga.
+
+Variables:
+  EXPORT_BATCH_SIZE   filas por lote leído del cursor y enviado al cliente (2000)
+"""
+
+import csv
+import io
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import select
+
+from db.json_codec import dumps
+from db.models.chat_session import ChatSession
+from db.models.messages import Message
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.chat_session_id,
+    Message.timestamp,
+    Message.direction,
+    Message.sender_phone_number,
+    Message.body,
+    Message.message_sid,
+)
+
+SESSION_COLUMNS = (
+    ChatSession.id,
+    ChatSession.user_phone_number,
+    ChatSession.status,
+    ChatSession.started_at,
+    ChatSession.last_activity,
+)
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Las columnas guardan UTC sin zona: una fecha con zona se convierte antes de comparar."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def export_query(resource: str, company_id: int, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None, session_id: Optional[int] = None):
+    """
+    Consulta de la exportación. Mensajes: los de [start, end) en orden cronológico. Sesiones:
+    las que tuvieron actividad en el rango (empezaron antes de `end` y siguieron activas
+    después de `start`), por id.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    if resource == "messages":
+        stmt = select(*MESSAGE_COLUMNS).where(Message.company_id == company_id)
+        if start is not None:
+            stmt = stmt.where(Message.timestamp >= start)
+        if end is not None:
+            stmt = stmt.where(Message.timestamp < end)
+        if session_id is not None:
+            stmt = stmt.where(Message.chat_session_id == session_id)
+        return stmt.order_by(Message.timestamp, Message.id)
+    if resource == "sessions":
+        stmt = select(*SESSION_COLUMNS).where(ChatSession.company_id == company_id)
+        if start is not None:
+            stmt = stmt.where(ChatSession.last_activity >= start)
+        if end is not None:
+            stmt = stmt.where(ChatSession.started_at < end)
+        if session_id is not None:
+            stmt = stmt.where(ChatSession.id == session_id)
+        return stmt.order_by(ChatSession.id)
+    raise ValueError(f"Recurso de exportación inválido: {resource!r} (messages o sessions)")
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def export_chunks(engine, stmt, fmt: str, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Genera la exportación por lotes de `batch_size` filas, ya codificada."""
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"Formato de exportación inválido: {fmt!r} (ndjson o csv)")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        # La cabecera sale antes de ejecutar la consulta.
+        writer.writerow([column.key for column in stmt.selected_columns])
+        yield buffer.getvalue().encode()
+
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            if fmt == "ndjson":
+                yield "".join(dumps(dict(row._mapping)) + "\n" for row in rows).encode()
+            else:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows([_csv_value(value) for value in row] for row in rows)
+                yield buffer.getvalue().encode()
@@ -0,0 +1,388 @@
+"""
+Feed en vivo de las conversaciones de una empresa por Server-Sent Events.
+
+Publicación: add_message (y el mensaje entrante del turno, ver message_handler.py) ejecuta
+pg_notify en la transacción de escritura del turno. Postgres entrega la notificación solo si
+la transacción confirma, a todos los procesos que escuchan el canal: el webhook no espera a
+ningún navegador, solo agrega una sentencia a una transacción que ya existía.
+
+Solo se publica si alguien mira el feed de la empresa: NOTIFY toma un lock global de la base
+al confirmar, y no debe serializar los commits de todos los turnos sin necesidad. Cada proceso
+con suscriptores registra (empresa, proceso) en live_feed_watchers y lo renueva mientras los
+tenga; al abrirse el primer feed de una empresa lo avisa por el canal de control. Cada proceso
+guarda en memoria las empresas vigiladas (recargadas de la tabla periódicamente y al recibir el
+aviso), así que sin nadie mirando un turno no hace ninguna consulta extra. Un feed cerrado deja
+de publicarse a lo sumo LIVE_FEED_WATCH_TTL_SECONDS después.
+
+Reparto: cada proceso mantiene una única conexión al primario con LISTEN (las réplicas no
+reciben NOTIFY) y reparte cada notificación a los suscriptores locales de la empresa. El frame
+SSE se arma una vez por evento y se comparte entre los suscriptores; sin suscriptores en el
+proceso, la notificación se descarta sin decodificarla.
+
+Cada suscriptor tiene un buffer acotado (LIVE_FEED_BUFFER eventos). Si el navegador no lee a
+tiempo, se descartan los eventos más viejos y antes del siguiente se le envía un evento `lag`
+con la cantidad perdida; lo mismo si se cayó la conexión LISTEN (los eventos de ese lapso no se
+recuperan). Un cliente lento nunca bloquea al resto ni al webhook.
+
+Eventos SSE: `message` (JSON con company_id, chat_session_id, direction, body, truncated,
+sender_phone_number, message_sid y timestamp), `lag` ({"dropped": n} o {"reconnected": true})
+y comentarios de keep-alive cada LIVE_FEED_HEARTBEAT_SECONDS. Una conexión dura a lo sumo
+LIVE_FEED_MAX_SECONDS; EventSource reconecta solo (eso también reparte los clientes entre
+workers y no retiene el apagado).
+
+Como LeaderElection (apps/jobs/scheduler.py), LISTEN necesita una conexión de sesión: no
+funciona detrás de pgbouncer en modo transacción.
+
+Variables:
+  LIVE_FEED_ENABLED            publicar y servir el feed (true)
+  LIVE_FEED_BUFFER             eventos en el buffer de cada suscriptor (100)
+  LIVE_FEED_HEARTBEAT_SECONDS  intervalo de keep-alive de la conexión SSE (15)
+  LIVE_FEED_MAX_SECONDS        duración máxima de una conexión SSE (300)
+"""
+
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Iterable, Optional, Set
+
+from sqlalchemy import Interval, bindparam, delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from apps.monitoring.metrics import LIVE_FEED_SUBSCRIBERS, record_live_feed_dropped
+from db.database import engine
+from db.json_codec import dumps, loads
+from db.models.live_feed_watcher import LiveFeedWatcher
+
+logger = logging.getLogger(__name__)
+
+LIVE_FEED_CHANNEL = "conversation_feed"
+# Aviso de que una empresa tiene un feed abierto (payload: company_id).
+LIVE_FEED_WATCH_CHANNEL = "conversation_feed_watch"
+LIVE_FEED_ENABLED = os.getenv("LIVE_FEED_ENABLED", "true").strip().lower() in ("1", "true", "yes", "si", "sí", "on")
+LIVE_FEED_BUFFER = int(os.getenv("LIVE_FEED_BUFFER", "100"))
+LIVE_FEED_HEARTBEAT_SECONDS = float(os.getenv("LIVE_FEED_HEARTBEAT_SECONDS", "15"))
+LIVE_FEED_MAX_SECONDS = float(os.getenv("LIVE_FEED_MAX_SECONDS", "300"))
+LIVE_FEED_WATCH_TTL_SECONDS = 60.0
+# Renovación de los watchers propios, recarga de los ajenos y ping de la conexión LISTEN.
+LIVE_FEED_PING_SECONDS = LIVE_FEED_WATCH_TTL_SECONDS / 3
+# El payload de NOTIFY admite menos de 8000 bytes: el texto se recorta (el evento lo indica).
+LIVE_FEED_MAX_BODY = 1000
+
+NOTIFY_STMT = text("SELECT pg_notify(:channel, :payload)")
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+
+def _build_watch_stmt():
+    stmt = pg_insert(LiveFeedWatcher).values(
+        company_id=bindparam("company_id"),
+        worker_id=bindparam("worker_id"),
+        expires_at=func.timezone("utc", func.now()) + bindparam("ttl", type_=Interval),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["company_id", "worker_id"], set_={"expires_at": stmt.excluded.expires_at},
+    )
+
+
+WATCH_STMT = _build_watch_stmt()
+
+HEARTBEAT_FRAME = b": ping\n\n"
+RETRY_FRAME = b"retry: 3000\n\n"
+
+
+def _frame(event: str, data: str) -> bytes:
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+
+# === Empresas vigiladas ===
+
+# company_id -> instante (time.monotonic) hasta el que alguien mira su feed.
+_watched: Dict[int, float] = {}
+
+
+def is_watched(company_id: int) -> bool:
+    return _watched.get(company_id, 0.0) > time.monotonic()
+
+
+def _mark_watched(company_id: int, seconds: float = LIVE_FEED_WATCH_TTL_SECONDS) -> None:
+    _watched[company_id] = max(_watched.get(company_id, 0.0), time.monotonic() + seconds)
+
+
+async def _renew_watchers(company_ids: Iterable[int], announce: Iterable[int] = ()) -> None:
+    """
+    Renueva los watchers de este proceso, quita los de empresas sin suscriptores locales,
+    avisa por el canal de control las empresas de `announce` y recarga las vigiladas.
+    """
+    company_ids = list(company_ids)
+    db_now = func.timezone("utc", func.now())
+    async with engine.begin() as conn:
+        if company_ids:
+            ttl = timedelta(seconds=LIVE_FEED_WATCH_TTL_SECONDS)
+            await conn.execute(WATCH_STMT, [
+                {"company_id": company_id, "worker_id": WORKER_ID, "ttl": ttl} for company_id in company_ids
+            ])
+        await conn.execute(delete(LiveFeedWatcher).where(
+            (LiveFeedWatcher.expires_at < db_now)
+            | ((LiveFeedWatcher.worker_id == WORKER_ID) & LiveFeedWatcher.company_id.notin_(company_ids))
+        ))
+        for company_id in announce:
+            await conn.execute(NOTIFY_STMT, {"channel": LIVE_FEED_WATCH_CHANNEL, "payload": str(company_id)})
+        result = await conn.execute(
+            select(LiveFeedWatcher.company_id, func.max(LiveFeedWatcher.expires_at) - db_now)
+            .group_by(LiveFeedWatcher.company_id)
+        )
+        rows = result.all()
+    now = time.monotonic()
+    _watched.clear()
+    _watched.update((company_id, now + remaining.total_seconds()) for company_id, remaining in rows)
+
+
+# === Publicación ===
+
+async def publish_message(db_session, company_id: int, chat_session_id: int, direction: str, body: str,
+                          sender_phone_number: str, message_sid: str, timestamp: Optional[datetime] = None) -> None:
+    """
+    Publica un mensaje en el feed; se entrega al confirmar la transacción de `db_session`. Si
+    nadie mira el feed de la empresa no hace nada (ni siquiera una consulta).
+    """
+    if not LIVE_FEED_ENABLED or not is_watched(company_id):
+        return
+    payload = dumps({
+        "company_id": company_id,
+        "chat_session_id": chat_session_id,
+        "direction": direction,
+        "body": body[:LIVE_FEED_MAX_BODY],
+        "truncated": len(body) > LIVE_FEED_MAX_BODY,
+        "sender_phone_number": sender_phone_number,
+        "message_sid": message_sid,
+        "timestamp": timestamp,
+    })
+    await db_session.execute(NOTIFY_STMT, {"channel": LIVE_FEED_CHANNEL, "payload": payload})
+
+
+# === Reparto en el proceso ===
+
+class Subscription:
+    """Conexión SSE de una empresa, con buffer acotado que descarta los eventos más viejos."""
+
+    def __init__(self, company_id: int, buffer_size: int = LIVE_FEED_BUFFER):
+        self.company_id = company_id
+        self.dropped = 0
+        self.reconnected = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(buffer_size, 1))
+
+    def offer(self, frame: Optional[bytes]) -> None:
+        """Encola sin esperar nunca; None cierra la suscripción."""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            record_live_feed_dropped()
+        self._queue.put_nowait(frame)
+
+    async def next_frame(self, timeout: float) -> Optional[bytes]:
+        """Siguiente frame, un `lag` si se perdieron eventos, keep-alive al vencer `timeout` o None al cerrar."""
+        if self.reconnected:
+            self.reconnected = False
+            return _frame("lag", '{"reconnected":true}')
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            return _frame("lag", dumps({"dropped": dropped}))
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return HEARTBEAT_FRAME
+
+
+class LiveFeedHub:
+    def __init__(self, buffer_size: int = LIVE_FEED_BUFFER):
+        self.buffer_size = buffer_size
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def companies(self) -> Set[int]:
+        return set(self._subscribers)
+
+    def subscribe(self, company_id: int) -> Subscription:
+        subscription = Subscription(company_id, self.buffer_size)
+        self._subscribers.setdefault(company_id, set()).add(subscription)
+        LIVE_FEED_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.company_id)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.company_id]
+        LIVE_FEED_SUBSCRIBERS.dec()
+
+    def dispatch(self, company_id: int, frame: bytes) -> int:
+        """Entrega el frame a los suscriptores de la empresa. Retorna a cuántos."""
+        subscribers = self._subscribers.get(company_id, ())
+        for subscription in subscribers:
+            subscription.offer(frame)
+        return len(subscribers)
+
+    def mark_reconnected(self) -> None:
+        for subscribers in self._subscribers.values():
+            for subscription in subscribers:
+                subscription.reconnected = True
+
+    def close(self) -> None:
+        for subscribers in self._subscribers.values():
+            for subscription in subscribers:
+                subscription.offer(None)
+
+
+hub = LiveFeedHub()
+
+
+async def sse_stream(company_id: int, feed: LiveFeedHub = hub, heartbeat: float = LIVE_FEED_HEARTBEAT_SECONDS,
+                     max_seconds: float = LIVE_FEED_MAX_SECONDS) -> AsyncIterator[bytes]:
+    """
+    Cuerpo de la respuesta SSE. La suscripción se crea al empezar a enviar y se quita al
+    terminar, también si el cliente se desconecta (la respuesta cancela el generador).
+    """
+    first = company_id not in feed.companies()
+    subscription = feed.subscribe(company_id)
+    deadline = time.monotonic() + max_seconds
+    try:
+        if first:
+            # Desde ahora los turnos de la empresa publican (en este y en los demás procesos).
+            _mark_watched(company_id)
+            try:
+                await _renew_watchers(feed.companies(), announce=[company_id])
+            except Exception as e:
+                logger.error("No se pudo registrar el feed de la empresa %s: %s", company_id, e)
+        yield RETRY_FRAME
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            frame = await subscription.next_frame(min(heartbeat, remaining))
+            if frame is None:
+                return
+            yield frame
+    finally:
+        feed.unsubscribe(subscription)
+
+
+# === LISTEN ===
+
+class LiveFeedListener:
+    """Conexión LISTEN dedicada al canal del feed, que se reconecta con backoff si se cae."""
+
+    def __init__(self, feed: LiveFeedHub = hub, bind=engine):
+        self.feed = feed
+        self._engine = bind
+        self._task: Optional[asyncio.Task] = None
+
+    def _on_watch(self, connection, pid, channel, payload: str) -> None:
+        try:
+            _mark_watched(int(payload))
+        except ValueError:
+            logger.warning("Aviso de feed inválido: %r", payload)
+
+    async def _renew(self) -> None:
+        try:
+            await _renew_watchers(self.feed.companies())
+        except Exception as e:
+            logger.error("No se pudieron renovar los watchers del feed en vivo: %s", e)
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        if not self.feed.has_subscribers():
+            return
+        try:
+            company_id = loads(payload)["company_id"]
+        except Exception as e:
+            logger.warning("Notificación del feed inválida: %s", e)
+            return
+        self.feed.dispatch(company_id, _frame("message", payload))
+
+    async def _listen(self) -> None:
+        conn = await self._engine.connect()
+        try:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            raw = await conn.get_raw_connection()
+            lost = asyncio.Event()
+            # asyncpg avisa apenas se cierra la conexión; el ping cubre las caídas silenciosas.
+            raw.driver_connection.add_termination_listener(lambda _connection: lost.set())
+            await raw.driver_connection.add_listener(LIVE_FEED_CHANNEL, self._on_notify)
+            await raw.driver_connection.add_listener(LIVE_FEED_WATCH_CHANNEL, self._on_watch)
+            logger.info("Feed en vivo escuchando el canal %s.", LIVE_FEED_CHANNEL)
+            # Avisos perdidos mientras no se escuchaba: se recargan de la tabla.
+            await self._renew()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), LIVE_FEED_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    await conn.execute(text("SELECT 1"))
+                    await self._renew()
+            raise ConnectionError("la conexión LISTEN se cerró")
+        finally:
+            # Una conexión con LISTEN no vuelve al pool.
+            try:
+                await conn.invalidate()
+            except Exception:
+                pass
+
+    async def _run(self) -> None:
+        delay = 1.0
+        connected_once = False
+        while True:
+            started = time.monotonic()
+            try:
+                if connected_once:
+                    # Lo notificado mientras no había conexión se perdió.
+                    self.feed.mark_reconnected()
+                connected_once = True
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Se perdió la conexión LISTEN del feed en vivo: %s", e)
+            if time.monotonic() - started > LIVE_FEED_PING_SECONDS:
+                delay = 1.0
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="live-feed-listener")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.feed.close()
+        try:
+            await _renew_watchers(())
+        except Exception as e:
+            logger.warning("No se pudieron quitar los watchers del feed en vivo: %s", e)
+
+
+_listener: Optional[LiveFeedListener] = None
+
+
+def start_live_feed() -> Optional[LiveFeedListener]:
+    global _listener
+    if not LIVE_FEED_ENABLED:
+        logger.info("Feed en vivo desactivado (LIVE_FEED_ENABLED).")
+        return None
+    _listener = LiveFeedListener()
+    _listener.start()
+    return _listener
+
+
+async def stop_live_feed() -> None:
+    global _listener
+    if _listener is not None:
+        await _listener.stop()
+        _listener = None
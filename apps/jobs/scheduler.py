@@ -0,0 +1,338 @@
+"""
+Programador de tareas periódicas en segundo plano (purga de mensajes, mantenimiento, etc.).
+
+Cada trabajo corre en su propia tarea de asyncio, guardada por el JobScheduler para poder
+cancelarla al apagar. Se programa por intervalo (segundos) o por expresión cron de 5 campos
+en UTC ("min hora día mes día_semana", con *, listas, rangos y pasos, o @hourly/@daily/
+@weekly/@monthly), con un jitter aleatorio opcional para que las réplicas no lleguen juntas
+a la base de datos.
+
+Elección de líder: con varias réplicas o workers de uvicorn, un trabajo con leader_only solo
+corre en el proceso que tiene su advisory lock de Postgres (pg_try_advisory_lock sobre
+"job:<nombre>"). Los locks se toman en una conexión dedicada en autocommit que el proceso
+mantiene abierta: si el proceso muere o la conexión se cae, Postgres libera los locks y otro
+proceso los toma en su siguiente turno. Los locks de sesión no funcionan detrás de pgbouncer
+en modo transacción (usar una conexión directa al primario).
+
+Al apagar (stop) se dejan de programar ejecuciones, se espera hasta JOB_DRAIN_SECONDS a que
+terminen las que están en curso, se cancelan las restantes y se liberan los locks.
+
+Métricas: scheduled_job_runs_total{job, outcome}, scheduled_job_duration_seconds{job} y
+scheduled_job_last_success_timestamp_seconds{job} (ver apps/monitoring/metrics.py).
+
+Variables:
+  JOBS_ENABLED        iniciar el programador con la app (true)
+  JOB_DRAIN_SECONDS   espera a los trabajos en curso al apagar (30)
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import text
+
+from apps.monitoring.metrics import record_job_run
+from db.database import engine
+
+logger = logging.getLogger(__name__)
+
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "30"))
+
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# === Cron ===
+
+def _parse_cron_field(spec: str, low: int, high: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in spec.split(","):
+        base, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            start, end = (int(v) for v in base.split("-", 1))
+        else:
+            start = int(base)
+            end = high if step_text else start
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"Campo cron fuera de rango: {part!r} ({low}-{high})")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Expresión cron de 5 campos evaluada en UTC."""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"La expresión cron debe tener 5 campos: {expression!r}")
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        # 0 y 7 son domingo.
+        self.weekdays = {d % 7 for d in _parse_cron_field(fields[4], 0, 7)}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        # Como en cron: si se restringen ambos, basta con que coincida uno.
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Primer instante (al minuto) estrictamente posterior a `moment`."""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = candidate.replace(year=candidate.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"La expresión cron {self.expression!r} nunca se cumple.")
+
+
+# === Trabajos ===
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], Awaitable[None]]
+    interval: Optional[float] = None
+    cron: Optional[CronSchedule] = None
+    jitter: float = 0.0
+    leader_only: bool = True
+    run_at_start: bool = False
+    timeout: Optional[float] = None
+    lock_key: int = field(init=False)
+
+    def __post_init__(self):
+        if (self.interval is None) == (self.cron is None):
+            raise ValueError(f"El trabajo {self.name!r} necesita interval o cron (uno de los dos).")
+        digest = hashlib.sha256(f"job:{self.name}".encode()).digest()
+        self.lock_key = int.from_bytes(digest[:8], "big", signed=True)
+
+    def next_run(self, last_start: Optional[datetime], now: datetime) -> datetime:
+        if self.cron is not None:
+            scheduled = self.cron.next_after(now)
+        elif last_start is None:
+            scheduled = now + timedelta(seconds=self.interval)
+        else:
+            # Sin deriva: se cuenta desde el inicio anterior; si la ejecución se pasó, ya.
+            scheduled = max(last_start + timedelta(seconds=self.interval), now)
+        return scheduled + timedelta(seconds=random.uniform(0, self.jitter))
+
+
+class LeaderElection:
+    """Advisory locks de sesión en una conexión dedicada (uno por trabajo)."""
+
+    def __init__(self, bind=engine):
+        self._engine = bind
+        self._conn = None
+        self._held: Set[int] = set()
+        self._lock = asyncio.Lock()
+
+    async def _connection(self):
+        if self._conn is None:
+            conn = await self._engine.connect()
+            self._conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        return self._conn
+
+    async def _reset(self) -> None:
+        conn, self._conn = self._conn, None
+        lost = len(self._held)
+        self._held.clear()
+        if lost:
+            logger.warning("Se perdió la conexión de elección de líder; se liberaron %d locks.", lost)
+        if conn is not None:
+            try:
+                await conn.invalidate()
+            except Exception:
+                pass
+
+    async def acquire(self, key: int) -> bool:
+        """True si este proceso es (o acaba de volverse) líder del trabajo."""
+        async with self._lock:
+            try:
+                conn = await self._connection()
+                if key in self._held:
+                    # Los locks viven lo que la conexión: se verifica que siga abierta.
+                    await conn.execute(text("SELECT 1"))
+                    return True
+                acquired = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key})).scalar()
+            except Exception as e:
+                logger.error("Error en la elección de líder: %s", e)
+                await self._reset()
+                return False
+            if acquired:
+                self._held.add(key)
+            return bool(acquired)
+
+    async def release_all(self) -> None:
+        async with self._lock:
+            if self._conn is None:
+                return
+            try:
+                await self._conn.execute(text("SELECT pg_advisory_unlock_all()"))
+                await self._conn.close()
+            except Exception as e:
+                logger.warning("No se pudieron liberar los locks de líder: %s", e)
+            self._conn = None
+            self._held.clear()
+
+
+class JobScheduler:
+    def __init__(self, election: Optional[LeaderElection] = None, drain_seconds: float = JOB_DRAIN_SECONDS):
+        self.election = election or LeaderElection()
+        self.drain_seconds = drain_seconds
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._stop = asyncio.Event()
+
+    def add_job(self, name: str, func: Callable[[], Awaitable[None]], *, interval: Optional[float] = None,
+                cron: Optional[str] = None, jitter: float = 0.0, leader_only: bool = True,
+                run_at_start: bool = False, timeout: Optional[float] = None) -> Job:
+        if name in self.jobs:
+            raise ValueError(f"Ya existe un trabajo llamado {name!r}.")
+        job = Job(
+            name=name, func=func, interval=interval, cron=CronSchedule(cron) if cron else None,
+            jitter=jitter, leader_only=leader_only, run_at_start=run_at_start, timeout=timeout,
+        )
+        self.jobs[name] = job
+        if self._tasks:
+            self._start_job(job)
+        return job
+
+    def start(self) -> None:
+        for job in self.jobs.values():
+            self._start_job(job)
+        logger.info("Programador de trabajos iniciado: %s.", ", ".join(self.jobs) or "sin trabajos")
+
+    def _start_job(self, job: Job) -> None:
+        self._tasks[job.name] = asyncio.create_task(self._job_loop(job), name=f"job-{job.name}")
+
+    async def _sleep_until(self, moment: datetime) -> bool:
+        """Espera hasta `moment`. Retorna False si el programador se detuvo antes."""
+        delay = (moment - _utcnow()).total_seconds()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(self._stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        return not self._stop.is_set()
+
+    async def _job_loop(self, job: Job) -> None:
+        last_start: Optional[datetime] = None
+        next_at = _utcnow() if job.run_at_start else job.next_run(None, _utcnow())
+        while await self._sleep_until(next_at):
+            started_at = _utcnow()
+            is_leader = not job.leader_only or await self.election.acquire(job.lock_key)
+            if is_leader and not self._stop.is_set():
+                # La ejecución es una tarea aparte para que stop() pueda esperarla o cancelarla.
+                run = asyncio.create_task(self.run_once(job), name=f"job-{job.name}-run")
+                self._running.add(run)
+                try:
+                    await asyncio.shield(run)
+                finally:
+                    self._running.discard(run)
+            last_start = started_at
+            next_at = job.next_run(last_start, _utcnow())
+
+    async def run_once(self, job: Job) -> str:
+        """Ejecuta el trabajo una vez y registra duración y resultado. Retorna el resultado."""
+        started = time.perf_counter()
+        try:
+            if job.timeout:
+                await asyncio.wait_for(job.func(), job.timeout)
+            else:
+                await job.func()
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.error("El trabajo %s superó su límite de %.0f s.", job.name, job.timeout)
+        except asyncio.CancelledError:
+            record_job_run(job.name, time.perf_counter() - started, "cancelled")
+            raise
+        except Exception as e:
+            outcome = "error"
+            logger.error("Error en el trabajo %s: %s", job.name, e, exc_info=True)
+        else:
+            outcome = "success"
+        seconds = time.perf_counter() - started
+        record_job_run(job.name, seconds, outcome)
+        logger.info("Trabajo %s: %s en %.2f s.", job.name, outcome, seconds)
+        return outcome
+
+    async def stop(self) -> None:
+        """Deja de programar, espera a las ejecuciones en curso y cancela las que no terminen."""
+        self._stop.set()
+        running = list(self._running)
+        if running:
+            logger.info("Esperando a %d trabajos en curso (hasta %.0f s).", len(running), self.drain_seconds)
+            _, pending = await asyncio.wait(running, timeout=self.drain_seconds)
+            for task in pending:
+                logger.warning("Se cancela el trabajo en curso %s.", task.get_name())
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        loops: List[asyncio.Task] = list(self._tasks.values())
+        for task in loops:
+            task.cancel()
+        await asyncio.gather(*loops, return_exceptions=True)
+        self._tasks.clear()
+        # Una ejecución que arrancó justo al apagar no se espera.
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        await self.election.release_all()
+        logger.info("Programador de trabajos detenido.")
+
+
+_scheduler: Optional[JobScheduler] = None
+
+
+def start_job_scheduler(register: Callable[[JobScheduler], None]) -> Optional[JobScheduler]:
+    """Crea el programador del proceso, registra los trabajos con `register` y lo inicia."""
+    global _scheduler
+    if os.getenv("JOBS_ENABLED", "true").strip().lower() not in ("1", "true", "yes", "si", "sí", "on"):
+        logger.info("Programador de trabajos desactivado (JOBS_ENABLED).")
+        return None
+    _scheduler = JobScheduler()
+    register(_scheduler)
+    _scheduler.start()
+    return _scheduler
+
+
+async def stop_job_scheduler() -> None:
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
@@ -0,0 +1,59 @@
+"""
+Contexto de la conversación en curso, disponible para logs, métricas y trazas.
+
+Usa contextvars: cada request del webhook (y las tareas que cree) ve sus propios valores,
+sin pasarlos como parámetro por todo el flujo.
+"""
+
+import hashlib
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+conversation_id_var: ContextVar[Optional[str]] = ContextVar("conversation_id", default=None)
+company_id_var: ContextVar[Optional[int]] = ContextVar("company_id", default=None)
+message_sid_var: ContextVar[Optional[str]] = ContextVar("message_sid", default=None)
+
+
+def make_conversation_id(company_number: str, user_phone_number: str) -> str:
+    """
+    Identificador estable de la conversación (empresa + usuario) que no expone el teléfono
+    del usuario en los logs.
+    """
+    raw = f"{(company_number or '').replace('whatsapp:', '')}:{(user_phone_number or '').replace('whatsapp:', '')}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def bind_conversation(conversation_id: str, message_sid: Optional[str] = None) -> Tuple:
+    """Fija la conversación del contexto actual. Retorna los tokens para reset_conversation."""
+    return (
+        conversation_id_var.set(conversation_id),
+        message_sid_var.set(message_sid),
+        company_id_var.set(None),
+    )
+
+
+def bind_company(company_id: Optional[int]) -> None:
+    """Registra la empresa una vez identificada (se restablece con reset_conversation)."""
+    company_id_var.set(company_id)
+
+
+def reset_conversation(tokens: Tuple) -> None:
+    conversation_token, sid_token, company_token = tokens
+    conversation_id_var.reset(conversation_token)
+    message_sid_var.reset(sid_token)
+    company_id_var.reset(company_token)
+
+
+def current_context() -> dict:
+    """Valores del contexto actual (solo los definidos)."""
+    context = {}
+    conversation_id = conversation_id_var.get()
+    if conversation_id is not None:
+        context["conversation_id"] = conversation_id
+    company_id = company_id_var.get()
+    if company_id is not None:
+        context["company_id"] = company_id
+    message_sid = message_sid_var.get()
+    if message_sid is not None:
+        context["message_sid"] = message_sid
+    return context
@@ -0,0 +1,189 @@
+"""
+Configuración de logging de la aplicación.
+
+- Los registros se encolan con un QueueHandler y un QueueListener los escribe desde un hilo
+  propio: el event loop nunca espera a stdout ni a disco.
+- Formato JSON (LOG_FORMAT=json, por defecto) con el contexto de la conversación
+  (conversation_id, company_id, message_sid; ver apps/monitoring/context.py), o texto
+  plano con LOG_FORMAT=text.
+- Muestreo por logger para niveles menores a WARNING con LOG_SAMPLING, p. ej.
+  "apps.whatsapp.chat_session_repository=0.1,apps.whatsapp=0.5". Se aplica el prefijo más
+  largo y la decisión es por conversación, así una conversación muestreada queda completa.
+  Los WARNING y ERROR nunca se descartan.
+
+Variables: LOG_LEVEL (INFO), LOG_FORMAT (json), LOG_SAMPLING (vacío = sin muestreo).
+
+En el código, usar formato diferido (logger.debug("... %s", valor)) para que los mensajes
+descartados no se formateen, y `if logger.isEnabledFor(logging.DEBUG):` alrededor de
+volcados costosos de armar.
+"""
+
+import atexit
+import copy
+import logging
+import os
+import queue
+import random
+import sys
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from apps.monitoring.context import company_id_var, conversation_id_var, message_sid_var
+from db.json_codec import dumps
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+
+
+def parse_sampling(spec: Optional[str]) -> Dict[str, float]:
+    """Convierte "logger=tasa,otro=tasa" en {logger: tasa}, ignorando entradas inválidas."""
+    rates = {}
+    for item in (spec or "").split(","):
+        name, sep, rate = item.partition("=")
+        if not sep:
+            continue
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Copia el contexto de la conversación al registro (en el hilo que lo emite)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.conversation_id = conversation_id_var.get()
+        record.company_id = company_id_var.get()
+        record.message_sid = message_sid_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Descarta una fracción de los registros < WARNING según la tasa de su logger."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def rate_for(self, logger_name: str) -> float:
+        rate = self._resolved.get(logger_name)
+        if rate is None:
+            rate = 1.0
+            best = -1
+            for prefix, prefix_rate in self.rates.items():
+                if (logger_name == prefix or logger_name.startswith(prefix + ".")) and len(prefix) > best:
+                    rate, best = prefix_rate, len(prefix)
+            self._resolved[logger_name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        conversation_id = getattr(record, "conversation_id", None) or conversation_id_var.get()
+        if conversation_id:
+            return (zlib.crc32(conversation_id.encode()) % 10000) < rate * 10000
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea con el contexto de la conversación."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("conversation_id", "company_id", "message_sid"):
+            value = getattr(record, key, None)
+            if value is not None:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return dumps(data)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    QueueHandler para una cola del mismo proceso: solo fija el mensaje y la traza de la
+    excepción (los argumentos podrían cambiar después), sin formatear la línea completa.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None, sampling: Optional[str] = None) -> QueueListener:
+    """
+    Reemplaza los handlers del logger raíz por el QueueHandler y arranca el listener.
+    Es idempotente: llamadas posteriores reconfiguran y reinician el listener.
+    """
+    global _listener, _queue_handler
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+    rates = parse_sampling(sampling if sampling is not None else os.getenv("LOG_SAMPLING"))
+
+    stop_logging()
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _queue_handler = queue_handler
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """
+    Detiene el listener vaciando antes la cola (llamar al apagar la aplicación). Primero deja
+    en el logger raíz la salida directa, con los mismos filtros: lo que se registre después
+    (el resto del apagado, atexit) se escribe sin la cola en lugar de quedar en ella sin leer.
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    if _queue_handler in root.handlers:
+        for output in _listener.handlers:
+            for log_filter in _queue_handler.filters:
+                output.addFilter(log_filter)
+            root.addHandler(output)
+        root.removeHandler(_queue_handler)
+    _listener.stop()
+    _listener = None
+    _queue_handler = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,235 @@
+"""
+Métricas Prometheus del pipeline de mensajes y endpoint /metrics.
+
+- whatsapp_stage_duration_seconds{stage, company_id}: latencia de cada etapa del turno
+  (ver STAGES). company_id se toma del contexto de la conversación al cerrar la etapa.
+- llm_calls_total{company_id, outcome} y llm_request_duration_seconds{company_id}.
+- calendar_calls_total{operation, outcome} y calendar_request_duration_seconds{operation}.
+- whatsapp_outbound_*: envíos de la cola de salida y callbacks de estado.
+- appointment_reminder*: recordatorios encolados, pendientes y retraso de despacho.
+- campaign_recipients_total{outcome}: destinatarios de campañas encolados u omitidos.
+- scheduled_job_*: ejecuciones, duración y último éxito de los trabajos periódicos
+  (apps/jobs/scheduler.py).
+
+Con varios workers (gunicorn/uvicorn --workers) cada proceso tiene su propio registro:
+definir PROMETHEUS_MULTIPROC_DIR (un directorio vacío y escribible, limpiado al arrancar)
+para que /metrics agregue los de todos. En ese modo los Gauge con set_function (p. ej. las
+métricas del pool en db/database.py) no se exportan.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import APIRouter, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from apps.monitoring.context import company_id_var
+from apps.monitoring.tracing import span
+
+STAGES = (
+    "company_lookup",
+    "session_fetch",
+    "intent_keyword",
+    "intent_llm",
+    "extract_name_llm",
+    "extract_option_llm",
+    "extract_datetime_dateparser",
+    "extract_datetime_llm",
+    "calendar_check",
+    "calendar_insert",
+    "commit",
+    "turn",
+)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_DURATION = Histogram(
+    "whatsapp_stage_duration_seconds",
+    "Duración de cada etapa del procesamiento de un mensaje.",
+    ["stage", "company_id"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALLS = Counter(
+    "llm_calls_total",
+    "Llamadas al LLM por resultado.",
+    ["company_id", "outcome"],
+)
+LLM_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "Duración de las llamadas al LLM.",
+    ["company_id"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens enviados (prompt) y recibidos (output) del LLM.",
+    ["company_id", "kind"],
+)
+OUTBOUND_SENDS = Counter(
+    "whatsapp_outbound_sends_total",
+    "Intentos de envío de mensajes salientes por resultado (sent, retry, failed).",
+    ["outcome"],
+)
+OUTBOUND_SEND_DURATION = Histogram(
+    "whatsapp_outbound_send_duration_seconds",
+    "Duración de las peticiones de envío a Twilio.",
+    buckets=LATENCY_BUCKETS,
+)
+OUTBOUND_STATUS = Counter(
+    "whatsapp_outbound_status_callbacks_total",
+    "Callbacks de estado de Twilio recibidos por estado.",
+    ["status"],
+)
+REMINDERS = Counter(
+    "appointment_reminders_total",
+    "Recordatorios de citas: encolados, descartados (ya enviados o cancelados) o duplicados.",
+    ["outcome"],
+)
+REMINDERS_PENDING = Gauge(
+    "appointment_reminders_pending",
+    "Recordatorios pendientes en el heap del programador de este proceso.",
+    multiprocess_mode="max",
+)
+REMINDER_DELAY = Histogram(
+    "appointment_reminder_dispatch_delay_seconds",
+    "Retraso entre la hora programada del recordatorio y su despacho.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+CAMPAIGN_RECIPIENTS = Counter(
+    "campaign_recipients_total",
+    "Destinatarios de campañas: encolados u omitidos (ya encolados o sin número válido).",
+    ["outcome"],
+)
+JOB_RUNS = Counter(
+    "scheduled_job_runs_total",
+    "Ejecuciones de trabajos periódicos por resultado (success, error, timeout, cancelled).",
+    ["job", "outcome"],
+)
+JOB_DURATION = Histogram(
+    "scheduled_job_duration_seconds",
+    "Duración de cada ejecución de un trabajo periódico.",
+    ["job"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+JOB_LAST_SUCCESS = Gauge(
+    "scheduled_job_last_success_timestamp_seconds",
+    "Hora (epoch) de la última ejecución exitosa del trabajo en cualquier proceso.",
+    ["job"],
+    multiprocess_mode="max",
+)
+LIVE_FEED_SUBSCRIBERS = Gauge(
+    "live_feed_subscribers",
+    "Conexiones SSE abiertas al feed en vivo de conversaciones.",
+    multiprocess_mode="livesum",
+)
+LIVE_FEED_DROPPED = Counter(
+    "live_feed_dropped_events_total",
+    "Eventos del feed en vivo descartados porque el buffer del suscriptor estaba lleno.",
+)
+CALENDAR_CALLS = Counter(
+    "calendar_calls_total",
+    "Llamadas a la API de Google Calendar por operación y resultado.",
+    ["operation", "outcome"],
+)
+CALENDAR_DURATION = Histogram(
+    "calendar_request_duration_seconds",
+    "Duración de las llamadas a la API de Google Calendar.",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def _company_label(company_id: Optional[int] = None) -> str:
+    if company_id is None:
+        company_id = company_id_var.get()
+    return str(company_id) if company_id is not None else "unknown"
+
+
+@contextmanager
+def track_stage(stage: str, company_id: Optional[int] = None):
+    """
+    Mide la duración del bloque como la etapa `stage` (también si termina con excepción).
+    Si hay una traza activa, el bloque es además un span "stage.<stage>".
+    """
+    started = time.perf_counter()
+    try:
+        with span(f"stage.{stage}"):
+            yield
+    finally:
+        STAGE_DURATION.labels(stage, _company_label(company_id)).observe(time.perf_counter() - started)
+
+
+def observe_stage(stage: str, seconds: float, company_id: Optional[int] = None) -> None:
+    STAGE_DURATION.labels(stage, _company_label(company_id)).observe(seconds)
+
+
+def record_llm_call(seconds: float, outcome: str, prompt_tokens: Optional[int] = None, output_tokens: Optional[int] = None) -> None:
+    company = _company_label()
+    LLM_CALLS.labels(company, outcome).inc()
+    LLM_DURATION.labels(company).observe(seconds)
+    if prompt_tokens:
+        LLM_TOKENS.labels(company, "prompt").inc(prompt_tokens)
+    if output_tokens:
+        LLM_TOKENS.labels(company, "output").inc(output_tokens)
+
+
+def record_outbound_send(seconds: float, outcome: str) -> None:
+    OUTBOUND_SENDS.labels(outcome).inc()
+    OUTBOUND_SEND_DURATION.observe(seconds)
+
+
+def record_outbound_status(status: str) -> None:
+    OUTBOUND_STATUS.labels(status).inc()
+
+
+def record_reminders(outcome: str, count: int) -> None:
+    if count:
+        REMINDERS.labels(outcome).inc(count)
+
+
+def observe_reminder_delay(seconds: float) -> None:
+    REMINDER_DELAY.observe(max(seconds, 0.0))
+
+
+def record_campaign_recipients(outcome: str, count: int) -> None:
+    if count:
+        CAMPAIGN_RECIPIENTS.labels(outcome).inc(count)
+
+
+def record_live_feed_dropped(count: int = 1) -> None:
+    LIVE_FEED_DROPPED.inc(count)
+
+
+def record_job_run(job: str, seconds: float, outcome: str) -> None:
+    JOB_RUNS.labels(job, outcome).inc()
+    JOB_DURATION.labels(job).observe(seconds)
+    if outcome == "success":
+        JOB_LAST_SUCCESS.labels(job).set(time.time())
+
+
+def record_calendar_call(operation: str, seconds: float, outcome: str) -> None:
+    CALENDAR_CALLS.labels(operation, outcome).inc()
+    CALENDAR_DURATION.labels(operation).observe(seconds)
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+def metrics():
+    """Exposición en formato de texto de Prometheus."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
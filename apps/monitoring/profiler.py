@@ -0,0 +1,148 @@
+"""
+Profiler por muestreo activable en caliente en un worker en producción.
+
+POST /admin/profile?seconds=N (header X-Admin-Token, ver require_admin_token) arranca un
+hilo que cada PROFILER_INTERVAL_MS lee las pilas de todos los hilos con
+sys._current_frames() durante N segundos y devuelve las pilas en formato "collapsed"
+(una línea "marco;marco;... cuenta"), listo para flamegraph.pl o speedscope.
+
+Las pilas se agrupan por su primer marco:
+  event_loop   el hilo del event loop (el que atendió la petición)
+  thread_pool  hilos de asyncio.to_thread / run_in_executor (Google Calendar, Gemini, etc.)
+  other        el resto (listener de logs, exportador de trazas, ...)
+
+Sin perfilado en curso no hay hilo ni hooks: el costo con el profiler apagado es cero.
+Solo se permite un perfilado a la vez por worker.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from apps.auth.auth import require_admin_token
+
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", "60"))
+MAX_STACK_DEPTH = 128
+
+THREAD_POOL_PREFIXES = ("asyncio_", "ThreadPoolExecutor")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    # Rutas cortas: a partir del paquete (site-packages/... o apps/..., db/...).
+    for marker in ("site-packages/", "/apps/", "/db/"):
+        index = filename.rfind(marker)
+        if index != -1:
+            filename = filename[index + (len(marker) if marker == "site-packages/" else 1):]
+            break
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Muestrea las pilas de todos los hilos desde un hilo propio."""
+
+    def __init__(self, loop_thread_id: int, interval: float = PROFILER_INTERVAL_MS / 1000):
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _group(self, thread_id: int, names: Dict[int, str]) -> str:
+        if thread_id == self.loop_thread_id:
+            return "event_loop"
+        if names.get(thread_id, "").startswith(THREAD_POOL_PREFIXES):
+            return "thread_pool"
+        return "other"
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(self._group(thread_id, names))
+            self.stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            self._sample()
+            next_tick += self.interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_tick = time.perf_counter()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def summary(self) -> Dict[str, int]:
+        groups: Counter = Counter()
+        for stack, count in self.stacks.items():
+            groups[stack.split(";", 1)[0]] += count
+        return dict(groups)
+
+
+_profile_lock = asyncio.Lock()
+
+
+async def profile_for(seconds: float) -> SamplingProfiler:
+    """Perfila el proceso durante `seconds` (debe llamarse desde el event loop)."""
+    profiler = SamplingProfiler(loop_thread_id=threading.get_ident())
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(profiler.stop)
+    return profiler
+
+
+profiler_router = APIRouter()
+
+
+@profiler_router.post("/profile", dependencies=[Depends(require_admin_token)])
+async def run_profile(seconds: float = Query(10, gt=0)):
+    """Perfila este worker durante `seconds` y devuelve las pilas en formato collapsed."""
+    if seconds > PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"El máximo es {PROFILER_MAX_SECONDS} segundos.")
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay un perfilado en curso en este worker.")
+    async with _profile_lock:
+        profiler = await profile_for(seconds)
+    summary = ", ".join(f"{group}={count}" for group, count in sorted(profiler.summary().items()))
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{os.getpid()}-{int(time.time())}.collapsed"',
+            "X-Profile-Samples": str(profiler.samples),
+            "X-Profile-Groups": summary,
+        },
+    )
@@ -0,0 +1,370 @@
+"""
+Trazas livianas por turno del webhook.
+
+Cada mensaje entrante abre una traza (start_trace) y el código instrumentado agrega spans
+anidados con span(): etapas del turno (apps/monitoring/metrics.track_stage), sentencias SQL
+(eventos de cursor de SQLAlchemy, ver instrument_engine), llamadas al LLM (con conteo de
+tokens, nunca el contenido), dateparser y llamadas HTTP a Google Calendar.
+
+El span actual vive en un ContextVar: se propaga a las tareas y a asyncio.to_thread, y a los
+greenlets de SQLAlchemy asyncio, que ejecutan los eventos de cursor con el contexto del llamador.
+
+Muestreo por cola (tail-based): la decisión se toma al cerrar la traza. Se exportan todas las
+trazas más lentas que TRACE_SLOW_MS, las que registraron un error en cualquier span (aunque
+el handler lo haya capturado) y una fracción
+TRACE_SAMPLE_RATE del resto.
+
+Variables:
+  TRACE_EXPORTER       none (por defecto) | jsonl | otlp
+  TRACE_FILE           archivo JSONL (traces.jsonl)
+  TRACE_OTLP_ENDPOINT  colector OTLP/HTTP JSON (http://localhost:4318/v1/traces)
+  TRACE_SLOW_MS        umbral de lentitud en milisegundos (1000)
+  TRACE_SAMPLE_RATE    fracción de trazas rápidas a exportar (0.0)
+
+Con TRACE_EXPORTER=none no se crea ningún span: span() solo consulta el ContextVar.
+"""
+
+import logging
+import os
+from abc import ABC, abstractmethod
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+from apps.monitoring.context import current_context
+from db.json_codec import dumps
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "whatsapp-ia-saas"
+MAX_STATEMENT_LENGTH = 300
+
+
+@dataclass(slots=True)
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+        }
+        if self.attributes:
+            data["attributes"] = self.attributes
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+@dataclass(slots=True)
+class Trace:
+    trace_id: str
+    root: Span
+    spans: List[Span] = field(default_factory=list)
+    # Primer error registrado en cualquier span: el handler captura las excepciones del turno y
+    # responde un mensaje genérico, así que un turno fallido no siempre marca la raíz.
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "duration_ms": round(self.root.duration_ms, 3),
+            "error": self.root.error or self.error,
+            "spans": [s.to_dict() for s in self.spans],
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+# === Exportadores ===
+
+class QueueExporter(ABC):
+    """Exporta las trazas desde un hilo propio: el event loop solo encola."""
+
+    def __init__(self):
+        self._queue: "queue.SimpleQueue[Optional[Trace]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace) -> None:
+        self._queue.put(trace)
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            trace = self._queue.get()
+            if trace is None:
+                return
+            batch = [trace]
+            # Agrupa lo que ya esté en cola en una sola escritura.
+            while True:
+                try:
+                    pending = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    self._safe_write(batch)
+                    return
+                batch.append(pending)
+            self._safe_write(batch)
+
+    def _safe_write(self, batch: List[Trace]) -> None:
+        try:
+            self.write(batch)
+        except Exception as e:
+            logger.warning("No se pudieron exportar %d trazas: %s", len(batch), e)
+
+    @abstractmethod
+    def write(self, batch: List[Trace]) -> None:
+        """Escribe un lote de trazas (desde el hilo del exportador)."""
+
+
+class JsonlExporter(QueueExporter):
+    """Una traza por línea en un archivo local."""
+
+    def __init__(self, path: str):
+        self.path = path
+        super().__init__()
+
+    def write(self, batch: List[Trace]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for trace in batch:
+                f.write(dumps(trace.to_dict()))
+                f.write("\n")
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(batch: List[Trace]) -> Dict[str, Any]:
+    """Convierte las trazas al formato OTLP/HTTP JSON (resourceSpans)."""
+    spans = []
+    for trace in batch:
+        for s in trace.spans:
+            spans.append({
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]
+    }
+
+
+class OtlpHttpExporter(QueueExporter):
+    """Envía las trazas a un colector compatible con OTLP/HTTP (JSON)."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        import httpx
+
+        self.endpoint = endpoint
+        self._client = httpx.Client(timeout=timeout)
+        super().__init__()
+
+    def write(self, batch: List[Trace]) -> None:
+        response = self._client.post(
+            self.endpoint,
+            content=dumps(to_otlp(batch)),
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self._client.close()
+
+
+# === Configuración ===
+
+_exporter: Optional[QueueExporter] = None
+_slow_ns = 1000 * 1_000_000
+_sample_rate = 0.0
+
+
+def configure_tracing(exporter: Optional[str] = None) -> Optional[QueueExporter]:
+    """Crea el exportador según TRACE_EXPORTER. Retorna None si las trazas están desactivadas."""
+    global _exporter, _slow_ns, _sample_rate
+    shutdown_tracing()
+    kind = (exporter or os.getenv("TRACE_EXPORTER", "none")).lower()
+    _slow_ns = int(float(os.getenv("TRACE_SLOW_MS", "1000")) * 1_000_000)
+    _sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.0"))
+    if kind == "jsonl":
+        _exporter = JsonlExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+    elif kind == "otlp":
+        _exporter = OtlpHttpExporter(os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"))
+    if _exporter is not None:
+        logger.info("Trazas activas (%s, umbral %.0f ms, muestreo %.2f).", kind, _slow_ns / 1e6, _sample_rate)
+    return _exporter
+
+
+def shutdown_tracing() -> None:
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        _exporter = None
+
+
+def tracing_enabled() -> bool:
+    return _exporter is not None
+
+
+def _should_export(trace: Trace) -> bool:
+    root = trace.root
+    if root.error or trace.error or (root.end_ns - root.start_ns) >= _slow_ns:
+        return True
+    return _sample_rate > 0 and random.random() < _sample_rate
+
+
+# === API de instrumentación ===
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Abre la traza de un turno. Sin exportador configurado no hace nada."""
+    if _exporter is None:
+        yield None
+        return
+    trace_id = secrets.token_hex(16)
+    root = Span(trace_id, secrets.token_hex(8), None, name, time.time_ns(), attributes=attributes)
+    trace = Trace(trace_id, root, [root])
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(root)
+    try:
+        yield root
+    except Exception as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        root.end_ns = time.time_ns()
+        root.attributes.update(current_context())
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        exporter = _exporter
+        if exporter is not None and _should_export(trace):
+            exporter.export(trace)
+
+
+def begin_span(name: str, **attributes) -> Optional[Span]:
+    """Crea un span hijo del actual sin activarlo (para instrumentación por eventos)."""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    parent = _current_span.get()
+    new_span = Span(
+        trace.trace_id,
+        secrets.token_hex(8),
+        parent.span_id if parent else trace.root.span_id,
+        name,
+        time.time_ns(),
+        attributes=attributes,
+    )
+    trace.spans.append(new_span)
+    return new_span
+
+
+def end_span(finished: Optional[Span], error: Optional[BaseException] = None) -> None:
+    if finished is None:
+        return
+    finished.end_ns = time.time_ns()
+    if error is not None:
+        finished.error = f"{type(error).__name__}: {error}"
+        trace = _current_trace.get()
+        if trace is not None and trace.trace_id == finished.trace_id and trace.error is None:
+            trace.error = finished.error
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Span anidado dentro de la traza actual; fuera de una traza solo cuesta un ContextVar.get()."""
+    if _current_trace.get() is None:
+        yield None
+        return
+    new_span = begin_span(name, **attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except Exception as e:
+        end_span(new_span, e)
+        raise
+    else:
+        end_span(new_span)
+    finally:
+        _current_span.reset(token)
+
+
+# === SQLAlchemy ===
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db_span = begin_span("db.query", statement=statement[:MAX_STATEMENT_LENGTH], executemany=executemany)
+    if db_span is not None and context is not None:
+        context._trace_span = db_span
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db_span = getattr(context, "_trace_span", None)
+    if db_span is not None:
+        rowcount = getattr(cursor, "rowcount", -1)
+        if rowcount is not None and rowcount >= 0:
+            db_span.set(rows=rowcount)
+        end_span(db_span)
+
+
+def _handle_error(exception_context):
+    db_span = getattr(exception_context.execution_context, "_trace_span", None)
+    end_span(db_span, exception_context.original_exception)
+
+
+def instrument_engine(async_engine) -> None:
+    """Registra los eventos de cursor que crean un span por sentencia SQL."""
+    sync_engine = async_engine.sync_engine
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
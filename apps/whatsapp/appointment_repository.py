@@ -0,0 +1,83 @@
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from pytz import timezone as pytz_timezone
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models.appointment import Appointment
+
+logger = logging.getLogger(__name__)
+
+# Zona de las fechas que escribe el usuario y que muestra el calendario.
+APPOINTMENT_TZ = pytz_timezone('America/Bogota')
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """Fecha local (sin zona = America/Bogota) o con zona -> UTC sin zona, como se guarda en la base."""
+    if value.tzinfo is None:
+        value = APPOINTMENT_TZ.localize(value)
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_local(value: datetime) -> datetime:
+    """UTC sin zona (como se guarda) -> hora local de America/Bogota."""
+    return value.replace(tzinfo=timezone.utc).astimezone(APPOINTMENT_TZ)
+
+
+def add_appointment(
+    db_session: AsyncSession,
+    company_id: int,
+    client_phone_number: str,
+    client_name: str,
+    scheduled_for: datetime,
+    event_id: Optional[str] = None,
+) -> Appointment:
+    """Agrega la cita a la transacción del turno (el commit lo hace la unidad de trabajo)."""
+    appointment = Appointment(
+        company_id=company_id,
+        client_phone_number=client_phone_number.replace("whatsapp:", ""),
+        client_name=client_name or "",
+        scheduled_for=to_utc_naive(scheduled_for),
+        event_id=event_id,
+        status="scheduled",
+    )
+    db_session.add(appointment)
+    logger.debug("APPOINTMENT_REPO: Cita agregada para la empresa %s (evento %s).", company_id, event_id)
+    return appointment
+
+
+async def cancel_appointments_by_event_ids(
+    db_session: AsyncSession,
+    event_ids: Iterable[str],
+    company_id: Optional[int] = None,
+) -> Dict[int, int]:
+    """Marca como canceladas las citas de esos eventos del calendario. Retorna cuántas cambiaron por empresa."""
+    event_ids = [e for e in event_ids if e]
+    if not event_ids:
+        return {}
+    stmt = (
+        update(Appointment)
+        .where(Appointment.event_id.in_(event_ids), Appointment.status == "scheduled")
+        .values(status="cancelled")
+        .returning(Appointment.company_id)
+        .execution_options(synchronize_session=False)
+    )
+    if company_id is not None:
+        stmt = stmt.where(Appointment.company_id == company_id)
+    result = await db_session.execute(stmt)
+    return dict(Counter(result.scalars().all()))
+
+
+async def reschedule_appointment_by_event_id(db_session: AsyncSession, event_id: str, scheduled_for: datetime) -> int:
+    """Cambia el horario de la cita del evento; el recordatorio vuelve a quedar pendiente."""
+    stmt = (
+        update(Appointment)
+        .where(Appointment.event_id == event_id, Appointment.status == "scheduled")
+        .values(scheduled_for=to_utc_naive(scheduled_for), reminder_sent_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db_session.execute(stmt)
+    return result.rowcount
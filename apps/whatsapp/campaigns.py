@@ -0,0 +1,526 @@
+"""
+Campañas de envío masivo por empresa (p. ej. "la clínica cierra el festivo").
+
+Una campaña toma sus destinatarios de los contactos de la empresa (chat_sessions, un mensaje
+por número distinto con el último nombre conocido) o de una lista cargada por la API
+(campaign_recipients), arma el mensaje de cada uno desde la plantilla y lo encola en
+outbound_messages. El envío en sí lo hace el worker de apps/whatsapp/outbound_sender.py, con
+su concurrencia acotada y su límite por remitente.
+
+Un CampaignRunner por proceso reclama las campañas en curso con un plazo (lease_until) y
+las recorre por segmentos ordenados por teléfono (o por id de la lista):
+
+  - Cada segmento se lee con un cursor del servidor (stream + yield_per), así que la memoria
+    no depende del tamaño de la campaña, y la transacción de lectura dura solo un segmento.
+  - Por cada lote se encolan los mensajes y se avanza el punto de control (cursor, contadores
+    y plazo) en la misma transacción: al reiniciar se retoma desde el último lote confirmado.
+    La idempotency_key "campaign:<id>:<teléfono>" descarta además cualquier repetición.
+  - Antes de cada segmento se espera a que la empresa tenga menos de CAMPAIGN_MAX_PENDING
+    mensajes pendientes en la cola, para no llenar la tabla con toda la campaña de una vez
+    ni demorar los recordatorios y notificaciones de la misma empresa.
+  - Cancelar la campaña se nota en el siguiente lote (el UPDATE del punto de control exige
+    status = 'running').
+
+Variables:
+  CAMPAIGNS_ENABLED                iniciar el runner con la app (true)
+  CAMPAIGN_CONCURRENCY             campañas simultáneas por proceso (2)
+  CAMPAIGN_BATCH_SIZE              destinatarios por lote encolado (500)
+  CAMPAIGN_SEGMENT_SIZE            destinatarios por segmento leído (5000)
+  CAMPAIGN_MAX_PENDING             mensajes pendientes por empresa antes de pausar (5000)
+  CAMPAIGN_LEASE_SECONDS           plazo de una campaña reclamada (120)
+  CAMPAIGN_POLL_SECONDS            espera sin campañas o con la cola llena (2)
+
+Plantilla: placeholders {name}, {empresa} y {phone}; un nombre desconocido se rechaza al
+crear la campaña y un valor faltante se reemplaza por "".
+"""
+
+import asyncio
+import codecs
+import csv
+import logging
+import os
+import re
+import string
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import BaseModel
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apps.auth.auth import get_current_company
+from apps.monitoring.metrics import record_campaign_recipients
+from apps.whatsapp.outbound_sender import PENDING_STATUSES, enqueue_messages, wake_outbound_worker
+from db.database import SessionLocal, get_db
+from db.models.campaign import Campaign, CampaignRecipient
+from db.models.chat_session import ChatSession
+from db.models.company import Company
+from db.models.outbound_message import OutboundMessage
+
+logger = logging.getLogger(__name__)
+
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "2"))
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "500"))
+CAMPAIGN_SEGMENT_SIZE = int(os.getenv("CAMPAIGN_SEGMENT_SIZE", "5000"))
+CAMPAIGN_MAX_PENDING = int(os.getenv("CAMPAIGN_MAX_PENDING", "5000"))
+CAMPAIGN_LEASE_SECONDS = int(os.getenv("CAMPAIGN_LEASE_SECONDS", "120"))
+CAMPAIGN_POLL_SECONDS = float(os.getenv("CAMPAIGN_POLL_SECONDS", "2"))
+
+UPLOAD_BATCH_SIZE = 1000
+TEMPLATE_FIELDS = {"name", "empresa", "phone"}
+SOURCES = ("chat_sessions", "upload")
+
+_PHONE_RE = re.compile(r"^\+?\d{8,15}$")
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# === Plantillas y números ===
+
+def validate_template(template: str) -> None:
+    """Lanza ValueError si la plantilla está vacía, mal formada o usa placeholders desconocidos."""
+    if not template or not template.strip():
+        raise ValueError("La plantilla está vacía.")
+    try:
+        fields = {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+    except ValueError as e:
+        raise ValueError(f"Plantilla inválida: {e}") from e
+    unknown = fields - TEMPLATE_FIELDS
+    if unknown:
+        raise ValueError(
+            f"Placeholders desconocidos: {', '.join(sorted(unknown))} (válidos: {{name}}, {{empresa}}, {{phone}})."
+        )
+
+
+def render_template(template: str, name: Optional[str], empresa: str, phone: str) -> str:
+    first_name = (name or "").strip().split(" ")[0]
+    return template.format(name=first_name, empresa=empresa, phone=phone)
+
+
+def normalize_phone(raw: Optional[str]) -> Optional[str]:
+    """Número en formato +<dígitos>, o None si no parece un número de WhatsApp."""
+    if not raw:
+        return None
+    phone = re.sub(r"[\s\-().]", "", raw.replace("whatsapp:", ""))
+    if not _PHONE_RE.match(phone):
+        return None
+    return phone if phone.startswith("+") else f"+{phone}"
+
+
+# === Destinatarios ===
+
+def _segment_query(campaign_id: int, company_id: int, source: str, cursor: Optional[str], limit: int):
+    """Siguiente segmento de destinatarios: filas (clave del cursor, teléfono, nombre)."""
+    if source == "upload":
+        stmt = (
+            select(CampaignRecipient.id, CampaignRecipient.phone_number, CampaignRecipient.name)
+            .where(CampaignRecipient.campaign_id == campaign_id)
+            .order_by(CampaignRecipient.id)
+        )
+        if cursor:
+            stmt = stmt.where(CampaignRecipient.id > int(cursor))
+        return stmt.limit(limit)
+
+    # Un destinatario por número, con el nombre de su sesión más reciente.
+    stmt = (
+        select(
+            ChatSession.user_phone_number.label("cursor_key"),
+            ChatSession.user_phone_number,
+            ChatSession.session_data["client_name"].astext,
+        )
+        .distinct(ChatSession.user_phone_number)
+        .where(ChatSession.company_id == company_id)
+        .order_by(ChatSession.user_phone_number, ChatSession.last_activity.desc())
+    )
+    if cursor:
+        stmt = stmt.where(ChatSession.user_phone_number > cursor)
+    return stmt.limit(limit)
+
+
+async def stream_recipients(session: AsyncSession, campaign_id: int, company_id: int, source: str,
+                            cursor: Optional[str], limit: int,
+                            batch_size: int = CAMPAIGN_BATCH_SIZE) -> AsyncIterator[List[Tuple[Any, str, Optional[str]]]]:
+    """Lotes de destinatarios del segmento, leídos con un cursor del servidor."""
+    stmt = _segment_query(campaign_id, company_id, source, cursor, limit).execution_options(yield_per=batch_size)
+    result = await session.stream(stmt)
+    async for partition in result.partitions():
+        yield partition
+
+
+# === Runner ===
+
+class CampaignRunner:
+    def __init__(self, session_factory=SessionLocal, concurrency: int = CAMPAIGN_CONCURRENCY,
+                 batch_size: int = CAMPAIGN_BATCH_SIZE, segment_size: int = CAMPAIGN_SEGMENT_SIZE,
+                 max_pending: int = CAMPAIGN_MAX_PENDING, poll_seconds: float = CAMPAIGN_POLL_SECONDS):
+        self._session_factory = session_factory
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        self.max_pending = max_pending
+        self.poll_seconds = poll_seconds
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run(), name="campaign-runner")
+
+    def wake(self) -> None:
+        """Avisa que hay una campaña nueva en curso (evita esperar al siguiente sondeo)."""
+        self._wake.set()
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Deja de reclamar campañas y espera a que las en curso confirmen su lote."""
+        self._stopping = True
+        self._wake.set()
+        tasks = [t for t in (self._task, *self._running.values()) if t is not None]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("%d tareas de campañas no terminaron en %.0f s; se cancelan.", len(pending), timeout)
+
+    async def run(self) -> None:
+        logger.info("Runner de campañas iniciado (%d simultáneas).", self.concurrency)
+        while not self._stopping:
+            try:
+                free = self.concurrency - len(self._running)
+                for campaign_id in (await self._claim(free) if free > 0 else []):
+                    task = asyncio.create_task(self.run_campaign(campaign_id), name=f"campaign-{campaign_id}")
+                    self._running[campaign_id] = task
+                    task.add_done_callback(lambda _, cid=campaign_id: self._running.pop(cid, None))
+            except Exception as e:
+                logger.error("Error al reclamar campañas: %s", e, exc_info=True)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, limit: int) -> List[int]:
+        now = _utcnow()
+        available = (
+            select(Campaign.id)
+            .where(
+                Campaign.status == "running",
+                (Campaign.lease_until.is_(None)) | (Campaign.lease_until < now),
+            )
+            .order_by(Campaign.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(Campaign)
+            .where(Campaign.id.in_(available))
+            .values(lease_until=now + timedelta(seconds=CAMPAIGN_LEASE_SECONDS))
+            .returning(Campaign.id)
+            .execution_options(synchronize_session=False)
+        )
+        async with self._session_factory() as session:
+            ids = (await session.execute(stmt)).scalars().all()
+            await session.commit()
+        return list(ids)
+
+    async def _pending_for_company(self, company_id: int) -> int:
+        async with self._session_factory() as session:
+            result = await session.execute(
+                select(func.count())
+                .select_from(OutboundMessage)
+                .where(OutboundMessage.company_id == company_id, OutboundMessage.status.in_(PENDING_STATUSES))
+            )
+            return result.scalar_one()
+
+    async def _renew(self, campaign_id: int, **values) -> bool:
+        """Renueva el plazo (y aplica `values`) si la campaña sigue en curso."""
+        values.setdefault("lease_until", _utcnow() + timedelta(seconds=CAMPAIGN_LEASE_SECONDS))
+        stmt = (
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.status == "running")
+            .values(**values)
+            .returning(Campaign.id)
+            .execution_options(synchronize_session=False)
+        )
+        async with self._session_factory() as session:
+            renewed = (await session.execute(stmt)).first() is not None
+            await session.commit()
+        return renewed
+
+    async def _wait_for_capacity(self, campaign_id: int, company_id: int) -> bool:
+        """Espera a que baje la cola de la empresa. Retorna False si la campaña ya no está en curso."""
+        while await self._pending_for_company(company_id) >= self.max_pending:
+            if self._stopping or not await self._renew(campaign_id):
+                return False
+            await asyncio.sleep(self.poll_seconds)
+        return not self._stopping
+
+    async def run_campaign(self, campaign_id: int) -> None:
+        try:
+            await self._run_campaign(campaign_id)
+        except Exception as e:
+            logger.error("Error en la campaña %s: %s", campaign_id, e, exc_info=True)
+            # Se reintenta desde el último punto de control cuando vence el plazo.
+            await self._renew(campaign_id, last_error=str(e)[:500])
+            return
+        if self._stopping:
+            # Al apagar se libera el plazo para que otro proceso la retome sin esperar.
+            await self._renew(campaign_id, lease_until=None)
+
+    async def _run_campaign(self, campaign_id: int) -> None:
+        async with self._session_factory() as session:
+            row = (await session.execute(
+                select(Campaign.company_id, Campaign.template, Campaign.source, Campaign.cursor,
+                       Company.name, Company.company_number)
+                .join(Company, Company.id == Campaign.company_id)
+                .where(Campaign.id == campaign_id)
+            )).one()
+        company_id, template, source, cursor = row.company_id, row.template, row.source, row.cursor
+        logger.info("Campaña %s en curso desde %s.", campaign_id, cursor or "el inicio")
+
+        while await self._wait_for_capacity(campaign_id, company_id):
+            read = 0
+            async with self._session_factory() as reader:
+                async for batch in stream_recipients(
+                    reader, campaign_id, company_id, source, cursor, self.segment_size, self.batch_size
+                ):
+                    read += len(batch)
+                    cursor = str(batch[-1][0])
+                    if not await self._enqueue_batch(campaign_id, company_id, row, template, batch, cursor):
+                        logger.info("Campaña %s detenida (ya no está en curso).", campaign_id)
+                        return
+            if read < self.segment_size:
+                await self._renew(campaign_id, status="completed", finished_at=_utcnow(), lease_until=None)
+                logger.info("Campaña %s completada.", campaign_id)
+                return
+
+    async def _enqueue_batch(self, campaign_id: int, company_id: int, company, template: str,
+                             batch, cursor: str) -> bool:
+        messages = []
+        for _, raw_phone, name in batch:
+            phone = normalize_phone(raw_phone)
+            if phone is None:
+                continue
+            messages.append({
+                "to_number": phone,
+                "body": render_template(template, name, company.name, phone),
+                "from_number": company.company_number,
+                "company_id": company_id,
+                "idempotency_key": f"campaign:{campaign_id}:{phone}",
+            })
+        async with self._session_factory() as session:
+            # Punto de control primero: si la campaña se canceló, no se encola nada.
+            checkpoint = (
+                update(Campaign)
+                .where(Campaign.id == campaign_id, Campaign.status == "running")
+                .values(
+                    cursor=cursor,
+                    lease_until=_utcnow() + timedelta(seconds=CAMPAIGN_LEASE_SECONDS),
+                    last_error=None,
+                )
+                .returning(Campaign.id)
+                .execution_options(synchronize_session=False)
+            )
+            if (await session.execute(checkpoint)).first() is None:
+                await session.rollback()
+                return False
+            queued = await enqueue_messages(session, messages)
+            skipped = len(batch) - queued
+            await session.execute(
+                update(Campaign)
+                .where(Campaign.id == campaign_id)
+                .values(enqueued=Campaign.enqueued + queued, skipped=Campaign.skipped + skipped)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        if queued:
+            wake_outbound_worker()
+        record_campaign_recipients("queued", queued)
+        record_campaign_recipients("skipped", skipped)
+        return True
+
+
+_runner: Optional[CampaignRunner] = None
+
+
+def start_campaign_runner() -> Optional[CampaignRunner]:
+    global _runner
+    if os.getenv("CAMPAIGNS_ENABLED", "true").strip().lower() not in ("1", "true", "yes", "si", "sí", "on"):
+        logger.info("Runner de campañas desactivado (CAMPAIGNS_ENABLED).")
+        return None
+    _runner = CampaignRunner()
+    _runner.start()
+    return _runner
+
+
+async def stop_campaign_runner() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.stop()
+        _runner = None
+
+
+def wake_campaign_runner() -> None:
+    if _runner is not None:
+        _runner.wake()
+
+
+# === API ===
+
+campaign_router = APIRouter()
+
+
+class CampaignCreate(BaseModel):
+    name: str
+    template: str
+    source: str = "chat_sessions"
+
+
+def _campaign_dict(campaign: Campaign) -> Dict[str, Any]:
+    return {
+        "id": campaign.id,
+        "name": campaign.name,
+        "source": campaign.source,
+        "status": campaign.status,
+        "template": campaign.template,
+        "enqueued": campaign.enqueued,
+        "skipped": campaign.skipped,
+        "last_error": campaign.last_error,
+        "created_at": campaign.created_at,
+        "started_at": campaign.started_at,
+        "finished_at": campaign.finished_at,
+    }
+
+
+async def _get_campaign(db: AsyncSession, company: Company, campaign_id: int, lock: bool = False) -> Campaign:
+    stmt = select(Campaign).where(Campaign.id == campaign_id, Campaign.company_id == company.id)
+    if lock:
+        stmt = stmt.with_for_update()
+    campaign = (await db.execute(stmt)).scalars().first()
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada.")
+    return campaign
+
+
+@campaign_router.post("")
+async def create_campaign(
+    payload: CampaignCreate,
+    company: Company = Depends(get_current_company),
+    db: AsyncSession = Depends(get_db),
+):
+    if payload.source not in SOURCES:
+        raise HTTPException(status_code=422, detail=f"source debe ser {' o '.join(SOURCES)}.")
+    try:
+        validate_template(payload.template)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    campaign = Campaign(company_id=company.id, name=payload.name, template=payload.template, source=payload.source)
+    db.add(campaign)
+    await db.commit()
+    return _campaign_dict(campaign)
+
+
+@campaign_router.get("")
+async def list_campaigns(company: Company = Depends(get_current_company), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(Campaign).where(Campaign.company_id == company.id).order_by(Campaign.id.desc()).limit(100)
+    )
+    return [_campaign_dict(campaign) for campaign in result.scalars()]
+
+
+@campaign_router.get("/{campaign_id}")
+async def get_campaign(campaign_id: int, company: Company = Depends(get_current_company),
+                       db: AsyncSession = Depends(get_db)):
+    return _campaign_dict(await _get_campaign(db, company, campaign_id))
+
+
+@campaign_router.post("/{campaign_id}/recipients")
+async def upload_recipients(
+    campaign_id: int,
+    request: Request,
+    company: Company = Depends(get_current_company),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Carga destinatarios en una campaña en borrador con source 'upload'. El cuerpo es un CSV
+    (teléfono[,nombre]) que se procesa a medida que llega, por lotes; los números repetidos
+    en la campaña se ignoran.
+    """
+    campaign = await _get_campaign(db, company, campaign_id)
+    if campaign.source != "upload" or campaign.status != "draft":
+        raise HTTPException(status_code=409, detail="Solo se cargan destinatarios en campañas 'upload' en borrador.")
+
+    added = invalid = 0
+    batch: List[Dict[str, Any]] = []
+
+    async def flush():
+        nonlocal added
+        if batch:
+            result = await db.execute(
+                pg_insert(CampaignRecipient)
+                .values(batch)
+                .on_conflict_do_nothing(constraint="uq_campaign_recipients_phone")
+                .returning(CampaignRecipient.id)
+            )
+            added += len(result.all())
+            batch.clear()
+
+    async def add(lines):
+        nonlocal invalid
+        for fields in csv.reader(lines):
+            if not fields:
+                continue
+            phone = normalize_phone(fields[0])
+            if phone is None:
+                invalid += 1
+                continue
+            name = fields[1].strip() if len(fields) > 1 and fields[1].strip() else None
+            batch.append({"campaign_id": campaign_id, "phone_number": phone, "name": name})
+            if len(batch) >= UPLOAD_BATCH_SIZE:
+                await flush()
+
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        await add(lines)
+    await add([pending + decoder.decode(b"", final=True)])
+    await flush()
+    await db.commit()
+    # Una fila de encabezado (p. ej. "telefono,nombre") cuenta como inválida.
+    return {"added": added, "invalid": invalid}
+
+
+@campaign_router.post("/{campaign_id}/start")
+async def start_campaign(campaign_id: int, company: Company = Depends(get_current_company),
+                         db: AsyncSession = Depends(get_db)):
+    campaign = await _get_campaign(db, company, campaign_id, lock=True)
+    if campaign.status != "draft":
+        raise HTTPException(status_code=409, detail=f"La campaña está en estado '{campaign.status}'.")
+    campaign.status = "running"
+    campaign.started_at = _utcnow()
+    campaign.lease_until = None
+    await db.commit()
+    wake_campaign_runner()
+    return _campaign_dict(campaign)
+
+
+@campaign_router.post("/{campaign_id}/cancel")
+async def cancel_campaign(campaign_id: int, company: Company = Depends(get_current_company),
+                          db: AsyncSession = Depends(get_db)):
+    """Detiene la campaña; los mensajes ya encolados se envían igual."""
+    campaign = await _get_campaign(db, company, campaign_id, lock=True)
+    if campaign.status not in ("draft", "running"):
+        raise HTTPException(status_code=409, detail=f"La campaña está en estado '{campaign.status}'.")
+    campaign.status = "cancelled"
+    campaign.finished_at = _utcnow()
+    campaign.lease_until = None
+    await db.commit()
+    return _campaign_dict(campaign)
@@ -0,0 +1,462 @@
+"""
+Motor declarativo del flujo de conversación por WhatsApp.
+
+El flujo de cada empresa se compila una sola vez a partir de company_metadata
+(appointment_slots, allow_parallel_appointments, etc.) en un CompiledFlow con los pasos,
+las preguntas y los extractores ya resueltos. En cada turno run_turn recorre la tabla
+TURN_RULES en orden: la primera regla que aplica produce la respuesta y deja en el Turn
+los cambios de sesión, que el handler persiste con una sola escritura y un solo commit.
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from apps.ai.nlp_utils import detect_intent_with_source, extract_info
+from apps.calendar.calendar_integration import (
+    create_calendar_event,
+    delete_calendar_event,
+    find_user_events
+)
+from apps.calendar.availability_cache import (
+    prefetch_availability,
+    is_time_slot_available_cached,
+    record_created_event,
+    invalidate_calendar
+)
+from apps.monitoring.metrics import track_stage
+from apps.whatsapp.session_state import SessionState
+from apps.whatsapp.utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+DATETIME_SLOT_KEYS = frozenset({"datetime", "fecha", "hora", "fecha_hora", "date", "time"})
+SCHEDULE_INTENTS = frozenset({"schedule_appointment", "agendar_cita", "cita"})
+
+# Palabras que, en medio de un agendamiento, reinician el flujo.
+RESET_GREETINGS = ("hola", "buenos días", "buenas tardes", "buenas noches", "saludo", "hey")
+_RESET_GREETINGS_RE = re.compile("|".join(map(re.escape, RESET_GREETINGS)))
+# Saludos reconocidos fuera del flujo y su respuesta.
+GREETING_REPLIES = (
+    ("hola", "¡Hola!"),
+    ("buenos días", "¡Buenos días!"),
+    ("buenas tardes", "¡Buenas tardes!"),
+    ("buenas noches", "¡Buenas noches!"),
+    ("hey", "¡Hey!"),
+)
+
+APPOINTMENT_DURATION = timedelta(hours=1)
+
+
+@dataclass(frozen=True)
+class SlotStep:
+    """Un paso del flujo de agendamiento: qué dato pedir, cómo preguntarlo y cómo extraerlo."""
+    key: str
+    label: str
+    kind: str  # 'name' | 'options' | 'datetime' | 'text'
+    prompt: str
+    start_prompt: str
+    options: Tuple[str, ...] = ()
+    normalized_options: Tuple[str, ...] = ()
+
+    def match_option(self, value: str) -> Optional[str]:
+        """Busca la opción válida que corresponde al valor extraído (exacta y luego parcial)."""
+        normalized = normalize_text(value)
+        for option, normalized_option in zip(self.options, self.normalized_options):
+            if normalized_option == normalized:
+                return option
+        for option, normalized_option in zip(self.options, self.normalized_options):
+            if normalized in normalized_option:
+                return option
+        return None
+
+
+@dataclass(frozen=True)
+class CompiledFlow:
+    """Flujo de una empresa ya compilado: pasos en orden y datos derivados de la metadata."""
+    company_name: str
+    allow_parallel: bool
+    steps: Tuple[SlotStep, ...]
+    name_key: str = "name"
+    datetime_key: Optional[str] = None
+    resource_keys: Tuple[str, ...] = ()
+
+    def next_step(self, slots_filled: Dict[str, Any]) -> Optional[SlotStep]:
+        for step in self.steps:
+            if step.key not in slots_filled:
+                return step
+        return None
+
+
+def _compile_step(slot: Dict[str, Any]) -> SlotStep:
+    key = slot["key"]
+    label = slot.get("label", key)
+    if key == "name":
+        prompt = "¿Podrías indicarme el nombre de la persona para quien es la cita?"
+        return SlotStep(key=key, label=label, kind="name", prompt=prompt, start_prompt=prompt)
+    if "options" in slot:
+        options = tuple(slot["options"])
+        prompt = (
+            f"¿Con qué {label} prefieres tu cita? Puedes elegir entre {', '.join(options)}."
+        )
+        return SlotStep(
+            key=key,
+            label=label,
+            kind="options",
+            prompt=prompt,
+            start_prompt=prompt,
+            options=options,
+            normalized_options=tuple(normalize_text(o) for o in options),
+        )
+    if key in DATETIME_SLOT_KEYS:
+        prompt = "¿Para qué fecha y hora deseas la cita?"
+        return SlotStep(key=key, label=label, kind="datetime", prompt=prompt, start_prompt=prompt)
+    return SlotStep(
+        key=key,
+        label=label,
+        kind="text",
+        prompt=f"Por favor indícame {label}.",
+        start_prompt=f"Para agendar tu cita necesito saber {label}.",
+    )
+
+
+def compile_flow(company_name: str, company_metadata: Dict[str, Any]) -> CompiledFlow:
+    """Compila la metadata de una empresa en un CompiledFlow."""
+    steps = tuple(_compile_step(slot) for slot in company_metadata.get("appointment_slots", []))
+    datetime_key = next((s.key for s in steps if s.kind == "datetime"), None)
+    return CompiledFlow(
+        company_name=company_name or "la empresa",
+        allow_parallel=company_metadata.get("allow_parallel_appointments", True),
+        steps=steps,
+        datetime_key=datetime_key,
+        resource_keys=tuple(s.key for s in steps if s.kind == "options"),
+    )
+
+
+# company_id -> (metadata con la que se compiló, flujo compilado)
+_compiled_flows: Dict[int, Tuple[Dict[str, Any], CompiledFlow]] = {}
+
+
+def get_compiled_flow(company) -> CompiledFlow:
+    """
+    Devuelve el flujo compilado de la empresa. Solo se recompila si cambió su nombre o su
+    company_metadata (la comparación de dicts pequeños es mucho más barata que compilar).
+    """
+    metadata = company.company_metadata or {}
+    cached = _compiled_flows.get(company.id)
+    if cached and cached[0] == metadata and cached[1].company_name == (company.name or "la empresa"):
+        return cached[1]
+    flow = compile_flow(company.name, metadata)
+    _compiled_flows[company.id] = (metadata, flow)
+    return flow
+
+
+@dataclass(slots=True)
+class Turn:
+    """Estado de un turno: entrada, sesión de trabajo y resultado."""
+    flow: CompiledFlow
+    company: Any
+    user_phone_number: str
+    message_text: str
+    state: SessionState
+    text_lower: str = ""
+    intent: Optional[str] = None
+    # "keywords" o "llm": si la intención se resolvió con el fallback al LLM.
+    intent_source: Optional[str] = None
+    reply: Optional[str] = None
+    session_changed: bool = False
+    # Regla que respondió el turno.
+    rule: Optional[str] = None
+    # Cambios de citas que el handler escribe en la misma transacción que la sesión.
+    booked_appointment: Optional[Dict[str, Any]] = None
+    cancelled_event_id: Optional[str] = None
+    # session_context ya serializado; set_session lo invalida.
+    _context: Optional[Dict[str, Any]] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.text_lower = self.message_text.lower().strip()
+
+    def set_session(self, **values) -> None:
+        for name, value in values.items():
+            setattr(self.state, name, value)
+        self.session_changed = True
+        self._context = None
+
+    @property
+    def in_appointment_flow(self) -> bool:
+        return self.state.in_appointment_flow
+
+    @property
+    def session_context(self) -> Dict[str, Any]:
+        """Estado de la sesión en forma de dict, como contexto para los prompts del LLM."""
+        if self._context is None:
+            self._context = self.state.to_json_dict()
+        return self._context
+
+    def greeting_prefix(self) -> str:
+        return f"Soy el asistente virtual para {self.flow.company_name}. ¿En qué puedo ayudarte?"
+
+
+# === Extractores por tipo de slot ===
+
+async def _extract_name(turn: Turn, step: SlotStep):
+    info = await extract_info(
+        turn.message_text, turn.session_context, user_phone=turn.user_phone_number, slot="name"
+    )
+    return info.get("name")
+
+
+async def _extract_option(turn: Turn, step: SlotStep):
+    info = await extract_info(
+        turn.message_text,
+        turn.session_context,
+        user_phone=turn.user_phone_number,
+        slot=step.key,
+        options=list(step.options),
+    )
+    gemini_value = info.get(step.key)
+    return step.match_option(gemini_value) if gemini_value else None
+
+
+async def _extract_datetime(turn: Turn, step: SlotStep):
+    info = await extract_info(
+        turn.message_text, turn.session_context, user_phone=turn.user_phone_number, slot=step.key, options=None
+    )
+    return info.get("datetime") or info.get(step.key)
+
+
+async def _extract_text(turn: Turn, step: SlotStep):
+    info = await extract_info(turn.message_text, turn.session_context, user_phone=turn.user_phone_number)
+    return info.get(step.key)
+
+
+SLOT_EXTRACTORS: Dict[str, Callable[[Turn, SlotStep], Awaitable[Any]]] = {
+    "name": _extract_name,
+    "options": _extract_option,
+    "datetime": _extract_datetime,
+    "text": _extract_text,
+}
+
+
+# === Acciones de la tabla de transiciones ===
+
+async def _reset_flow(turn: Turn) -> bool:
+    turn.set_session(in_appointment_flow=False, slots_filled={})
+    turn.reply = f"¡Hola! {turn.greeting_prefix()}"
+    return True
+
+
+async def _cancel_appointment(turn: Turn) -> bool:
+    company = turn.company
+    calendar_id = company.calendar_email
+    event_id = turn.state.event_id
+    if not event_id:
+        # La sesión no guarda la cita (p. ej. sesión nueva): se busca en el calendario
+        # la próxima cita etiquetada con el teléfono del usuario.
+        user_events = await find_user_events(
+            calendar_id,
+            turn.user_phone_number,
+            company_id=company.id,
+            max_results=1
+        )
+        if user_events:
+            event_id = user_events[0].get("id")
+
+    if not event_id:
+        turn.reply = "No se encontró una cita previa para cancelar. ¿Podrías indicarme la fecha y hora de la cita que deseas cancelar?"
+    elif delete_calendar_event(calendar_id, event_id):
+        invalidate_calendar(calendar_id)
+        turn.set_session(event_id=None)
+        turn.cancelled_event_id = event_id
+        turn.reply = "Tu cita ha sido cancelada y eliminada del calendario."
+    else:
+        turn.reply = "Hubo un error al intentar cancelar tu cita. Por favor intenta más tarde."
+    return True
+
+
+async def _collect_slot(turn: Turn) -> bool:
+    flow = turn.flow
+    slots_filled = dict(turn.state.slots_filled)
+    step = flow.next_step(slots_filled)
+    if step is None:
+        return False
+
+    value = await SLOT_EXTRACTORS[step.kind](turn, step)
+    if not value:
+        turn.reply = step.prompt
+        return True
+
+    slots_filled[step.key] = value
+    turn.set_session(slots_filled=slots_filled)
+
+    if step.kind == "options":
+        # Ya se conoce el recurso: se precarga su disponibilidad mientras
+        # se piden los demás datos, para que la confirmación no espere al calendario.
+        prefetch_availability(
+            turn.company.calendar_email,
+            resource_name=value if flow.allow_parallel else None,
+            company_id=turn.company.id
+        )
+
+    pending = flow.next_step(slots_filled)
+    if pending is not None:
+        turn.reply = pending.prompt
+        return True
+    return await _book_appointment(turn, slots_filled)
+
+
+def _parse_appointment_datetime(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+
+async def _book_appointment(turn: Turn, slots_filled: Dict[str, Any]) -> bool:
+    flow = turn.flow
+    company = turn.company
+    turn.set_session(in_appointment_flow=False)
+
+    name = slots_filled.get(flow.name_key, "")
+    resource_value = next((slots_filled[k] for k in flow.resource_keys if k in slots_filled), None)
+    doctor_or_resource = resource_value or ""
+    appointment_dt = _parse_appointment_datetime(slots_filled.get(flow.datetime_key)) if flow.datetime_key else None
+    fecha_str = appointment_dt.strftime("%d/%m/%Y") if appointment_dt else ""
+    hora_str = appointment_dt.strftime("%H:%M") if appointment_dt else ""
+
+    summary = (
+        f"Cita {name} con {doctor_or_resource} - {flow.company_name}"
+        if name
+        else f"Cita con {doctor_or_resource} - {flow.company_name}"
+    )
+    description = (
+        f"Cita para {name} con {doctor_or_resource} agendada por WhatsApp para el paciente {turn.user_phone_number}."
+    )
+    turn.reply = f"Perfecto, {name}, tu cita con {doctor_or_resource} fue agendada para el {fecha_str} a las {hora_str}."
+
+    if not appointment_dt:
+        return True
+
+    try:
+        end_datetime_obj = appointment_dt + APPOINTMENT_DURATION
+        calendar_id = company.calendar_email
+        with track_stage("calendar_check", company.id):
+            slot_available = await is_time_slot_available_cached(
+                calendar_id,
+                appointment_dt,
+                end_datetime_obj,
+                resource_name=resource_value,
+                allow_parallel_appointments=flow.allow_parallel,
+                company_id=company.id
+            )
+        if not slot_available:
+            # Se sigue en el flujo y solo se vuelve a pedir la fecha y hora.
+            slots_filled.pop(flow.datetime_key, None)
+            turn.set_session(in_appointment_flow=True, slots_filled=slots_filled)
+            turn.reply = f"Ya hay una cita agendada con {doctor_or_resource or 'el especialista'} para esa fecha y hora. ¿Quieres elegir otro horario?"
+            return True
+
+        with track_stage("calendar_insert", company.id):
+            calendar_event = await create_calendar_event(
+                summary,
+                description,
+                appointment_dt,
+                end_datetime_obj,
+                calendar_id,
+                resource_name=resource_value,
+                company_id=company.id,
+                user_phone=turn.user_phone_number,
+            )
+        status = calendar_event.get("status") if isinstance(calendar_event, dict) else None
+        if status == "success":
+            record_created_event(
+                calendar_id,
+                appointment_dt,
+                end_datetime_obj,
+                resource_name=resource_value,
+                company_id=company.id
+            )
+            turn.set_session(event_id=calendar_event.get("event_id"))
+            turn.booked_appointment = {
+                "client_name": name,
+                "scheduled_for": appointment_dt,
+                "event_id": calendar_event.get("event_id"),
+            }
+        elif status == "conflict":
+            turn.reply = calendar_event.get("message", turn.reply)
+        elif status == "error":
+            turn.reply += " (No se pudo crear el evento en el calendario)"
+    except Exception as e:
+        logger.error(f"Error al crear evento en calendario o verificar disponibilidad: {e}")
+    return True
+
+
+async def _greet(turn: Turn) -> bool:
+    for saludo, respuesta_saludo in GREETING_REPLIES:
+        if saludo in turn.text_lower:
+            turn.reply = f"{respuesta_saludo} {turn.greeting_prefix()}"
+            return True
+    return False
+
+
+async def _start_appointment_flow(turn: Turn) -> bool:
+    steps = turn.flow.steps
+    if not steps:
+        turn.reply = "No hay configuración de slots para agendar citas en esta empresa."
+        return True
+    turn.set_session(in_appointment_flow=True, slots_filled={})
+    turn.reply = steps[0].start_prompt
+    return True
+
+
+async def _answer_schedule(turn: Turn) -> bool:
+    horario = turn.company.schedule or "No tengo registrado el horario en este momento."
+    turn.reply = f"Nuestro horario de atención es: {horario}"
+    return True
+
+
+async def _fallback(turn: Turn) -> bool:
+    turn.reply = turn.greeting_prefix()
+    return True
+
+
+@dataclass(frozen=True, slots=True)
+class Rule:
+    """Fila de la tabla de transiciones: condición, acción y si necesita la intención detectada."""
+    name: str
+    when: Callable[[Turn], bool]
+    action: Callable[[Turn], Awaitable[bool]]
+    needs_intent: bool = False
+
+
+# Se evalúan en orden; la primera regla cuya acción retorne True responde el turno.
+TURN_RULES: Tuple[Rule, ...] = (
+    Rule(
+        "reset_on_greeting",
+        lambda t: t.in_appointment_flow and _RESET_GREETINGS_RE.search(t.text_lower) is not None,
+        _reset_flow,
+    ),
+    Rule("cancel_appointment", lambda t: t.intent == "cancel_appointment", _cancel_appointment, needs_intent=True),
+    Rule("collect_slot", lambda t: t.in_appointment_flow, _collect_slot),
+    Rule("greet", lambda t: True, _greet),
+    Rule("start_appointment_flow", lambda t: t.intent in SCHEDULE_INTENTS, _start_appointment_flow, needs_intent=True),
+    Rule("ask_schedule", lambda t: "horario" in t.text_lower, _answer_schedule),
+    Rule("fallback", lambda t: True, _fallback),
+)
+
+
+async def run_turn(turn: Turn) -> Turn:
+    """Ejecuta las reglas sobre el turno hasta que una responda."""
+    for rule in TURN_RULES:
+        if rule.needs_intent and turn.intent is None:
+            turn.intent, turn.intent_source = await detect_intent_with_source(turn.message_text, turn.session_context)
+        if rule.when(turn) and await rule.action(turn):
+            turn.rule = rule.name
+            return turn
+    return turn
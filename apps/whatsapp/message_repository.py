@@ -2,13 +2,25 @@ import logging
 from datetime import datetime, timezone
 from typing import List, Dict, Any
 
-from sqlalchemy import select, desc
+from sqlalchemy import Integer, bindparam, desc, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from apps.dashboard import live_feed
 from db.models.messages import Message
 
 logger = logging.getLogger(__name__)
 
+# Sentencias precompiladas del historial: se construyen una vez y SQLAlchemy reutiliza su
+# cache key y el SQL compilado. La variante con company_id permite descartar particiones.
+_HISTORY_BASE = (
+    select(Message)
+    .where(Message.chat_session_id == bindparam("chat_session_id"))
+    .order_by(desc(Message.timestamp))
+    .limit(bindparam("limit", type_=Integer))
+)
+HISTORY_STMT = _HISTORY_BASE
+HISTORY_BY_COMPANY_STMT = _HISTORY_BASE.where(Message.company_id == bindparam("company_id"))
+
 async def add_message(
     db_session: AsyncSession,
     message_sid: str,
@@ -18,7 +30,7 @@ async def add_message(
     company_id: int,
     chat_session_id: int
 ) -> None:
-    logger.info(f"MESSAGE_REPO: Añadiendo mensaje - SID: {message_sid}, Dir: {direction}, Body: '{body[:70]}'")
+    logger.debug("MESSAGE_REPO: Añadiendo mensaje - SID: %s, Dir: %s, Body: %.70r", message_sid, direction, body)
     try:
         new_message = Message(
             message_sid=message_sid,
@@ -30,19 +42,29 @@ async def add_message(
             timestamp=datetime.now(timezone.utc).replace(tzinfo=None) 
         )
         db_session.add(new_message)
+        # Se entrega al feed en vivo solo si la transacción confirma (ver apps/dashboard/live_feed.py).
+        await live_feed.publish_message(
+            db_session, company_id, chat_session_id, direction, body,
+            sender_phone_number, message_sid, new_message.timestamp,
+        )
     except Exception as e:
         logger.error(f"MESSAGE_REPO: Error al añadir mensaje: {e}", exc_info=True)
         raise
 
-async def get_message_history(db_session: AsyncSession, chat_session_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    logger.info(f"MESSAGE_REPO: Obteniendo historial para chat_session_id={chat_session_id}, limit={limit}")
+async def get_message_history(
+    db_session: AsyncSession,
+    chat_session_id: int,
+    limit: int = 10,
+    company_id: int = None
+) -> List[Dict[str, Any]]:
+    logger.debug("MESSAGE_REPO: Obteniendo historial para chat_session_id=%s, limit=%s", chat_session_id, limit)
     try:
-        result = await db_session.execute(
-            select(Message)
-            .where(Message.chat_session_id == chat_session_id)
-            .order_by(desc(Message.timestamp))
-            .limit(limit)
-        )
+        params = {"chat_session_id": chat_session_id, "limit": limit}
+        stmt = HISTORY_STMT
+        if company_id is not None:
+            stmt = HISTORY_BY_COMPANY_STMT
+            params["company_id"] = company_id
+        result = await db_session.execute(stmt, params)
         messages = result.scalars().all()
 
         formatted_history = []
@@ -50,7 +72,7 @@ async def get_message_history(db_session: AsyncSession, chat_session_id: int, li
             role = "user" if msg.direction == "in" else "model"
             formatted_history.append({"role": role, "parts": [{"text": msg.body}]})
 
-        logger.info(f"MESSAGE_REPO: Historial obtenido para chat_session_id={chat_session_id}: {len(formatted_history)} mensajes.")
+        logger.debug("MESSAGE_REPO: Historial obtenido para chat_session_id=%s: %d mensajes.", chat_session_id, len(formatted_history))
         return formatted_history
     except Exception as e:
         logger.error(f"MESSAGE_REPO: Error al obtener historial de mensajes: {e}", exc_info=True)
@@ -0,0 +1,525 @@
+"""
+Envío asíncrono de mensajes salientes de WhatsApp (Twilio) con cola durable.
+
+Los mensajes proactivos (notificaciones, recordatorios, campañas) no se envían en línea:
+se encolan en la tabla outbound_messages dentro de la transacción del llamador
+(enqueue_message / enqueue_messages) y un OutboundWorker por proceso los envía:
+
+  - Reclama lotes con UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED), así que
+    varios workers (o réplicas de la app) no envían el mismo mensaje. Un mensaje reclamado
+    queda en 'sending' con un plazo (OUTBOUND_SENDING_LEASE_SECONDS); si el proceso muere,
+    vuelve a tomarse al vencer (entrega al menos una vez).
+  - Envía con un cliente httpx asíncrono con pool de conexiones contra la API REST de Twilio.
+  - Respeta un límite por número remitente (OUTBOUND_RATE_PER_SECOND, OUTBOUND_BURST)
+    compartido entre workers y réplicas: al reclamar un lote se reservan sus turnos de envío en
+    outbound_sender_rates (una fila por remitente), así que el total no crece con los procesos.
+  - Reintenta con backoff exponencial y jitter los errores transitorios (red, 429, 5xx) hasta
+    OUTBOUND_MAX_ATTEMPTS; los errores permanentes (número inválido, etc.) quedan en 'failed'.
+  - Con OUTBOUND_STATUS_CALLBACK_URL, Twilio informa sent/delivered/read/failed en
+    POST /whatsapp/status, y el estado solo avanza (un callback atrasado no lo retrocede).
+
+Variables:
+  TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN   credenciales (sin ellas el worker no arranca)
+  TWILIO_PHONE_NUMBER                      remitente por defecto
+  OUTBOUND_WORKER_ENABLED                  iniciar el worker con la app (true)
+  OUTBOUND_RATE_PER_SECOND / OUTBOUND_BURST  mensajes por segundo y ráfaga por remitente, en total
+                                           para todos los procesos (10 / 10)
+  OUTBOUND_CONCURRENCY                     envíos HTTP simultáneos por worker (10)
+  OUTBOUND_BATCH_SIZE                      mensajes reclamados por lote (50)
+  OUTBOUND_MAX_ATTEMPTS                    intentos antes de 'failed' (6)
+  OUTBOUND_BACKOFF_BASE_SECONDS / OUTBOUND_BACKOFF_MAX_SECONDS  (5 / 900)
+  OUTBOUND_POLL_SECONDS                    espera sin mensajes pendientes (2)
+  OUTBOUND_STATUS_CALLBACK_URL             URL pública de /whatsapp/status (sin callback)
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import Interval, bindparam, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from apps.monitoring.metrics import record_outbound_send, record_outbound_status
+from db.database import SessionLocal, get_db_session
+from db.models.outbound_message import OutboundMessage, OutboundSenderRate
+
+logger = logging.getLogger(__name__)
+
+TWILIO_API_BASE = "https://api.twilio.com/2010-04-01"
+
+OUTBOUND_RATE_PER_SECOND = float(os.getenv("OUTBOUND_RATE_PER_SECOND", "10"))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "10"))
+OUTBOUND_CONCURRENCY = int(os.getenv("OUTBOUND_CONCURRENCY", "10"))
+OUTBOUND_BATCH_SIZE = int(os.getenv("OUTBOUND_BATCH_SIZE", "50"))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "6"))
+OUTBOUND_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOUND_BACKOFF_BASE_SECONDS", "5"))
+OUTBOUND_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOUND_BACKOFF_MAX_SECONDS", "900"))
+OUTBOUND_POLL_SECONDS = float(os.getenv("OUTBOUND_POLL_SECONDS", "2"))
+OUTBOUND_SENDING_LEASE_SECONDS = int(os.getenv("OUTBOUND_SENDING_LEASE_SECONDS", "300"))
+
+PENDING_STATUSES = ("queued", "retry", "sending")
+
+# Orden de los estados: un mensaje solo avanza. Los estados intermedios de Twilio
+# (accepted, queued, sending) no cambian nada una vez que el worker tiene el SID.
+STATUS_RANK = {
+    "queued": 0, "retry": 0, "sending": 0,
+    "sent": 1,
+    "delivered": 2,
+    "read": 3,
+    "undelivered": 4, "failed": 4,
+}
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _strip_channel(number: str) -> str:
+    return number.replace("whatsapp:", "").strip() if number else number
+
+
+def default_from_number() -> Optional[str]:
+    return _strip_channel(os.getenv("TWILIO_PHONE_NUMBER"))
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Espera antes del siguiente intento: exponencial con tope y jitter (50% a 100%)."""
+    delay = min(OUTBOUND_BACKOFF_MAX_SECONDS, OUTBOUND_BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# === Límite de envío por remitente ===
+
+def _build_reserve_stmt():
+    # GCRA: cada reserva corre theoretical_arrival `step` (= cantidad / rate) desde el máximo
+    # entre su valor y ahora, con el reloj de Postgres (el mismo para todas las réplicas).
+    db_now = func.timezone("utc", func.now())
+    step = bindparam("step", type_=Interval)
+    stmt = pg_insert(OutboundSenderRate).values(
+        from_number=bindparam("from_number"), theoretical_arrival=db_now + step,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["from_number"],
+        set_={"theoretical_arrival": func.greatest(OutboundSenderRate.theoretical_arrival, db_now) + step},
+    ).returning(OutboundSenderRate.theoretical_arrival - db_now)
+
+
+RESERVE_STMT = _build_reserve_stmt()
+
+
+class SenderRateLimiter:
+    """
+    Límite de mensajes por segundo por número remitente (Twilio/WhatsApp limitan el
+    throughput por remitente), compartido por todos los workers y réplicas: las reservas se
+    hacen sobre una fila por remitente en outbound_sender_rates (GCRA), así que el total no se
+    multiplica por la cantidad de procesos. Permite ráfagas de `burst` envíos.
+    """
+
+    def __init__(self, rate: float = OUTBOUND_RATE_PER_SECOND, burst: int = OUTBOUND_BURST):
+        self.rate = rate
+        self.burst = max(burst, 1)
+
+    async def reserve(self, session, from_number: str, count: int) -> List[float]:
+        """
+        Reserva `count` envíos del remitente en la transacción de `session`. Retorna, para cada
+        uno, cuántos segundos hay que esperar antes de enviarlo.
+        """
+        if self.rate <= 0 or count <= 0:
+            return [0.0] * count
+        interval = 1 / self.rate
+        ahead = (await session.execute(
+            RESERVE_STMT, {"from_number": from_number, "step": timedelta(seconds=count * interval)}
+        )).scalar_one()
+        # `ahead` es lo que falta para el fin de esta reserva; la ráfaga adelanta todo el tramo.
+        first = ahead.total_seconds() - count * interval - (self.burst - 1) * interval
+        return [max(first + i * interval, 0.0) for i in range(count)]
+
+
+# === Cliente de Twilio ===
+
+class SendError(Exception):
+    """Error al enviar un mensaje; `retryable` indica si vale la pena reintentarlo."""
+
+    def __init__(self, message: str, retryable: bool, code: Optional[str] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.code = code
+
+
+class TwilioClient:
+    """Cliente asíncrono mínimo de la API de mensajes de Twilio, con pool de conexiones."""
+
+    def __init__(self, account_sid: str, auth_token: str, base_url: str = TWILIO_API_BASE,
+                 max_connections: int = OUTBOUND_CONCURRENCY, timeout: float = 15.0):
+        self.account_sid = account_sid
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            auth=(account_sid, auth_token),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    @classmethod
+    def from_env(cls) -> "TwilioClient":
+        account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+        auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+        if not account_sid or not auth_token:
+            raise EnvironmentError("Faltan variables de entorno de Twilio.")
+        return cls(account_sid, auth_token)
+
+    async def send(self, from_number: str, to_number: str, body: str, status_callback: Optional[str] = None) -> str:
+        """Envía un mensaje y retorna su SID. Lanza SendError si Twilio lo rechaza o no responde."""
+        data = {
+            "From": f"whatsapp:{_strip_channel(from_number)}",
+            "To": f"whatsapp:{_strip_channel(to_number)}",
+            "Body": body,
+        }
+        if status_callback:
+            data["StatusCallback"] = status_callback
+        try:
+            response = await self._client.post(f"/Accounts/{self.account_sid}/Messages.json", data=data)
+        except httpx.HTTPError as e:
+            raise SendError(f"{type(e).__name__}: {e}", retryable=True) from e
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        if response.is_success:
+            return payload["sid"]
+        code = payload.get("code")
+        retryable = response.status_code == 429 or response.status_code >= 500
+        raise SendError(
+            f"Twilio {response.status_code}: {payload.get('message') or response.text[:200]}",
+            retryable=retryable,
+            code=str(code) if code is not None else None,
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+# === Cola ===
+
+def _row(to_number: str, body: str, from_number: Optional[str], company_id: Optional[int],
+         idempotency_key: Optional[str]) -> Dict[str, Any]:
+    sender = _strip_channel(from_number) or default_from_number()
+    if not sender:
+        raise ValueError("No hay número remitente: indicar from_number o definir TWILIO_PHONE_NUMBER.")
+    now = _utcnow()
+    return {
+        "company_id": company_id,
+        "from_number": sender,
+        "to_number": _strip_channel(to_number),
+        "body": body,
+        "status": "queued",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "idempotency_key": idempotency_key,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+async def enqueue_messages(session, messages: Iterable[Dict[str, Any]]) -> int:
+    """
+    Encola varios mensajes en la transacción de `session` (el llamador hace commit).
+    Cada dict lleva to_number y body, y opcionalmente from_number, company_id e
+    idempotency_key; los que repiten una idempotency_key ya encolada se omiten.
+    Retorna cuántos se encolaron.
+    """
+    rows = [
+        _row(m["to_number"], m["body"], m.get("from_number"), m.get("company_id"), m.get("idempotency_key"))
+        for m in messages
+    ]
+    if not rows:
+        return 0
+    # Con la lista como parámetros la sentencia se compila una vez (y queda en caché) y
+    # SQLAlchemy la envía en lotes de INSERT ... VALUES; .values(rows) la recompilaría en cada
+    # llamada con un parámetro por celda.
+    stmt = (
+        pg_insert(OutboundMessage)
+        .on_conflict_do_nothing(index_elements=["idempotency_key"])
+        .returning(OutboundMessage.id)
+    )
+    result = await session.execute(stmt, rows)
+    return len(result.all())
+
+
+async def enqueue_message(session, to_number: str, body: str, from_number: Optional[str] = None,
+                          company_id: Optional[int] = None, idempotency_key: Optional[str] = None) -> bool:
+    """Encola un mensaje en la transacción de `session`. Retorna False si la idempotency_key ya existía."""
+    return await enqueue_messages(session, [{
+        "to_number": to_number,
+        "body": body,
+        "from_number": from_number,
+        "company_id": company_id,
+        "idempotency_key": idempotency_key,
+    }]) == 1
+
+
+# === Worker ===
+
+class OutboundWorker:
+    def __init__(self, client: TwilioClient, session_factory=SessionLocal,
+                 limiter: Optional[SenderRateLimiter] = None,
+                 batch_size: int = OUTBOUND_BATCH_SIZE, concurrency: int = OUTBOUND_CONCURRENCY,
+                 poll_seconds: float = OUTBOUND_POLL_SECONDS,
+                 status_callback_url: Optional[str] = None):
+        self.client = client
+        self._session_factory = session_factory
+        self.limiter = limiter or SenderRateLimiter()
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.status_callback_url = status_callback_url
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run(), name="outbound-worker")
+
+    def wake(self) -> None:
+        """Avisa que hay mensajes nuevos (evita esperar al siguiente sondeo)."""
+        self._wake.set()
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Deja de reclamar mensajes y espera a que termine el lote en curso."""
+        self._stopping = True
+        self._wake.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                logger.warning("El worker de salida no terminó en %.0f s; se cancela.", timeout)
+                self._task.cancel()
+        await self.client.aclose()
+
+    async def run(self) -> None:
+        logger.info("Worker de mensajes salientes iniciado (%.1f msg/s por remitente).", self.limiter.rate)
+        while not self._stopping:
+            try:
+                processed = await self.process_batch()
+            except Exception as e:
+                logger.error("Error en el worker de mensajes salientes: %s", e, exc_info=True)
+                processed = 0
+            if processed < self.batch_size and not self._stopping:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_batch(self) -> int:
+        """Reclama y envía un lote. Retorna cuántos mensajes se procesaron."""
+        claimed = await self._claim()
+        if claimed:
+            await asyncio.gather(*(self._deliver(row, send_at) for row, send_at in claimed))
+        return len(claimed)
+
+    async def _claim(self) -> List[Tuple[Any, float]]:
+        """
+        Reclama un lote y, en la misma transacción, reserva sus turnos de envío por remitente.
+        Retorna (fila, instante monotónico a partir del cual se puede enviar).
+        """
+        now = _utcnow()
+        pending = (
+            select(OutboundMessage.id)
+            .where(
+                OutboundMessage.status.in_(PENDING_STATUSES),
+                OutboundMessage.next_attempt_at <= now,
+            )
+            .order_by(OutboundMessage.next_attempt_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(OutboundMessage)
+            .where(OutboundMessage.id.in_(pending))
+            .values(
+                status="sending",
+                attempts=OutboundMessage.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=OUTBOUND_SENDING_LEASE_SECONDS),
+                updated_at=now,
+            )
+            .returning(
+                OutboundMessage.id,
+                OutboundMessage.from_number,
+                OutboundMessage.to_number,
+                OutboundMessage.body,
+                OutboundMessage.attempts,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        async with self._session_factory() as session:
+            result = await session.execute(stmt)
+            rows = result.all()
+            by_sender: Dict[str, List[Any]] = {}
+            for row in rows:
+                by_sender.setdefault(row.from_number, []).append(row)
+            delays: Dict[int, float] = {}
+            for from_number, sender_rows in by_sender.items():
+                waits = await self.limiter.reserve(session, from_number, len(sender_rows))
+                delays.update((row.id, wait) for row, wait in zip(sender_rows, waits))
+            # El plazo de 'sending' cuenta desde el turno reservado, no desde el reclamo.
+            delayed = [
+                {"id": message_id, "next_attempt_at": now + timedelta(seconds=OUTBOUND_SENDING_LEASE_SECONDS + wait)}
+                for message_id, wait in delays.items() if wait > 0
+            ]
+            if delayed:
+                await session.execute(update(OutboundMessage), delayed)
+            await session.commit()
+        reserved_at = time.monotonic()
+        return [(row, reserved_at + delays[row.id]) for row in rows]
+
+    def _callback_for(self, message_id: int) -> Optional[str]:
+        if not self.status_callback_url:
+            return None
+        separator = "&" if "?" in self.status_callback_url else "?"
+        return f"{self.status_callback_url}{separator}outbound_id={message_id}"
+
+    async def _deliver(self, row, send_at: float) -> None:
+        # Se espera el turno reservado antes de ocupar un lugar de concurrencia.
+        await asyncio.sleep(max(send_at - time.monotonic(), 0.0))
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                sid = await self.client.send(row.from_number, row.to_number, row.body, self._callback_for(row.id))
+            except SendError as e:
+                await self._record_failure(row, e, time.perf_counter() - started)
+                return
+            record_outbound_send(time.perf_counter() - started, "sent")
+            now = _utcnow()
+            await self._update(
+                row.id,
+                status="sent", provider_sid=sid, sent_at=now, last_error=None, error_code=None,
+            )
+
+    async def _record_failure(self, row, error: SendError, seconds: float) -> None:
+        if error.retryable and row.attempts < OUTBOUND_MAX_ATTEMPTS:
+            delay = backoff_seconds(row.attempts)
+            record_outbound_send(seconds, "retry")
+            logger.warning(
+                "Envío %s falló (intento %d), reintento en %.0f s: %s", row.id, row.attempts, delay, error
+            )
+            await self._update(
+                row.id,
+                status="retry", next_attempt_at=_utcnow() + timedelta(seconds=delay),
+                last_error=str(error)[:500], error_code=error.code,
+            )
+        else:
+            record_outbound_send(seconds, "failed")
+            logger.error("Envío %s descartado tras %d intentos: %s", row.id, row.attempts, error)
+            await self._update(row.id, status="failed", last_error=str(error)[:500], error_code=error.code)
+
+    async def _update(self, message_id: int, **values) -> None:
+        # Solo si sigue reclamado: un callback de estado pudo haberlo avanzado antes.
+        stmt = (
+            update(OutboundMessage)
+            .where(OutboundMessage.id == message_id, OutboundMessage.status == "sending")
+            .values(updated_at=_utcnow(), **values)
+            .execution_options(synchronize_session=False)
+        )
+        async with self._session_factory() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+
+_worker: Optional[OutboundWorker] = None
+
+
+def start_outbound_worker() -> Optional[OutboundWorker]:
+    """Inicia el worker del proceso si está habilitado y hay credenciales de Twilio."""
+    global _worker
+    if os.getenv("OUTBOUND_WORKER_ENABLED", "true").strip().lower() not in ("1", "true", "yes", "si", "sí", "on"):
+        logger.info("Worker de mensajes salientes desactivado (OUTBOUND_WORKER_ENABLED).")
+        return None
+    try:
+        client = TwilioClient.from_env()
+    except EnvironmentError as e:
+        logger.warning("Worker de mensajes salientes no iniciado: %s", e)
+        return None
+    _worker = OutboundWorker(client, status_callback_url=os.getenv("OUTBOUND_STATUS_CALLBACK_URL"))
+    _worker.start()
+    return _worker
+
+
+async def stop_outbound_worker() -> None:
+    global _worker
+    if _worker is not None:
+        await _worker.stop()
+        _worker = None
+
+
+def wake_outbound_worker() -> None:
+    """Llamar tras hacer commit de mensajes encolados para enviarlos sin esperar al sondeo."""
+    if _worker is not None:
+        _worker.wake()
+
+
+# === Callback de estado de Twilio ===
+
+def _signature_is_valid(request: Request, form: Dict[str, str]) -> bool:
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    if not auth_token:
+        return True
+    from twilio.request_validator import RequestValidator
+
+    # Detrás de un proxy la URL que firmó Twilio es la configurada, no la que ve la app.
+    configured = os.getenv("OUTBOUND_STATUS_CALLBACK_URL")
+    url = str(request.url)
+    if configured:
+        base = configured.split("?", 1)[0]
+        url = f"{base}?{request.url.query}" if request.url.query else base
+    return RequestValidator(auth_token).validate(url, form, request.headers.get("X-Twilio-Signature", ""))
+
+
+async def apply_status(session, message_id: Optional[int], provider_sid: Optional[str], status: str,
+                       error_code: Optional[str] = None) -> bool:
+    """Avanza el estado del mensaje (nunca lo retrocede). Retorna True si cambió."""
+    if message_id is not None:
+        condition = OutboundMessage.id == message_id
+    elif provider_sid:
+        condition = OutboundMessage.provider_sid == provider_sid
+    else:
+        return False
+    result = await session.execute(select(OutboundMessage).where(condition).with_for_update())
+    message = result.scalars().first()
+    if message is None or STATUS_RANK.get(status, -1) <= STATUS_RANK.get(message.status, 0):
+        return False
+    message.status = status
+    if provider_sid and not message.provider_sid:
+        message.provider_sid = provider_sid
+    if message.sent_at is None:
+        message.sent_at = _utcnow()
+    if error_code:
+        message.error_code = error_code
+    return True
+
+
+status_router = APIRouter()
+
+
+@status_router.post("/status")
+async def twilio_status_callback(request: Request):
+    form = {key: value for key, value in (await request.form()).items()}
+    if not _signature_is_valid(request, form):
+        raise HTTPException(status_code=403, detail="Firma de Twilio inválida.")
+    status = (form.get("MessageStatus") or "").lower()
+    raw_id = request.query_params.get("outbound_id")
+    message_id = int(raw_id) if raw_id and raw_id.isdigit() else None
+    async with get_db_session() as session:
+        changed = await apply_status(session, message_id, form.get("MessageSid"), status, form.get("ErrorCode"))
+        await session.commit()
+    record_outbound_status(status if status in STATUS_RANK else "other")
+    logger.debug("Callback de estado %s para %s (aplicado: %s).", status, form.get("MessageSid"), changed)
+    return PlainTextResponse("", status_code=204)
@@ -0,0 +1,342 @@
+"""
+Recordatorios de citas por WhatsApp.
+
+Un ReminderScheduler por proceso mantiene en memoria un min-heap con una entrada por cita
+pendiente, (hora de envío, id, versión), de tamaño constante: el resto de los datos se lee
+al enviar. El loop duerme exactamente hasta la próxima hora de envío (o hasta el siguiente
+sondeo de cambios) y despacha en lotes todo lo vencido.
+
+  - Carga inicial: las citas futuras con status 'scheduled' y reminder_sent_at NULL, por
+    páginas de id (keyset).
+  - Cambios incrementales: cada REMINDER_POLL_SECONDS lee solo las filas con updated_at
+    posterior a la marca de agua (con un solape de REMINDER_POLL_OVERLAP_SECONDS para no
+    perder transacciones que confirmaron tarde). Una cita nueva o reprogramada agrega una
+    entrada con su nueva versión (updated_at); una cancelada se quita del índice de
+    versiones. Las entradas viejas quedan en el heap y se descartan al salir (borrado
+    perezoso); si superan a las vigentes, el heap se reconstruye.
+  - Envío: un UPDATE ... SET reminder_sent_at WHERE reminder_sent_at IS NULL reclama el
+    lote (así que varios procesos no duplican recordatorios) y, en la misma transacción, los
+    mensajes se encolan en outbound_messages con idempotency_key "reminder:<id>:<horario>"
+    (una cita reprogramada recibe el recordatorio de su nuevo horario). El worker
+    de apps/whatsapp/outbound_sender.py los envía respetando el límite por remitente.
+
+Las citas agendadas dentro de la ventana de aviso (menos de REMINDER_LEAD_MINUTES antes)
+no reciben recordatorio.
+
+Variables:
+  REMINDERS_ENABLED              iniciar el programador con la app (true)
+  REMINDER_LEAD_MINUTES          anticipación del recordatorio (1440 = 24 h)
+  REMINDER_POLL_SECONDS          intervalo de lectura de cambios (5)
+  REMINDER_POLL_OVERLAP_SECONDS  solape de la marca de agua (10)
+  REMINDER_BATCH_SIZE            recordatorios por lote de envío (500)
+
+El texto se puede personalizar por empresa con company_metadata["reminder_message"]
+(placeholders {name}, {empresa}, {fecha}, {hora}); si la plantilla no se puede formatear se
+usa DEFAULT_REMINDER_MESSAGE.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from apps.monitoring.metrics import REMINDERS_PENDING, observe_reminder_delay, record_reminders
+from apps.whatsapp.appointment_repository import to_local
+from apps.whatsapp.outbound_sender import enqueue_messages, wake_outbound_worker
+from db.database import SessionLocal
+from db.models.appointment import Appointment
+from db.models.company import Company
+
+logger = logging.getLogger(__name__)
+
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "1440"))
+REMINDER_POLL_SECONDS = float(os.getenv("REMINDER_POLL_SECONDS", "5"))
+REMINDER_POLL_OVERLAP_SECONDS = float(os.getenv("REMINDER_POLL_OVERLAP_SECONDS", "10"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+LOAD_PAGE_SIZE = 5000
+
+DEFAULT_REMINDER_MESSAGE = (
+    "Hola {name}, te recordamos tu cita en {empresa} el {fecha} a las {hora}. "
+    "Si no puedes asistir, escríbenos para cancelarla o reprogramarla."
+)
+
+# (hora de envío en segundos epoch, id de la cita, versión = updated_at en segundos epoch)
+HeapEntry = Tuple[float, int, float]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _epoch(value: datetime) -> float:
+    """UTC sin zona -> segundos epoch."""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class ReminderHeap:
+    """Min-heap por hora de envío con borrado perezoso (versiones por cita)."""
+
+    def __init__(self):
+        self._heap: List[HeapEntry] = []
+        self._versions: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def schedule(self, appointment_id: int, send_at: float, version: float) -> None:
+        if self._versions.get(appointment_id) == version:
+            return
+        self._versions[appointment_id] = version
+        heapq.heappush(self._heap, (send_at, appointment_id, version))
+        self._maybe_compact()
+
+    def discard(self, appointment_id: int) -> None:
+        self._versions.pop(appointment_id, None)
+
+    def next_send_at(self) -> Optional[float]:
+        """Hora de la próxima entrada vigente (descarta las obsoletas del tope)."""
+        while self._heap:
+            send_at, appointment_id, version = self._heap[0]
+            if self._versions.get(appointment_id) == version:
+                return send_at
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: float, limit: int) -> List[HeapEntry]:
+        due = []
+        while len(due) < limit and self.next_send_at() is not None and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            del self._versions[entry[1]]
+            due.append(entry)
+        return due
+
+    def _maybe_compact(self) -> None:
+        if len(self._heap) > 2 * len(self._versions) + 1024:
+            self._heap = [e for e in self._heap if self._versions.get(e[1]) == e[2]]
+            heapq.heapify(self._heap)
+
+
+class ReminderScheduler:
+    def __init__(self, session_factory=SessionLocal, lead_minutes: int = REMINDER_LEAD_MINUTES,
+                 poll_seconds: float = REMINDER_POLL_SECONDS, batch_size: int = REMINDER_BATCH_SIZE):
+        self._session_factory = session_factory
+        self.lead = timedelta(minutes=lead_minutes)
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.heap = ReminderHeap()
+        self.watermark: Optional[datetime] = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run(), name="reminder-scheduler")
+
+    async def stop(self) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+
+    async def run(self) -> None:
+        loaded = False
+        next_poll = time.monotonic()
+        while not self._stopping:
+            failed = False
+            try:
+                if not loaded:
+                    await self.load()
+                    loaded = True
+                    next_poll = time.monotonic() + self.poll_seconds
+                if time.monotonic() >= next_poll:
+                    await self.poll_changes()
+                    next_poll = time.monotonic() + self.poll_seconds
+                while await self.dispatch_due():
+                    pass
+            except Exception as e:
+                logger.error("Error en el programador de recordatorios: %s", e, exc_info=True)
+                failed = True
+            REMINDERS_PENDING.set(len(self.heap))
+
+            timeout = next_poll - time.monotonic()
+            next_send_at = self.heap.next_send_at()
+            if next_send_at is not None:
+                timeout = min(timeout, next_send_at - time.time())
+            if failed:
+                # Sin base de datos no se insiste en un loop cerrado.
+                timeout = max(timeout, self.poll_seconds)
+            if timeout > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    # --- Índice en memoria ---
+
+    def _apply(self, appointment_id: int, scheduled_for: datetime, created_at: datetime,
+               status: str, reminder_sent_at: Optional[datetime], updated_at: datetime, now: datetime) -> None:
+        send_at = scheduled_for - self.lead
+        if status != "scheduled" or reminder_sent_at is not None or scheduled_for <= now or send_at < created_at:
+            self.heap.discard(appointment_id)
+        else:
+            self.heap.schedule(appointment_id, _epoch(send_at), _epoch(updated_at))
+
+    async def load(self) -> None:
+        """Carga inicial de las citas con recordatorio pendiente, por páginas de id."""
+        started = time.perf_counter()
+        now = _utcnow()
+        self.watermark = now - timedelta(seconds=REMINDER_POLL_OVERLAP_SECONDS)
+        last_id = 0
+        while True:
+            stmt = (
+                select(
+                    Appointment.id, Appointment.scheduled_for, Appointment.created_at,
+                    Appointment.status, Appointment.reminder_sent_at, Appointment.updated_at,
+                )
+                .where(
+                    Appointment.status == "scheduled",
+                    Appointment.reminder_sent_at.is_(None),
+                    Appointment.scheduled_for > now,
+                    Appointment.id > last_id,
+                )
+                .order_by(Appointment.id)
+                .limit(LOAD_PAGE_SIZE)
+            )
+            async with self._session_factory() as session:
+                rows = (await session.execute(stmt)).all()
+            for row in rows:
+                self._apply(*row, now=now)
+            if len(rows) < LOAD_PAGE_SIZE:
+                break
+            last_id = rows[-1].id
+        logger.info(
+            "Recordatorios: %d pendientes cargados en %.0f ms.", len(self.heap), (time.perf_counter() - started) * 1000
+        )
+
+    async def poll_changes(self) -> int:
+        """Aplica las citas creadas o modificadas desde la última lectura. Retorna cuántas leyó."""
+        since = self.watermark - timedelta(seconds=REMINDER_POLL_OVERLAP_SECONDS)
+        stmt = select(
+            Appointment.id, Appointment.scheduled_for, Appointment.created_at,
+            Appointment.status, Appointment.reminder_sent_at, Appointment.updated_at,
+        ).where(Appointment.updated_at > since)
+        async with self._session_factory() as session:
+            rows = (await session.execute(stmt)).all()
+        now = _utcnow()
+        for row in rows:
+            self._apply(*row, now=now)
+            if row.updated_at > self.watermark:
+                self.watermark = row.updated_at
+        return len(rows)
+
+    # --- Envío ---
+
+    async def dispatch_due(self) -> int:
+        """Reclama y encola un lote de recordatorios vencidos. Retorna cuántos salieron del heap."""
+        now_epoch = time.time()
+        due = self.heap.pop_due(now_epoch, self.batch_size)
+        if not due:
+            return 0
+        for send_at, _, _ in due:
+            observe_reminder_delay(now_epoch - send_at)
+
+        now = _utcnow()
+        claim = (
+            update(Appointment)
+            .where(
+                Appointment.id.in_([appointment_id for _, appointment_id, _ in due]),
+                Appointment.status == "scheduled",
+                Appointment.reminder_sent_at.is_(None),
+                Appointment.scheduled_for > now,
+            )
+            .values(reminder_sent_at=now)
+            .returning(
+                Appointment.id, Appointment.client_phone_number, Appointment.client_name,
+                Appointment.scheduled_for, Appointment.company_id,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            async with self._session_factory() as session:
+                claimed = (await session.execute(claim)).all()
+                companies = {}
+                if claimed:
+                    result = await session.execute(
+                        select(Company.id, Company.name, Company.company_number, Company.company_metadata)
+                        .where(Company.id.in_({row.company_id for row in claimed}))
+                    )
+                    companies = {company.id: company for company in result}
+                messages = [self._message(row, companies[row.company_id]) for row in claimed]
+                queued = await enqueue_messages(session, messages)
+                await session.commit()
+        except Exception:
+            # Nada quedó reclamado: se devuelven al heap para el próximo intento.
+            for send_at, appointment_id, version in due:
+                self.heap.schedule(appointment_id, send_at, version)
+            raise
+        if queued:
+            wake_outbound_worker()
+        record_reminders("queued", queued)
+        record_reminders("skipped", len(due) - len(claimed))
+        # Reclamados pero con la clave ya encolada (mismo horario): no se reenvían.
+        record_reminders("duplicate", len(claimed) - queued)
+        logger.info(
+            "Recordatorios: %d encolados (%d ya enviados o cancelados, %d duplicados).",
+            queued, len(due) - len(claimed), len(claimed) - queued,
+        )
+        return len(due)
+
+    @staticmethod
+    def _message(row, company) -> Dict[str, object]:
+        local = to_local(row.scheduled_for)
+        values = {
+            "name": (row.client_name or "").split(" ")[0] or "",
+            "empresa": company.name,
+            "fecha": local.strftime("%d/%m/%Y"),
+            "hora": local.strftime("%H:%M"),
+        }
+        template = (company.company_metadata or {}).get("reminder_message") or DEFAULT_REMINDER_MESSAGE
+        try:
+            body = template.format(**values)
+        except (KeyError, IndexError, AttributeError, ValueError) as e:
+            # Una plantilla mal configurada no debe trabar el lote (se reintentaría para siempre).
+            logger.warning(
+                "Plantilla de recordatorio inválida en la empresa %s (%r): se usa la predeterminada.", company.id, e
+            )
+            body = DEFAULT_REMINDER_MESSAGE.format(**values)
+        return {
+            "to_number": row.client_phone_number,
+            "body": body,
+            "from_number": company.company_number,
+            "company_id": row.company_id,
+            # El horario va en la clave: al reprogramar, el nuevo recordatorio no choca con el ya enviado.
+            "idempotency_key": f"reminder:{row.id}:{row.scheduled_for:%Y%m%dT%H%M}",
+        }
+
+
+_scheduler: Optional[ReminderScheduler] = None
+
+
+def start_reminder_scheduler() -> Optional[ReminderScheduler]:
+    global _scheduler
+    if os.getenv("REMINDERS_ENABLED", "true").strip().lower() not in ("1", "true", "yes", "si", "sí", "on"):
+        logger.info("Recordatorios de citas desactivados (REMINDERS_ENABLED).")
+        return None
+    _scheduler = ReminderScheduler()
+    _scheduler.start()
+    return _scheduler
+
+
+async def stop_reminder_scheduler() -> None:
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
@@ -0,0 +1,89 @@
+"""
+Estado tipado de una sesión de chat (columna chat_sessions.session_data).
+
+SessionState reemplaza el dict sin tipo que se guardaba en session_data. Se serializa a un
+formato compacto y versionado ("v": SESSION_STATE_VERSION) en el que los slots de tipo
+fecha se guardan en ISO 8601 y se listan en "dt" para reconstruirlos como datetime al leer.
+Los dicts del formato anterior se migran al leerlos (from_json_dict).
+
+encode_session_state/decode_session_state usan db.json_codec (orjson si está instalado).
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from db.json_codec import dumps, loads
+
+SESSION_STATE_VERSION = 2
+
+
+@dataclass(slots=True)
+class SessionState:
+    in_appointment_flow: bool = False
+    slots_filled: Dict[str, Any] = field(default_factory=dict)
+    event_id: Optional[str] = None
+    client_name: Optional[str] = None
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        """Convierte el estado al dict compacto que se guarda en la columna JSONB."""
+        slots = {}
+        datetime_slots = []
+        for key, value in self.slots_filled.items():
+            if isinstance(value, datetime):
+                slots[key] = value.isoformat()
+                datetime_slots.append(key)
+            else:
+                slots[key] = value
+        data = {"v": SESSION_STATE_VERSION, "flow": self.in_appointment_flow, "slots": slots}
+        if datetime_slots:
+            data["dt"] = datetime_slots
+        if self.event_id:
+            data["event_id"] = self.event_id
+        if self.client_name:
+            data["client_name"] = self.client_name
+        return data
+
+    @classmethod
+    def from_json_dict(cls, data: Optional[Dict[str, Any]]) -> "SessionState":
+        """Construye el estado desde session_data, migrando el formato anterior si hace falta."""
+        if not data:
+            return cls()
+        if data.get("v") != SESSION_STATE_VERSION:
+            return cls._from_legacy_dict(data)
+
+        slots = dict(data.get("slots") or {})
+        for key in data.get("dt", ()):
+            value = slots.get(key)
+            if isinstance(value, str):
+                slots[key] = datetime.fromisoformat(value)
+        return cls(
+            in_appointment_flow=bool(data.get("flow", False)),
+            slots_filled=slots,
+            event_id=data.get("event_id"),
+            client_name=data.get("client_name"),
+        )
+
+    @classmethod
+    def _from_legacy_dict(cls, data: Dict[str, Any]) -> "SessionState":
+        """
+        Migra el dict sin versión: conserva el flujo, los slots, el evento y el nombre del
+        cliente, y descarta las banderas que el handler nunca leía (waiting_for_*, etc.).
+        """
+        return cls(
+            in_appointment_flow=bool(data.get("in_appointment_flow", False)),
+            slots_filled=dict(data.get("slots_filled") or {}),
+            event_id=data.get("event_id"),
+            client_name=data.get("client_name"),
+        )
+
+
+def encode_session_state(state: SessionState) -> str:
+    return dumps(state.to_json_dict())
+
+
+def decode_session_state(raw) -> SessionState:
+    """Decodifica un estado desde JSON (str/bytes) o desde el dict ya cargado de la columna."""
+    if isinstance(raw, (str, bytes, bytearray)):
+        raw = loads(raw)
+    return SessionState.from_json_dict(raw)
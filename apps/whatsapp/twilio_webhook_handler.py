@@ -2,6 +2,8 @@ import logging
 from fastapi import APIRouter, Request
 from fastapi.responses import Response, PlainTextResponse
 
+from apps.monitoring.context import bind_conversation, make_conversation_id, reset_conversation
+from apps.monitoring.tracing import start_trace
 from apps.whatsapp.message_handler import handle_incoming_message
 
 logger = logging.getLogger(__name__)
@@ -9,6 +11,7 @@ router = APIRouter()
 
 @router.post("/webhook")
 async def twilio_webhook(request: Request):
+    context_tokens = None
     try:
         form = await request.form()
         user_phone_number = form.get("From")
@@ -16,21 +19,26 @@ async def twilio_webhook(request: Request):
         message_text = form.get("Body")
         message_sid = form.get("MessageSid")
 
-        logger.info(
-            f"Datos del webhook: From={user_phone_number}, To={company_whatsapp_number}, "
-            f"Body={message_text}, MessageSid={message_sid}"
+        context_tokens = bind_conversation(
+            make_conversation_id(company_whatsapp_number, user_phone_number), message_sid
         )
+        logger.info("Mensaje entrante recibido (%d caracteres).", len(message_text or ""))
+        logger.debug("Datos del webhook: From=%s, To=%s, Body=%r", user_phone_number, company_whatsapp_number, message_text)
 
-        twilio_response_xml = await handle_incoming_message(
-            user_phone_number,
-            company_whatsapp_number,
-            message_text,
-            message_sid,
-        )
+        with start_trace("whatsapp.webhook"):
+            twilio_response_xml = await handle_incoming_message(
+                user_phone_number,
+                company_whatsapp_number,
+                message_text,
+                message_sid,
+            )
 
         return Response(content=twilio_response_xml, media_type="application/xml")
     except Exception as e:
         logger.error(f"Webhook error: {e}", exc_info=True)
         return PlainTextResponse("Error interno en el webhook", status_code=200)
+    finally:
+        if context_tokens is not None:
+            reset_conversation(context_tokens)
 
 webhook_router = router
\ No newline at end of file
@@ -1,6 +1,9 @@
 from twilio.rest import Client
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # Cargar credenciales de Twilio desde variables de entorno
 account_sid = os.getenv("TWILIO_ACCOUNT_SID")
 auth_token = os.getenv("TWILIO_AUTH_TOKEN")
@@ -12,12 +15,16 @@ if not all([account_sid, auth_token, twilio_whatsapp_number]):
 client = Client(account_sid, auth_token)
 
 def send_whatsapp_message(to_number: str, message: str, from_number: str = None):
+    """
+    Envío síncrono e inmediato, sin reintentos. Para mensajes proactivos usar la cola de
+    apps/whatsapp/outbound_sender.py (enqueue_message).
+    """
     try:
         message = client.messages.create(
             body=message,
             from_=f'whatsapp:{from_number or twilio_whatsapp_number}',
             to=f'whatsapp:{to_number}'
         )
-        print(f"Mensaje enviado con SID: {message.sid}")
+        logger.info("Mensaje enviado con SID: %s", message.sid)
     except Exception as e:
-        print(f"Error al enviar el mensaje: {e}")
+        logger.error("Error al enviar el mensaje: %s", e)
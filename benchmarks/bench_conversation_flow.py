@@ -0,0 +1,211 @@
+"""
+Microbenchmark del costo de CPU por turno del handler de mensajes.
+
+Ejecuta un guion de agendamiento completo contra handle_incoming_message con la base de
+datos, el LLM y Google Calendar reemplazados por dobles en memoria, de modo que solo se
+mide el trabajo propio del handler (búsqueda de slots, preguntas, serialización, TwiML).
+
+Uso:
+    python -m benchmarks.bench_conversation_flow
+    python -m benchmarks.bench_conversation_flow --ref <commit>   # compara contra otro commit
+"""
+
+import argparse
+import importlib
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from benchmarks.harness import bench_async, load_module_from_ref, print_report
+
+HANDLER_PATH = "apps/whatsapp/message_handler.py"
+
+COMPANY_METADATA = {
+    "appointment_slots": [
+        {"key": "doctor", "label": "doctor", "type": "string", "required": True,
+         "options": ["María Martinez", "Eduardo López"]},
+        {"key": "name", "label": "nombre", "type": "string", "required": True},
+        {"key": "datetime", "label": "fecha y hora", "type": "datetime", "required": True},
+    ],
+    "allow_parallel_appointments": True,
+    "confirmation_message": "Perfecto, {name}, tu cita con {doctor} fue agendada para el {datetime}.",
+}
+
+BOOKING_SCRIPT = [
+    "hola",
+    "quiero agendar una cita",
+    "con la doctora maria martinez",
+    "Juan Pérez",
+    "mañana a las 3 de la tarde",
+]
+
+
+class FakeDBSession:
+    def add(self, obj):
+        pass
+
+    def add_all(self, objs):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def execute(self, statement, params=None):
+        # Upserts de los agregados del dashboard: no se compilan ni se ejecutan.
+        return None
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+@asynccontextmanager
+async def fake_get_db_session():
+    yield FakeDBSession()
+
+
+class FakeUnitOfWork:
+    def stage(self, *objects):
+        pass
+
+    def read(self, replica=False):
+        return fake_get_db_session()
+
+    def write(self):
+        return fake_get_db_session()
+
+
+def build_fakes(state):
+    company = SimpleNamespace(
+        id=1,
+        name="Clínica Odontológica Sonríe",
+        schedule="Lunes a Viernes, 8am a 8pm",
+        calendar_email="agenda@example.com",
+        company_metadata=COMPANY_METADATA,
+    )
+
+    async def get_company_by_number(number, db_session):
+        return company
+
+    async def get_or_create_session(user_phone_number, company_id, db_session):
+        return state["chat_session"]
+
+    async def find_or_start_session(user_phone_number, company_id, db_session):
+        return state["chat_session"], None
+
+    async def update_session_data(session, new_data, db_session, replace=False):
+        if replace:
+            session.session_data = {}
+        session.session_data.update(new_data)
+
+    async def add_message(*args, **kwargs):
+        pass
+
+    async def detect_intent(message_text, session_data=None):
+        text = message_text.lower()
+        if "cancelar" in text:
+            return "cancel_appointment"
+        if "cita" in text or "agendar" in text:
+            return "schedule_appointment"
+        return "unknown"
+
+    async def detect_intent_with_source(message_text, session_data=None):
+        return await detect_intent(message_text, session_data), "keywords"
+
+    async def extract_info(message_text, session_data=None, user_phone=None, slot=None, options=None):
+        if slot and options:
+            return {slot: options[0]}
+        return {
+            "name": "Juan Pérez",
+            "phone": user_phone,
+            "datetime": datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1),
+        }
+
+    async def slot_available(*args, **kwargs):
+        return True
+
+    async def create_calendar_event(*args, **kwargs):
+        return {"status": "success", "event_id": "evt-1", "event_link": "", "message": ""}
+
+    async def find_user_events(*args, **kwargs):
+        return []
+
+    def noop(*args, **kwargs):
+        return None
+
+    return {
+        "get_db_session": fake_get_db_session,
+        "TurnUnitOfWork": FakeUnitOfWork,
+        "find_or_start_session": find_or_start_session,
+        "get_company_by_number": get_company_by_number,
+        "get_or_create_session": get_or_create_session,
+        "update_session_data": update_session_data,
+        "message_repository": SimpleNamespace(add_message=add_message),
+        "detect_intent": detect_intent,
+        "detect_intent_with_source": detect_intent_with_source,
+        "extract_info": extract_info,
+        "is_time_slot_available": slot_available,
+        "is_time_slot_available_cached": slot_available,
+        "create_calendar_event": create_calendar_event,
+        "delete_calendar_event": lambda *args, **kwargs: True,
+        "find_user_events": find_user_events,
+        "prefetch_availability": noop,
+        "record_created_event": noop,
+        "invalidate_calendar": noop,
+    }
+
+
+def patch_modules(modules, fakes):
+    for module in modules:
+        for name, fake in fakes.items():
+            if name in module.__dict__:
+                setattr(module, name, fake)
+
+
+def make_script_runner(handler_module):
+    state = {}
+    fakes = build_fakes(state)
+    # Los módulos que el handler usa para resolver el turno también reciben los dobles.
+    extra_modules = []
+    for name in ("apps.whatsapp.conversation_flow",):
+        try:
+            extra_modules.append(importlib.import_module(name))
+        except ImportError:
+            pass
+    patch_modules([handler_module, *extra_modules], fakes)
+
+    async def run_script():
+        state["chat_session"] = SimpleNamespace(id=1, company_id=1, session_data={})
+        for text in BOOKING_SCRIPT:
+            await handler_module.handle_incoming_message(
+                "whatsapp:+573000000000", "whatsapp:+14155238886", text, "SM-bench"
+            )
+
+    return run_script
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ref", help="commit contra el cual comparar el handler actual")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    turns = len(BOOKING_SCRIPT)
+    results = {}
+    current = importlib.import_module("apps.whatsapp.message_handler")
+    results["actual (por turno)"] = bench_async(make_script_runner(current), iterations=args.iterations)
+    if args.ref:
+        previous = load_module_from_ref(args.ref, HANDLER_PATH, "message_handler_ref")
+        results[f"{args.ref} (por turno)"] = bench_async(make_script_runner(previous), iterations=args.iterations)
+
+    # Las muestras son por guion completo; se reportan por turno.
+    for stats in results.values():
+        for key in ("mean_us", "p50_us", "p95_us", "min_us"):
+            stats[key] /= turns
+    print_report(f"Costo de CPU por turno ({turns} turnos por guion)", results)
+
+
+if __name__ == "__main__":
+    main()
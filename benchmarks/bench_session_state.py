@@ -0,0 +1,105 @@
+"""
+Benchmark de codificación/decodificación y memoria del estado de sesión.
+
+Compara el formato anterior (dict sin tipo + make_json_serializable recursivo + json) con
+SessionState (__slots__ + to_json_dict/from_json_dict + dumps/loads con orjson si está
+disponible) sobre sesiones realistas de un agendamiento en curso.
+
+Uso:
+    python -m benchmarks.bench_session_state
+"""
+
+import json
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.harness import bench_sync, print_report
+from apps.whatsapp.session_state import SessionState, dumps, loads, orjson
+
+SESSIONS = 10000
+
+
+def legacy_session():
+    """Sesión tal como la escribían el handler anterior y clear_session_slots."""
+    return {
+        "client_name": "Juan Pérez",
+        "waiting_for_name": False,
+        "in_appointment_flow": True,
+        "in_cancel_flow": False,
+        "waiting_for_datetime": True,
+        "waiting_for_cancel_datetime": True,
+        "waiting_for_cancel_confirmation": False,
+        "confirm_cancel_id": None,
+        "appointment_datetime_to_cancel": None,
+        "slots_filled": {
+            "doctor": "María Martinez",
+            "name": "Juan Pérez",
+            "datetime": datetime(2026, 10, 21, 15, 0),
+        },
+        "event_id": "a1b2c3d4e5f6g7h8",
+    }
+
+
+def typed_session():
+    return SessionState(
+        in_appointment_flow=True,
+        slots_filled={
+            "doctor": "María Martinez",
+            "name": "Juan Pérez",
+            "datetime": datetime(2026, 10, 21, 15, 0),
+        },
+        event_id="a1b2c3d4e5f6g7h8",
+        client_name="Juan Pérez",
+    )
+
+
+def make_json_serializable(obj):
+    if isinstance(obj, dict):
+        return {k: make_json_serializable(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [make_json_serializable(i) for i in obj]
+    elif isinstance(obj, datetime):
+        return obj.isoformat()
+    else:
+        return obj
+
+
+def measure_memory(factory, count=SESSIONS) -> float:
+    """Bytes asignados por sesión al mantener `count` sesiones en memoria."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = [factory() for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del sessions
+    return total / count
+
+
+def main():
+    legacy = legacy_session()
+    legacy_raw = json.dumps(make_json_serializable(legacy))
+    typed = typed_session()
+    typed_raw = dumps(typed.to_json_dict())
+
+    results = {
+        "legacy encode": bench_sync(lambda: json.dumps(make_json_serializable(legacy))),
+        "legacy decode": bench_sync(lambda: json.loads(legacy_raw)),
+        "SessionState encode": bench_sync(lambda: dumps(typed.to_json_dict())),
+        "SessionState decode": bench_sync(lambda: SessionState.from_json_dict(loads(typed_raw))),
+        "migración legacy -> SessionState": bench_sync(
+            lambda: SessionState.from_json_dict(json.loads(legacy_raw))
+        ),
+    }
+    print_report(f"Estado de sesión (orjson={'sí' if orjson else 'no'})", results)
+
+    print("\n== Tamaño ==")
+    print(f"JSON legacy:        {len(legacy_raw)} bytes")
+    print(f"JSON SessionState:  {len(typed_raw)} bytes")
+    print("\n== Memoria por sesión en proceso ==")
+    print(f"dict legacy:        {measure_memory(legacy_session):.0f} bytes")
+    print(f"SessionState:       {measure_memory(typed_session):.0f} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Utilidades comunes para los benchmarks del proyecto.
+
+Los benchmarks se ejecutan como scripts desde la raíz del repositorio, por ejemplo:
+    python -m benchmarks.bench_conversation_flow
+"""
+
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def summarize(samples_ns: List[int]) -> Dict[str, float]:
+    """Resume una lista de muestras (en nanosegundos) en microsegundos."""
+    ordered = sorted(samples_ns)
+    return {
+        "n": len(ordered),
+        "mean_us": statistics.fmean(ordered) / 1000,
+        "p50_us": ordered[len(ordered) // 2] / 1000,
+        "p95_us": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] / 1000,
+        "min_us": ordered[0] / 1000,
+    }
+
+
+def bench_sync(fn: Callable[[], object], iterations: int = 10000, warmup: int = 100) -> Dict[str, float]:
+    """Mide el tiempo de CPU por llamada de una función síncrona."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.process_time_ns()
+        fn()
+        samples.append(time.process_time_ns() - start)
+    return summarize(samples)
+
+
+def bench_async(fn: Callable[[], Awaitable[object]], iterations: int = 1000, warmup: int = 20) -> Dict[str, float]:
+    """Mide el tiempo de CPU por llamada de una corrutina (sin latencias externas reales)."""
+    async def runner():
+        for _ in range(warmup):
+            await fn()
+        samples = []
+        for _ in range(iterations):
+            start = time.process_time_ns()
+            await fn()
+            samples.append(time.process_time_ns() - start)
+        return samples
+
+    return summarize(asyncio.run(runner()))
+
+
+def bench_throughput(fn: Callable[[Any], object], inputs: Sequence[Any], repeat: int = 5, min_time: float = 0.2) -> Dict[str, float]:
+    """
+    Operaciones por segundo de `fn` recorriendo `inputs` (un corpus) durante al menos
+    `min_time` segundos por repetición. Reporta la mediana y la mejor de `repeat` repeticiones.
+    """
+    rates = []
+    for _ in range(repeat):
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            for item in inputs:
+                fn(item)
+            calls += len(inputs)
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        rates.append(calls / elapsed)
+    return {"ops_s": statistics.median(rates), "best_ops_s": max(rates)}
+
+
+def bench_throughput_async(fn: Callable[[Any], Awaitable[object]], inputs: Sequence[Any], repeat: int = 5, min_time: float = 0.2) -> Dict[str, float]:
+    """Como bench_throughput, para corrutinas (todas en el mismo event loop)."""
+    async def runner():
+        rates = []
+        for _ in range(repeat):
+            calls = 0
+            started = time.perf_counter()
+            while True:
+                for item in inputs:
+                    await fn(item)
+                calls += len(inputs)
+                elapsed = time.perf_counter() - started
+                if elapsed >= min_time:
+                    break
+            rates.append(calls / elapsed)
+        return rates
+
+    rates = asyncio.run(runner())
+    return {"ops_s": statistics.median(rates), "best_ops_s": max(rates)}
+
+
+def allocations_per_call(fn: Callable[[Any], object], inputs: Sequence[Any], is_async: bool = False) -> float:
+    """
+    Bytes asignados por llamada (promedio del pico de memoria de cada llamada sobre lo ya
+    asignado), medidos con tracemalloc en una pasada por `inputs`. Incluye los temporales.
+    """
+    peaks = []
+
+    def measure(item):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        result = fn(item)
+        return base, result
+
+    async def measure_all_async():
+        for item in inputs:
+            base, result = measure(item)
+            await result
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+
+    tracemalloc.start()
+    try:
+        if is_async:
+            asyncio.run(measure_all_async())
+        else:
+            for item in inputs:
+                base, _ = measure(item)
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return statistics.fmean(peaks) if peaks else 0.0
+
+
+def print_report(title: str, results: Dict[str, Dict[str, float]]) -> None:
+    print(f"\n== {title} ==")
+    print(f"{'caso':<40} {'n':>7} {'media (us)':>12} {'p50 (us)':>10} {'p95 (us)':>10}")
+    for name, stats in results.items():
+        print(
+            f"{name:<40} {stats['n']:>7} {stats['mean_us']:>12.1f} "
+            f"{stats['p50_us']:>10.1f} {stats['p95_us']:>10.1f}"
+        )
+
+
+def load_module_from_ref(ref: str, path: str, module_name: str) -> types.ModuleType:
+    """
+    Carga un módulo tal como estaba en otro commit (git show <ref>:<path>), para comparar
+    la implementación actual contra una anterior en el mismo proceso.
+    """
+    source = subprocess.check_output(["git", "show", f"{ref}:{path}"], cwd=ROOT_DIR, text=True)
+    module = types.ModuleType(module_name)
+    module.__file__ = os.path.join(ROOT_DIR, path)
+    exec(compile(source, f"{ref}:{path}", "exec"), module.__dict__)
+    return module
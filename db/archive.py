@@ -0,0 +1,273 @@
+"""
+Archivo de mensajes vencidos antes de la purga.
+
+En lugar de borrar los mensajes con más de PURGE_MAX_AGE_HOURS, la purga (tasks.py) los copia
+a archivos NDJSON comprimidos, uno por empresa y día, en disco local o en un almacenamiento
+compatible con S3, y solo entonces los borra de Postgres:
+
+  1. Agrupa las filas vencidas por (company_id, día) con un GROUP BY (un resultado pequeño).
+  2. Por cada grupo, lee las filas con un cursor del servidor (stream + yield_per) y las
+     escribe comprimidas en un archivo temporal: la memoria no depende del tamaño del grupo.
+  3. Verifica el archivo (se descomprime de nuevo y se cuentan las filas) y lo sube a
+     <prefijo>/messages/company_id=<id>/date=<AAAA-MM-DD>/<nombre>.ndjson.gz (o .zst), un
+     esquema de particiones que leen directamente DuckDB, Spark o Athena.
+  4. Borra las filas del grupo en una transacción que exige que se borre la misma cantidad
+     que se archivó; si no coincide (o falla), hace rollback y quita el archivo subido, y el
+     grupo se reintenta en la siguiente purga.
+
+Un día se archiva en varias partes (una por ejecución de la purga que lo alcance). Cada línea
+lleva el id del mensaje, por si hiciera falta deduplicar.
+
+Variables:
+  ARCHIVE_URL           destino: ruta o file:///ruta local, o s3://bucket/prefijo
+                        (sin definir, la purga borra sin archivar)
+  ARCHIVE_COMPRESSION   gzip (por defecto) | zstd (requiere el paquete zstandard)
+  ARCHIVE_BATCH_SIZE    filas por lote leído del cursor (5000)
+  ARCHIVE_S3_ENDPOINT_URL  endpoint de un almacenamiento compatible (MinIO, R2...); requiere boto3
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy import delete, func, select
+
+from db.json_codec import dumps
+from db.models.messages import Message
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard es opcional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+EXTENSIONS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+ARCHIVE_COLUMNS = (
+    Message.id,
+    Message.message_sid,
+    Message.company_id,
+    Message.chat_session_id,
+    Message.timestamp,
+    Message.direction,
+    Message.sender_phone_number,
+    Message.body,
+)
+
+
+class ArchiveError(Exception):
+    """El archivo no pudo escribirse, verificarse o conciliarse con las filas borradas."""
+
+
+# === Compresión ===
+
+def _open_compressed(path: str, compression: str, mode: str):
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ArchiveError("ARCHIVE_COMPRESSION=zstd requiere el paquete zstandard.")
+        raw = open(path, mode)
+        if mode == "wb":
+            return zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    raise ArchiveError(f"ARCHIVE_COMPRESSION inválido: {compression!r} (gzip o zstd)")
+
+
+def count_lines(path: str, compression: str) -> int:
+    """Descomprime el archivo por bloques y cuenta sus líneas (verificación de la escritura)."""
+    lines = 0
+    with _open_compressed(path, compression, "rb") as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                return lines
+            lines += chunk.count(b"\n")
+
+
+# === Almacenamiento ===
+
+class LocalStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def describe(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    async def put(self, local_path: str, key: str) -> None:
+        def _put():
+            target = os.path.join(self.root, key)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            partial = f"{target}.partial"
+            shutil.copyfile(local_path, partial)
+            with open(partial, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(partial, target)
+            if os.path.getsize(target) != os.path.getsize(local_path):
+                raise ArchiveError(f"Tamaño distinto al copiar {target}")
+
+        await asyncio.to_thread(_put)
+
+    async def remove(self, key: str) -> None:
+        def _remove():
+            try:
+                os.remove(self.describe(key))
+            except FileNotFoundError:
+                pass
+
+        await asyncio.to_thread(_remove)
+
+
+class S3Storage:
+    """Bucket S3 o compatible (endpoint_url). boto3 se importa solo si se usa."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def describe(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+    async def put(self, local_path: str, key: str) -> None:
+        def _put():
+            self._client.upload_file(local_path, self.bucket, self._key(key))
+            head = self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+            if head["ContentLength"] != os.path.getsize(local_path):
+                raise ArchiveError(f"Tamaño distinto al subir {self.describe(key)}")
+
+        await asyncio.to_thread(_put)
+
+    async def remove(self, key: str) -> None:
+        await asyncio.to_thread(self._client.delete_object, Bucket=self.bucket, Key=self._key(key))
+
+
+def storage_from_url(url: str):
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        return S3Storage(parsed.netloc, parsed.path, endpoint_url=os.getenv("ARCHIVE_S3_ENDPOINT_URL"))
+    if parsed.scheme in ("", "file"):
+        return LocalStorage(parsed.path if parsed.scheme else url)
+    raise ValueError(f"ARCHIVE_URL no soportada: {url!r} (ruta local, file:// o s3://)")
+
+
+def storage_from_env():
+    """Destino configurado en ARCHIVE_URL, o None si no se archiva."""
+    url = os.getenv("ARCHIVE_URL")
+    return storage_from_url(url) if url else None
+
+
+# === Archivo ===
+
+def archive_key(company_id: int, day: date, compression: str) -> str:
+    return (
+        f"messages/company_id={company_id}/date={day:%Y-%m-%d}/"
+        f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}{EXTENSIONS[compression]}"
+    )
+
+
+async def _expired_groups(engine, cutoff: datetime) -> List[Tuple[int, date, int]]:
+    day = func.date_trunc("day", Message.timestamp)
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            select(Message.company_id, day, func.count())
+            .where(Message.timestamp < cutoff)
+            .group_by(Message.company_id, day)
+            .order_by(Message.company_id, day)
+        )
+        return [(company_id, start.date(), count) for company_id, start, count in result.all()]
+
+
+def _group_filter(company_id: int, day: date, cutoff: datetime):
+    start = datetime.combine(day, datetime.min.time())
+    end = min(start + timedelta(days=1), cutoff)
+    return (Message.company_id == company_id, Message.timestamp >= start, Message.timestamp < end)
+
+
+async def _write_group(engine, path: str, compression: str, conditions, batch_size: int) -> int:
+    written = 0
+    out = _open_compressed(path, compression, "wb")
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(
+                select(*ARCHIVE_COLUMNS)
+                .where(*conditions)
+                .order_by(Message.timestamp, Message.id)
+                .execution_options(yield_per=batch_size)
+            )
+            async for rows in result.partitions():
+                chunk = "".join(dumps(dict(row._mapping)) + "\n" for row in rows).encode()
+                await asyncio.to_thread(out.write, chunk)
+                written += len(rows)
+    finally:
+        await asyncio.to_thread(out.close)
+    return written
+
+
+async def archive_group(engine, storage, company_id: int, day: date, cutoff: datetime,
+                        compression: str = "gzip", batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Archiva y borra las filas vencidas de una empresa en un día. Retorna cuántas se movieron."""
+    conditions = _group_filter(company_id, day, cutoff)
+    key = archive_key(company_id, day, compression)
+    fd, path = tempfile.mkstemp(prefix="messages-", suffix=EXTENSIONS[compression])
+    os.close(fd)
+    try:
+        written = await _write_group(engine, path, compression, conditions, batch_size)
+        if written == 0:
+            return 0
+        verified = await asyncio.to_thread(count_lines, path, compression)
+        if verified != written:
+            raise ArchiveError(f"{key}: se escribieron {written} filas pero el archivo tiene {verified}")
+        await storage.put(path, key)
+    finally:
+        os.remove(path)
+
+    try:
+        async with engine.begin() as conn:
+            deleted = (await conn.execute(delete(Message).where(*conditions))).rowcount
+            if deleted != written:
+                raise ArchiveError(f"{key}: se archivaron {written} filas pero se borrarían {deleted}")
+    except Exception:
+        # Las filas siguen en Postgres: se quita el archivo para no duplicarlas al reintentar.
+        try:
+            await storage.remove(key)
+        except Exception as e:
+            logger.warning("No se pudo quitar el archivo %s: %s", storage.describe(key), e)
+        raise
+    logger.info("Archivados %d mensajes de la empresa %s del %s en %s.", written, company_id, day, storage.describe(key))
+    return written
+
+
+async def archive_expired_messages(engine, storage, cutoff: datetime, compression: Optional[str] = None,
+                                   batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Archiva y borra todos los mensajes anteriores a `cutoff`, grupo por grupo. Un grupo que
+    falla se deja para la siguiente ejecución sin detener a los demás.
+    """
+    compression = compression or os.getenv("ARCHIVE_COMPRESSION", "gzip")
+    if compression not in EXTENSIONS:
+        raise ArchiveError(f"ARCHIVE_COMPRESSION inválido: {compression!r} (gzip o zstd)")
+    totals = {"archived": 0, "groups": 0, "failed_groups": 0}
+    for company_id, day, _ in await _expired_groups(engine, cutoff):
+        try:
+            totals["archived"] += await archive_group(engine, storage, company_id, day, cutoff, compression, batch_size)
+            totals["groups"] += 1
+        except Exception as e:
+            totals["failed_groups"] += 1
+            logger.error("No se archivaron los mensajes de la empresa %s del %s: %s", company_id, day, e, exc_info=True)
+    return totals
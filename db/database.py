@@ -1,49 +1,182 @@
 import os
+import time
 import logging
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from contextlib import asynccontextmanager
 from sqlalchemy import text
+from prometheus_client import Gauge, Histogram
+
+from db.json_codec import dumps as json_dumps, loads as json_loads
 
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
+# Réplica de solo lectura opcional (dashboard, historial, búsqueda de empresas).
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
 
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL no está configurada en las variables de entorno.")
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+# === Métricas del pool de conexiones ===
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Tiempo de espera para obtener una conexión del pool.",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Conexiones del pool actualmente en uso.",
+    ["pool"],
+)
+POOL_SATURATION = Gauge(
+    "db_pool_saturation_ratio",
+    "Conexiones en uso / capacidad máxima del pool (pool_size + max_overflow).",
+    ["pool"],
+)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """Pool asíncrono que mide el tiempo de espera de cada checkout."""
+
+    metrics_name = "primary"
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metrics_name).observe(time.perf_counter() - started)
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.metrics_name = self.metrics_name
+        return new_pool
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "si", "sí", "on")
+
+
+def create_engine_from_env(database_url: str, role: str = "primary"):
+    """
+    Crea un engine asíncrono configurado por variables de entorno:
+      DB_ECHO (false), DB_POOL_SIZE (10), DB_MAX_OVERFLOW (5), DB_POOL_TIMEOUT (10 s),
+      DB_POOL_RECYCLE (1800 s), DB_POOL_PRE_PING (true), DB_STATEMENT_CACHE_SIZE (500)
+      y DB_COMMAND_TIMEOUT (30 s).
+    Para la réplica se puede usar el prefijo DB_REPLICA_ (p. ej. DB_REPLICA_POOL_SIZE).
+    """
+    prefix = "DB_" if role == "primary" else f"DB_{role.upper()}_"
+
+    def setting(name, default):
+        return _env_int(f"{prefix}{name}", _env_int(f"DB_{name}", default))
+
+    url = make_url(database_url)
+    connect_args = {}
+    if url.drivername == "postgresql+asyncpg":
+        # Caché de sentencias preparadas del dialecto asyncpg de SQLAlchemy (0 si se usa pgbouncer).
+        url = url.update_query_dict({
+            "prepared_statement_cache_size": str(setting("STATEMENT_CACHE_SIZE", 500))
+        })
+        connect_args = {
+            "command_timeout": setting("COMMAND_TIMEOUT", 30),
+            "server_settings": {"application_name": f"whatsapp_ia_{role}"},
+        }
+
+    pool_size = setting("POOL_SIZE", 10)
+    max_overflow = setting("MAX_OVERFLOW", 5)
+    new_engine = create_async_engine(
+        url,
+        echo=_env_bool("DB_ECHO", False),
+        future=True,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=setting("POOL_TIMEOUT", 10),
+        pool_recycle=setting("POOL_RECYCLE", 1800),
+        pool_pre_ping=_env_bool(f"{prefix}POOL_PRE_PING", _env_bool("DB_POOL_PRE_PING", True)),
+        pool_use_lifo=True,
+        json_serializer=json_dumps,
+        json_deserializer=json_loads,
+        connect_args=connect_args,
+    )
+
+    new_engine.sync_engine.pool.metrics_name = role
+    capacity = max(pool_size + max_overflow, 1)
+    # El pool puede recrearse (p. ej. tras invalidar conexiones): se consulta siempre el actual.
+    POOL_CHECKED_OUT.labels(role).set_function(lambda: new_engine.sync_engine.pool.checkedout())
+    POOL_SATURATION.labels(role).set_function(lambda: new_engine.sync_engine.pool.checkedout() / capacity)
+    logger.info(f"Engine '{role}' creado (pool_size={pool_size}, max_overflow={max_overflow}).")
+    return new_engine
+
+
+engine = create_engine_from_env(DATABASE_URL, "primary")
+# Sin réplica configurada, las lecturas usan el engine principal.
+read_engine = create_engine_from_env(DATABASE_REPLICA_URL, "replica") if DATABASE_REPLICA_URL else engine
 
 Base = declarative_base()
 
 SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
 
 @asynccontextmanager
 async def get_db_session():
     async with SessionLocal() as session:
         try:
-            logger.info(f"DEBUG DB: Sesión CREADA (ID: {id(session)})")
             yield session
         except Exception as e:
             await session.rollback()
             logger.error(f"DB session rollback debido a error: {e}", exc_info=True)
             raise
         finally:
-            logger.info(f"DEBUG DB: Sesión CERRADA (ID: {id(session)})")
             await session.close()
 
-async def get_messages_by_session_id(session_id: str):
+@asynccontextmanager
+async def get_read_db_session():
+    """
+    Sesión de solo lectura contra la réplica (o el primario si no hay réplica).
+    Puede haber un pequeño retraso de replicación: no usar para leer lo que se acaba de escribir.
+    """
+    async with ReadSessionLocal() as session:
+        yield session
+
+async def get_db():
+    """Dependencia de FastAPI: sesión de lectura/escritura contra el primario."""
+    async with get_db_session() as session:
+        yield session
+
+async def get_read_db():
+    """Dependencia de FastAPI: sesión de solo lectura (réplica si está configurada)."""
+    async with get_read_db_session() as session:
+        yield session
+
+async def get_messages_by_session_id(session_id: str, company_id: int = None):
     """
     Recupera todos los mensajes asociados a una sesión específica ordenados cronológicamente.
     Usa los campos correctos según el esquema real: direction y body.
+    Con company_id, Postgres solo consulta la partición de la empresa (ver db/partitioning.py).
     """
-    async with get_db_session() as session:
-        query = text("""
+    async with get_read_db_session() as session:
+        company_filter = "AND company_id = :company_id" if company_id is not None else ""
+        query = text(f"""
             SELECT direction, body
             FROM messages
-            WHERE chat_session_id = :session_id
+            WHERE chat_session_id = :session_id {company_filter}
             ORDER BY timestamp ASC
         """)
-        result = await session.execute(query, {"session_id": session_id})
+        params = {"session_id": session_id}
+        if company_id is not None:
+            params["company_id"] = company_id
+        result = await session.execute(query, params)
         rows = result.fetchall()
-        return [{"direction": row.direction, "body": row.body} for row in rows]
\ No newline at end of file
+        return [{"direction": row.direction, "body": row.body} for row in rows]
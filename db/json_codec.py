@@ -0,0 +1,35 @@
+"""
+Serialización JSON compartida (columnas JSONB y estado de sesión).
+
+Usa orjson si está instalado (más rápido y con soporte nativo de datetime) y, si no,
+el módulo json estándar con el mismo comportamiento.
+"""
+
+import json
+from datetime import datetime
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Objeto de tipo {type(obj).__name__} no serializable a JSON")
+
+
+def dumps(obj: Any) -> str:
+    """Serializa a JSON (str), con soporte nativo de datetime."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=_json_default, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(raw) -> Any:
+    """Deserializa JSON desde str o bytes."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
@@ -1,4 +1,8 @@
 from .company import Company
 from .appointment import Appointment
 from .messages import Message
-from .chat_session import ChatSession
\ No newline at end of file
+from .chat_session import ChatSession
+from .outbound_message import OutboundMessage, OutboundSenderRate
+from .campaign import Campaign, CampaignRecipient
+from .conversation_stats import ConversationStatsHourly, ConversationLatencyHourly
+from .live_feed_watcher import LiveFeedWatcher
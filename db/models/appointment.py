@@ -1,17 +1,39 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from db.database import Base
 
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class Appointment(Base):
+    """
+    Cita agendada. scheduled_for se guarda en UTC (sin zona), igual que created_at.
+    updated_at cambia con cada modificación: el programador de recordatorios
+    (apps/whatsapp/reminder_scheduler.py) la usa como marca de agua para leer solo los cambios.
+    """
     __tablename__ = "appointments"
+    __table_args__ = (
+        Index("ix_appointments_updated_at", "updated_at"),
+        # Citas con recordatorio pendiente (carga inicial del programador).
+        Index(
+            "ix_appointments_pending_reminder",
+            "scheduled_for",
+            postgresql_where=text("status = 'scheduled' AND reminder_sent_at IS NULL"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     client_phone_number = Column(String, nullable=False, index=True)
     client_name = Column(String, nullable=False)
     company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
     scheduled_for = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
     status = Column(String, nullable=False, default='scheduled')
+    event_id = Column(String, nullable=True, index=True)
+    updated_at = Column(DateTime, nullable=False, default=_utcnow, onupdate=_utcnow)
+    reminder_sent_at = Column(DateTime, nullable=True)
 
-    company = relationship("Company", back_populates="appointments")
\ No newline at end of file
+    company = relationship("Company", back_populates="appointments")
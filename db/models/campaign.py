@@ -0,0 +1,53 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint, text
+from datetime import datetime, timezone
+from db.database import Base
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Campaign(Base):
+    """
+    Envío masivo de una empresa (ver apps/whatsapp/campaigns.py).
+
+    status: draft -> running -> completed, o cancelled/failed. cursor es el punto de control
+    del recorrido de destinatarios (último teléfono de chat_sessions o último id de
+    campaign_recipients ya encolado); se guarda en la misma transacción que los mensajes.
+    """
+    __tablename__ = "campaigns"
+    __table_args__ = (
+        # Campañas en curso (el runner las reclama por lease_until).
+        Index("ix_campaigns_running", "lease_until", postgresql_where=text("status = 'running'")),
+    )
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    template = Column(String, nullable=False)
+    # chat_sessions (contactos de la empresa) o upload (lista cargada en campaign_recipients).
+    source = Column(String, nullable=False, default="chat_sessions")
+    status = Column(String, nullable=False, default="draft")
+    cursor = Column(String, nullable=True)
+    enqueued = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    # Mientras un proceso la envía, renueva el plazo; si muere, otro la retoma al vencer.
+    lease_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
+    updated_at = Column(DateTime, nullable=False, default=_utcnow, onupdate=_utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class CampaignRecipient(Base):
+    """Destinatario de una campaña con lista cargada (source = 'upload')."""
+    __tablename__ = "campaign_recipients"
+    __table_args__ = (
+        UniqueConstraint("campaign_id", "phone_number", name="uq_campaign_recipients_phone"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    campaign_id = Column(Integer, ForeignKey("campaigns.id", ondelete="CASCADE"), nullable=False)
+    phone_number = Column(String, nullable=False)
+    name = Column(String, nullable=True)
@@ -1,7 +1,7 @@
 from datetime import datetime, timezone
 from typing import List, Dict, Any
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,6 +10,16 @@ from db.database import Base
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        # Búsqueda de la sesión activa de un usuario (ver find_or_start_session).
+        Index(
+            "ix_chat_sessions_active_lookup",
+            "user_phone_number",
+            "company_id",
+            text("last_activity DESC"),
+            postgresql_where=text("status = 'active'"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_phone_number = Column(String, nullable=False, index=True)
@@ -22,6 +32,10 @@ class ChatSession(Base):
     company = relationship("Company", back_populates="chat_sessions") 
     messages = relationship("Message", back_populates="chat_session", cascade="all, delete-orphan", order_by="Message.timestamp")
 
+    # Con las tablas particionadas por empresa (db/partitioning.py) los UPDATE/DELETE del ORM
+    # incluyen company_id y solo tocan la partición correspondiente.
+    __mapper_args__ = {"primary_key": [id, company_id]}
+
     async def get_formatted_message_history(self, db_session: AsyncSession, limit: int = 10) -> List[Dict[str, Any]]:
         """
         Recupera y formatea el historial de mensajes de esta sesión para el modelo LLM.
@@ -30,7 +44,7 @@ class ChatSession(Base):
 
         result = await db_session.execute(
             select(Message)
-            .where(Message.chat_session_id == self.id)
+            .where(Message.chat_session_id == self.id, Message.company_id == self.company_id)
             .order_by(Message.timestamp.desc()) 
             .limit(limit)
         )
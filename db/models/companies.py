@@ -1,12 +1,17 @@
 from db.models.company import Company
+from sqlalchemy import bindparam
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+# Sentencia construida una sola vez: SQLAlchemy memoriza su cache key y reutiliza el SQL
+# compilado, en lugar de armar y recorrer un select() nuevo en cada mensaje.
+COMPANY_BY_NUMBER_STMT = select(Company).where(Company.company_number == bindparam("company_number"))
+
 async def get_company_by_number(company_number, db_session):
     
     if company_number.startswith('whatsapp:'):
         company_number = company_number.replace('whatsapp:', '')
     result = await db_session.execute(
-        select(Company).where(Company.company_number == company_number)
+        COMPANY_BY_NUMBER_STMT, {"company_number": company_number}
     )
-    return result.scalar_one_or_none()
\ No newline at end of file
+    return result.scalar_one_or_none()
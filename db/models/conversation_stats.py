@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, DateTime, ForeignKey
+from db.database import Base
+
+
+class ConversationStatsHourly(Base):
+    """
+    Agregados por empresa y hora (UTC) para el dashboard, mantenidos con upserts en la misma
+    transacción que el turno o la cita (ver apps/dashboard/rollups.py).
+    """
+    __tablename__ = "conversation_stats_hourly"
+
+    company_id = Column(Integer, ForeignKey("companies.id"), primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    messages_in = Column(Integer, nullable=False, default=0)
+    messages_out = Column(Integer, nullable=False, default=0)
+    bookings = Column(Integer, nullable=False, default=0)
+    cancellations = Column(Integer, nullable=False, default=0)
+    # Turnos cuya intención se resolvió con el fallback al LLM (sin match de palabras clave).
+    llm_fallbacks = Column(Integer, nullable=False, default=0)
+    response_ms_sum = Column(BigInteger, nullable=False, default=0)
+
+
+class ConversationLatencyHourly(Base):
+    """Histograma por hora del tiempo de respuesta: turnos por cubeta de LATENCY_BUCKETS_MS."""
+    __tablename__ = "conversation_latency_hourly"
+
+    company_id = Column(Integer, ForeignKey("companies.id"), primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    bucket = Column(SmallInteger, primary_key=True)
+    turns = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from db.database import Base
+
+
+class LiveFeedWatcher(Base):
+    """
+    Proceso con al menos una conexión SSE abierta al feed en vivo de una empresa (ver
+    apps/dashboard/live_feed.py). Los publicadores solo ejecutan pg_notify para las empresas
+    con un watcher vigente; cada proceso renueva expires_at mientras tenga suscriptores.
+    """
+    __tablename__ = "live_feed_watchers"
+
+    company_id = Column(Integer, primary_key=True)
+    worker_id = Column(String, primary_key=True)
+    expires_at = Column(DateTime, nullable=False)
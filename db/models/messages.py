@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from db.database import Base
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_session_id_timestamp", "chat_session_id", "timestamp"),
+        Index("ix_messages_timestamp", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     message_sid = Column(String, nullable=False, unique=True, index=True)
@@ -0,0 +1,54 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, text
+from datetime import datetime, timezone
+from db.database import Base
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class OutboundMessage(Base):
+    """
+    Mensaje saliente de WhatsApp en la cola de envío (ver apps/whatsapp/outbound_sender.py).
+
+    status: queued -> sending -> sent -> delivered/read, o retry (reintento pendiente) y
+    failed/undelivered. Twilio informa los estados posteriores a sent por el callback de estado.
+    """
+    __tablename__ = "outbound_messages"
+    __table_args__ = (
+        # Solo las filas pendientes: el worker las toma por next_attempt_at.
+        Index(
+            "ix_outbound_messages_pending",
+            "next_attempt_at",
+            postgresql_where=text("status IN ('queued', 'retry', 'sending')"),
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=True, index=True)
+    from_number = Column(String, nullable=False)
+    to_number = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=_utcnow)
+    last_error = Column(String, nullable=True)
+    error_code = Column(String, nullable=True)
+    provider_sid = Column(String, nullable=True, unique=True)
+    # Clave opcional para encolar sin duplicados (p. ej. "campaña:teléfono").
+    idempotency_key = Column(String, nullable=True, unique=True)
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
+    updated_at = Column(DateTime, nullable=False, default=_utcnow, onupdate=_utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+
+class OutboundSenderRate(Base):
+    """
+    Límite de envío compartido por número remitente (GCRA, ver SenderRateLimiter en
+    apps/whatsapp/outbound_sender.py): theoretical_arrival es el instante (UTC) a partir del cual
+    queda libre el siguiente envío. Todos los workers y réplicas reservan sobre la misma fila.
+    """
+    __tablename__ = "outbound_sender_rates"
+
+    from_number = Column(String, primary_key=True)
+    theoretical_arrival = Column(DateTime, nullable=False)
@@ -0,0 +1,323 @@
+"""
+Particionamiento opcional por empresa de chat_sessions y messages.
+
+Esquema particionado:
+  - chat_sessions: PARTITION BY HASH (company_id), PK (id, company_id).
+  - messages: PARTITION BY HASH (company_id) y cada partición de hash sub-particionada
+    por día con PARTITION BY RANGE ("timestamp"); PK (id, company_id, "timestamp").
+    Cada partición de hash tiene una partición DEFAULT para filas fuera de rango.
+
+Como todas las consultas de los repositorios filtran por company_id, Postgres descarta las
+particiones de las demás empresas (partition pruning).
+
+Restricciones del esquema particionado: las claves únicas deben incluir las columnas de
+partición, por lo que message_sid pasa a ser único por (message_sid, company_id, "timestamp").
+La tabla particionada de messages no lleva FK a chat_sessions: durante la doble escritura
+rechazaría mensajes de sesiones aún no copiadas (la relación la mantiene el ORM).
+
+La migración en línea de una instalación existente (ver partition_tables.py) es:
+  prepare   -> crea las tablas particionadas "sombra" y triggers de doble escritura
+  backfill  -> copia las filas existentes por lotes (ON CONFLICT DO NOTHING)
+  reconcile -> borra de la sombra filas eliminadas del original durante la copia
+  swap      -> en una transacción corta renombra original -> *_legacy y sombra -> original
+"""
+
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import List
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+HASH_MODULUS = int(os.getenv("PARTITION_HASH_MODULUS", "8"))
+MESSAGES_PARTITION_DAYS_AHEAD = int(os.getenv("MESSAGES_PARTITION_DAYS_AHEAD", "7"))
+BACKFILL_BATCH_SIZE = int(os.getenv("PARTITION_BACKFILL_BATCH_SIZE", "5000"))
+
+SHADOW_SUFFIX = "_partitioned"
+LEGACY_SUFFIX = "_legacy"
+
+CHAT_SESSION_COLUMNS = (
+    "id", "user_phone_number", "company_id", "session_data", "status", "started_at", "last_activity",
+)
+MESSAGE_COLUMNS = (
+    "id", "message_sid", "body", "timestamp", "direction", "sender_phone_number", "company_id", "chat_session_id",
+)
+
+# Nombre de las sub-particiones diarias: messages_h<resto>_<AAAAMMDD>
+_DAILY_PARTITION_RE = re.compile(r"^messages_h(\d+)_(\d{8})$")
+
+
+def _columns(columns) -> str:
+    return ", ".join(f'"{c}"' for c in columns)
+
+
+def _daily_partition_name(remainder: int, day: date) -> str:
+    return f"messages_h{remainder}_{day:%Y%m%d}"
+
+
+async def is_partitioned(conn, table: str) -> bool:
+    result = await conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        {"table": table},
+    )
+    return result.scalar() is not None
+
+
+def partitioned_schema_ddl(chat_sessions: str, messages: str, modulus: int = HASH_MODULUS) -> List[str]:
+    """DDL de las tablas particionadas (sin sub-particiones diarias, ver ensure_message_partitions)."""
+    statements = [
+        f"""
+        CREATE TABLE IF NOT EXISTS {chat_sessions} (
+            LIKE chat_sessions INCLUDING DEFAULTS,
+            PRIMARY KEY (id, company_id)
+        ) PARTITION BY HASH (company_id)
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS {chat_sessions}_active_lookup
+            ON {chat_sessions} (user_phone_number, company_id, last_activity DESC)
+            WHERE status = 'active'
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS {messages} (
+            LIKE messages INCLUDING DEFAULTS,
+            PRIMARY KEY (id, company_id, "timestamp"),
+            UNIQUE (message_sid, company_id, "timestamp")
+        ) PARTITION BY HASH (company_id)
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS {messages}_session_timestamp
+            ON {messages} (company_id, chat_session_id, "timestamp")
+        """,
+        f'CREATE INDEX IF NOT EXISTS {messages}_timestamp ON {messages} ("timestamp")',
+    ]
+    for remainder in range(modulus):
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS chat_sessions_h{remainder} PARTITION OF {chat_sessions} "
+            f"FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})"
+        )
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS messages_h{remainder} PARTITION OF {messages} "
+            f"FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder}) "
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS messages_h{remainder}_default PARTITION OF messages_h{remainder} DEFAULT"
+        )
+    return statements
+
+
+async def _hash_partitions(conn, parent: str) -> List[int]:
+    result = await conn.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:parent)
+        """),
+        {"parent": parent},
+    )
+    remainders = []
+    for (name,) in result:
+        match = re.match(r"^messages_h(\d+)$", name)
+        if match:
+            remainders.append(int(match.group(1)))
+    return sorted(remainders)
+
+
+async def _create_daily_partition(conn, remainder: int, day: date, name: str) -> int:
+    """
+    Crea la sub-partición diaria `name`. Si la partición DEFAULT ya tiene filas de ese día (el
+    mantenimiento estuvo detenido más de days_ahead días), Postgres rechaza el CREATE: se
+    desconecta la DEFAULT, se crea la partición, se mueven las filas y se vuelve a conectar.
+    Retorna cuántas filas se movieron.
+    """
+    parent = f"messages_h{remainder}"
+    default = f"{parent}_default"
+    start = datetime.combine(day, datetime.min.time())
+    bounds = {"start": start, "end": start + timedelta(days=1)}
+    range_filter = '"timestamp" >= :start AND "timestamp" < :end'
+    create = (
+        f"CREATE TABLE {name} PARTITION OF {parent} "
+        f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+    )
+    in_default = (await conn.execute(text(f"SELECT 1 FROM {default} WHERE {range_filter} LIMIT 1"), bounds)).scalar()
+    if not in_default:
+        await conn.execute(text(create))
+        return 0
+    # Mientras tanto las escrituras a esta partición de hash esperan el lock de la transacción.
+    cols = _columns(MESSAGE_COLUMNS)
+    await conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {default}"))
+    await conn.execute(text(create))
+    moved = (await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE {range_filter} RETURNING {cols}) "
+        f"INSERT INTO {name} ({cols}) SELECT {cols} FROM moved"
+    ), bounds)).rowcount
+    await conn.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {default} DEFAULT"))
+    return moved
+
+
+async def ensure_message_partitions(conn, parent: str = "messages", days_ahead: int = MESSAGES_PARTITION_DAYS_AHEAD, start: date = None) -> int:
+    """
+    Crea las sub-particiones diarias de messages desde `start` (hoy por defecto) hasta
+    `days_ahead` días adelante en cada partición de hash. Retorna cuántas se crearon.
+    """
+    start = start or datetime.utcnow().date()
+    created = 0
+    for remainder in await _hash_partitions(conn, parent):
+        for offset in range(days_ahead + 1):
+            day = start + timedelta(days=offset)
+            name = _daily_partition_name(remainder, day)
+            exists = (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar()
+            if exists:
+                continue
+            try:
+                # Cada día en su savepoint: si uno falla se omite y se reintenta en la próxima
+                # ejecución, sin deshacer los demás.
+                async with conn.begin_nested():
+                    moved = await _create_daily_partition(conn, remainder, day, name)
+            except Exception as e:
+                logger.error(f"No se pudo crear la partición {name}: {e}")
+                continue
+            if moved:
+                logger.warning(f"Partición {name}: {moved} filas movidas desde messages_h{remainder}_default.")
+            created += 1
+    if created:
+        logger.info(f"Particiones diarias de messages creadas: {created}.")
+    return created
+
+
+async def drop_expired_message_partitions(conn, cutoff: datetime) -> int:
+    """
+    Elimina las sub-particiones diarias que terminan antes de `cutoff` y ya están vacías
+    (sus filas fueron purgadas o archivadas). Retorna cuántas se eliminaron.
+    """
+    result = await conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname ~ '^messages_h[0-9]+$'
+    """))
+    dropped = 0
+    for (name,) in result.all():
+        match = _DAILY_PARTITION_RE.match(name)
+        if not match:
+            continue
+        day_end = datetime.strptime(match.group(2), "%Y%m%d") + timedelta(days=1)
+        if day_end > cutoff:
+            continue
+        has_rows = (await conn.execute(text(f"SELECT 1 FROM {name} LIMIT 1"))).scalar()
+        if has_rows:
+            continue
+        await conn.execute(text(f"DROP TABLE {name}"))
+        dropped += 1
+    if dropped:
+        logger.info(f"Particiones diarias de messages eliminadas: {dropped}.")
+    return dropped
+
+
+# === Migración en línea ===
+
+def _mirror_trigger_ddl(source: str, target: str, columns, key_columns) -> List[str]:
+    cols = _columns(columns)
+    new_values = ", ".join(f'NEW."{c}"' for c in columns)
+    updates = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in columns if c not in key_columns)
+    key_match = " AND ".join(f'"{c}" = OLD."{c}"' for c in key_columns)
+    conflict = _columns(key_columns)
+    function = f"{source}_mirror_to_partitioned"
+    return [
+        f"""
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM {target} WHERE {key_match};
+                RETURN OLD;
+            END IF;
+            INSERT INTO {target} ({cols}) VALUES ({new_values})
+            ON CONFLICT ({conflict}) DO UPDATE SET {updates};
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        f"DROP TRIGGER IF EXISTS {function} ON {source}",
+        f"""
+        CREATE TRIGGER {function}
+        AFTER INSERT OR UPDATE OR DELETE ON {source}
+        FOR EACH ROW EXECUTE FUNCTION {function}()
+        """,
+    ]
+
+
+async def prepare_partitioned_tables(conn, modulus: int = HASH_MODULUS) -> None:
+    """Crea las tablas sombra particionadas y los triggers de doble escritura."""
+    chat_sessions = f"chat_sessions{SHADOW_SUFFIX}"
+    messages = f"messages{SHADOW_SUFFIX}"
+    for statement in partitioned_schema_ddl(chat_sessions, messages, modulus):
+        await conn.execute(text(statement))
+
+    # Sub-particiones desde el mensaje más antiguo para que la copia no caiga en DEFAULT.
+    oldest = (await conn.execute(text('SELECT min("timestamp") FROM messages'))).scalar()
+    start = oldest.date() if oldest else datetime.utcnow().date()
+    days = (datetime.utcnow().date() - start).days + MESSAGES_PARTITION_DAYS_AHEAD
+    await ensure_message_partitions(conn, parent=messages, days_ahead=days, start=start)
+
+    for statement in _mirror_trigger_ddl("chat_sessions", chat_sessions, CHAT_SESSION_COLUMNS, ("id", "company_id")):
+        await conn.execute(text(statement))
+    for statement in _mirror_trigger_ddl("messages", messages, MESSAGE_COLUMNS, ("id", "company_id", "timestamp")):
+        await conn.execute(text(statement))
+    logger.info("Tablas particionadas y triggers de doble escritura creados.")
+
+
+async def backfill_table(engine, table: str, columns, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Copia las filas existentes a la tabla sombra por rangos de id, una transacción corta por
+    lote. Es reanudable: las filas ya copiadas (o escritas por el trigger) se ignoran.
+    """
+    target = f"{table}{SHADOW_SUFFIX}"
+    cols = _columns(columns)
+    async with engine.connect() as conn:
+        max_id = (await conn.execute(text(f"SELECT coalesce(max(id), 0) FROM {table}"))).scalar()
+    copied = 0
+    last_id = 0
+    while last_id < max_id:
+        upper = last_id + batch_size
+        async with engine.begin() as conn:
+            result = await conn.execute(text(
+                f"INSERT INTO {target} ({cols}) SELECT {cols} FROM {table} "
+                f"WHERE id > :lower AND id <= :upper ON CONFLICT DO NOTHING"
+            ), {"lower": last_id, "upper": upper})
+            copied += result.rowcount or 0
+        last_id = upper
+        logger.info(f"Backfill {table}: hasta id {min(upper, max_id)} de {max_id} ({copied} filas copiadas).")
+    return copied
+
+
+async def reconcile_table(conn, table: str) -> int:
+    """Borra de la sombra las filas que ya no existen en el original (eliminadas durante la copia)."""
+    target = f"{table}{SHADOW_SUFFIX}"
+    result = await conn.execute(text(
+        f"DELETE FROM {target} s WHERE NOT EXISTS (SELECT 1 FROM {table} o WHERE o.id = s.id)"
+    ))
+    return result.rowcount or 0
+
+
+async def swap_tables(conn) -> None:
+    """
+    Intercambia las tablas en una sola transacción corta (debe ejecutarse dentro de conn.begin()).
+    Las originales quedan como *_legacy para poder revertir; borrarlas manualmente después.
+    """
+    await conn.execute(text("LOCK TABLE chat_sessions, messages IN ACCESS EXCLUSIVE MODE"))
+    await conn.execute(text("DROP TRIGGER IF EXISTS messages_mirror_to_partitioned ON messages"))
+    await conn.execute(text("DROP TRIGGER IF EXISTS chat_sessions_mirror_to_partitioned ON chat_sessions"))
+    for table in ("messages", "chat_sessions"):
+        sequence = (await conn.execute(text(f"SELECT pg_get_serial_sequence('{table}', 'id')"))).scalar()
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}{LEGACY_SUFFIX}"))
+        await conn.execute(text(f"ALTER TABLE {table}{SHADOW_SUFFIX} RENAME TO {table}"))
+        if sequence:
+            # La tabla nueva usa la misma secuencia: se le transfiere para que borrar *_legacy no la elimine.
+            await conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    await conn.execute(text("DROP FUNCTION IF EXISTS messages_mirror_to_partitioned()"))
+    await conn.execute(text("DROP FUNCTION IF EXISTS chat_sessions_mirror_to_partitioned()"))
+    logger.info("Tablas intercambiadas: chat_sessions y messages ahora están particionadas.")
@@ -0,0 +1,92 @@
+"""
+Verificación con EXPLAIN de que las consultas del camino caliente usan un índice.
+
+Se ejecuta contra una base con las migraciones aplicadas (p. ej. en CI):
+    python -m db.query_plans
+
+Las tablas de prueba suelen ser pequeñas y el planificador preferiría un Seq Scan, por lo
+que cada EXPLAIN corre con enable_seqscan desactivado dentro de una transacción que se
+descarta (un savepoint si la conexión ya está en una transacción): así se verifica que existe
+un índice utilizable, no el costo real. Con tablas vacías y sin estadísticas varios índices
+empatan en costo; tests/test_query_plans.py carga filas representativas y corre ANALYZE en
+una transacción que descarta al terminar.
+"""
+
+import asyncio
+import json
+import sys
+from typing import Any, Dict, List
+
+from sqlalchemy import text
+
+from db.database import engine
+
+# (nombre, sentencia con valores fijos, índice esperado)
+HOT_QUERIES = [
+    (
+        "historial de mensajes de una sesión",
+        "SELECT * FROM messages WHERE chat_session_id = 1 ORDER BY timestamp DESC LIMIT 10",
+        "ix_messages_chat_session_id_timestamp",
+    ),
+    (
+        "sesión activa del usuario",
+        "SELECT * FROM chat_sessions WHERE user_phone_number = 'whatsapp:+570000000000' "
+        "AND company_id = 1 AND status = 'active' ORDER BY last_activity DESC LIMIT 1",
+        "ix_chat_sessions_active_lookup",
+    ),
+    (
+        "barrido de la purga",
+        "DELETE FROM messages WHERE timestamp < '2000-01-01'",
+        "ix_messages_timestamp",
+    ),
+    (
+        "empresa por número",
+        "SELECT * FROM companies WHERE company_number = '+14155238886'",
+        "companies_company_number_key",
+    ),
+]
+
+INDEX_NODE_TYPES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def _used_indexes(plan: Dict[str, Any]) -> List[str]:
+    found = []
+    if plan.get("Node Type") in INDEX_NODE_TYPES and plan.get("Index Name"):
+        found.append(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        found.extend(_used_indexes(child))
+    return found
+
+
+async def check_query_plans(connection) -> List[Dict[str, Any]]:
+    """Ejecuta EXPLAIN de cada consulta y retorna [{'query', 'expected', 'used', 'ok'}]."""
+    results = []
+    for name, sql, expected_index in HOT_QUERIES:
+        begin = connection.begin_nested if connection.in_transaction() else connection.begin
+        transaction = await begin()
+        try:
+            await connection.execute(text("SET LOCAL enable_seqscan = off"))
+            raw_plan = (await connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar()
+        finally:
+            await transaction.rollback()
+        plan = raw_plan if isinstance(raw_plan, list) else json.loads(raw_plan)
+        used = _used_indexes(plan[0]["Plan"])
+        results.append({"query": name, "expected": expected_index, "used": used, "ok": expected_index in used})
+    return results
+
+
+async def main() -> int:
+    async with engine.connect() as connection:
+        results = await check_query_plans(connection)
+    await engine.dispose()
+
+    failed = 0
+    for result in results:
+        status = "OK " if result["ok"] else "ERR"
+        failed += 0 if result["ok"] else 1
+        print(f"[{status}] {result['query']}: esperado {result['expected']}, usados {result['used'] or 'ninguno'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
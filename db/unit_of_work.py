@@ -0,0 +1,63 @@
+"""
+Unidad de trabajo por turno de conversación.
+
+Separa el turno en tres fases para que una conexión del pool solo se retenga unos milisegundos:
+  1. read():  lecturas al inicio (empresa, sesión) en una sesión que se cierra al salir;
+              los objetos cargados siguen disponibles (quedan desasociados). Con
+              replica=True la lectura va a la réplica (datos que toleran retraso).
+  2. Llamadas externas (LLM, calendario) sin ninguna transacción abierta.
+  3. write(): todas las escrituras en una única transacción corta, con un solo commit.
+              Los objetos registrados con stage() (nuevos o modificados durante el turno)
+              se agregan a esa transacción.
+"""
+
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List
+
+from db.database import SessionLocal, ReadSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class TurnUnitOfWork:
+    def __init__(self, session_factory=SessionLocal, read_session_factory=ReadSessionLocal):
+        self._session_factory = session_factory
+        self._read_session_factory = read_session_factory
+        self._staged: List[object] = []
+
+    def stage(self, *objects) -> None:
+        """Registra objetos (nuevos o modificados fuera de una sesión) para la fase de escritura."""
+        self._staged.extend(obj for obj in objects if obj is not None)
+
+    @asynccontextmanager
+    async def read(self, replica: bool = False):
+        """
+        Sesión de solo lectura. Sin autoflush, para que modificar objetos cargados no emita
+        escrituras; al cerrarse libera la conexión sin expirar los objetos leídos.
+        """
+        started = time.perf_counter()
+        factory = self._read_session_factory if replica else self._session_factory
+        async with factory(autoflush=False) as session:
+            yield session
+        logger.debug("UOW: fase de lectura retuvo la sesión %.1f ms", (time.perf_counter() - started) * 1000)
+
+    @asynccontextmanager
+    async def write(self):
+        """
+        Transacción de escritura del turno: agrega los objetos registrados, entrega la sesión
+        para escrituras adicionales y hace commit al salir (rollback si hay error).
+        """
+        started = time.perf_counter()
+        async with self._session_factory() as session:
+            try:
+                session.add_all(self._staged)
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                self._staged.clear()
+        logger.debug("UOW: fase de escritura retuvo la sesión %.1f ms", (time.perf_counter() - started) * 1000)
@@ -1,20 +1,38 @@
 import asyncio
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from alembic import command
+from alembic.config import Config
+
 from db.database import engine, Base
 from db.models import company, appointment, chat_session, messages
 
-async def init_models():
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+async def drop_models():
     async with engine.begin() as conn:
-        if os.getenv("ENVIRONMENT", "development") == "development":
-            await conn.run_sync(Base.metadata.drop_all)
-            print("Todas las tablas eliminadas.")
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.exec_driver_sql("DROP TABLE IF EXISTS alembic_version")
+    await engine.dispose()
+    print("Todas las tablas eliminadas.")
+
+def init_models(reset: bool = False):
+    """
+    Aplica las migraciones de Alembic hasta la última revisión.
+    Con --reset (solo en development) borra antes todas las tablas.
+    """
+    if reset:
+        if os.getenv("ENVIRONMENT", "development") != "development":
+            print("--reset solo está permitido con ENVIRONMENT=development.")
+            sys.exit(1)
+        asyncio.run(drop_models())
 
-        await conn.run_sync(Base.metadata.create_all)
-        print("Tablas creadas correctamente.")
+    command.upgrade(Config(ALEMBIC_INI), "head")
+    print("Migraciones aplicadas correctamente.")
 
 if __name__ == "__main__":
-    asyncio.run(init_models())
\ No newline at end of file
+    init_models(reset="--reset" in sys.argv)
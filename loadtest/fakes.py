@@ -0,0 +1,243 @@
+"""
+Dobles en proceso de Gemini y Google Calendar para las pruebas de carga.
+
+- LatencyModel: latencia log-normal definida por su mediana y su p95, más una tasa de error.
+- FakeLLM: backend del LLM (apps/ai/llm_backends) que responde a los prompts de
+  apps/ai/nlp_utils con reglas simples (opción mencionada, nombre, "NO" para fechas).
+- FakeCalendarService: imita el cliente de googleapiclient (events().list/insert/delete/patch
+  y new_batch_http_request) sobre eventos en memoria, con filtros por rango de tiempo y
+  privateExtendedProperty.
+
+Igual que los clientes reales, las llamadas del calendario bloquean el hilo que las ejecuta;
+las del LLM bloquean el event loop con mode="blocking" (como el cliente actual de Gemini) o
+esperan con asyncio.sleep con mode="async".
+"""
+
+import ast
+import asyncio
+import itertools
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from apps.ai.llm_backends import LLMBackend, LLMResponse
+
+
+class LatencyModel:
+    """Latencia log-normal (mediana y p95 en milisegundos) con una tasa de error."""
+
+    def __init__(self, median_ms: float, p95_ms: Optional[float] = None, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.p95_ms = p95_ms or median_ms
+        self.error_rate = error_rate
+        self.sigma = math.log(self.p95_ms / median_ms) / 1.645 if median_ms > 0 and self.p95_ms > median_ms else 0.0
+        self._random = random.Random(seed)
+
+    @classmethod
+    def parse(cls, spec: str, error_rate: float = 0.0) -> "LatencyModel":
+        """'mediana' o 'mediana,p95' en milisegundos."""
+        parts = [float(p) for p in spec.split(",") if p.strip()]
+        return cls(parts[0], parts[1] if len(parts) > 1 else None, error_rate)
+
+    def sample_seconds(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms * math.exp(self._random.gauss(0, self.sigma)) / 1000
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+_MESSAGE_RE = re.compile(r"(?:mensaje: \"|Mensaje: ')(.*?)(?:\"\n|'$)", re.DOTALL)
+_OPTIONS_RE = re.compile(r"Opciones válidas para este campo: (\[.*?\])")
+
+
+class FakeLLMError(Exception):
+    pass
+
+
+class FakeLLM(LLMBackend):
+    """Backend del LLM con respuestas por reglas."""
+
+    name = "fake"
+
+    def __init__(self, latency: LatencyModel, mode: str = "blocking"):
+        super().__init__()
+        self.latency = latency
+        self.mode = mode
+
+    def respond(self, prompt: str) -> str:
+        match = _MESSAGE_RE.search(prompt)
+        message = match.group(1) if match else ""
+        options_match = _OPTIONS_RE.search(prompt)
+        if options_match:
+            words = set(_normalize(message).split())
+            for option in ast.literal_eval(options_match.group(1)):
+                if any(part in words for part in _normalize(option).split()):
+                    return option
+            return "None"
+        if "nombre completo" in prompt:
+            words = message.split()
+            looks_like_name = 0 < len(words) <= 4 and not any(c.isdigit() for c in message)
+            return message if looks_like_name else "NO"
+        if "fecha y hora" in prompt:
+            return "NO"
+        if "intención principal" in prompt:
+            return "unknown"
+        return "Entendido."
+
+    async def _generate(self, messages: List[Dict[str, Any]]) -> LLMResponse:
+        prompt = " ".join(part.get("text", "") for part in messages[-1].get("parts", []))
+        delay = self.latency.sample_seconds()
+        if self.mode == "blocking":
+            time.sleep(delay)
+        else:
+            await asyncio.sleep(delay)
+        if self.latency.should_fail():
+            raise FakeLLMError("Error simulado del LLM")
+        text = self.respond(prompt)
+        return LLMResponse(text, prompt_tokens=len(prompt) // 4, output_tokens=len(text) // 4, latency_ms=delay * 1000)
+
+
+class FakeCalendarError(Exception):
+    pass
+
+
+class _Request:
+    def __init__(self, service: "FakeCalendarService", operation: Callable[[], Any]):
+        self._service = service
+        self._operation = operation
+
+    def execute(self):
+        return self._service._call(self._operation)
+
+
+class _Batch:
+    def __init__(self, service: "FakeCalendarService", callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: _Request, request_id: str):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        # Una sola "petición HTTP" para todo el lote, como el batch real.
+        def run_all():
+            for request_id, request in self._requests:
+                try:
+                    self._callback(request_id, request._operation(), None)
+                except Exception as e:
+                    self._callback(request_id, None, e)
+        return self._service._call(run_all)
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class _Events:
+    def __init__(self, service: "FakeCalendarService"):
+        self._service = service
+
+    def list(self, calendarId, timeMin=None, timeMax=None, privateExtendedProperty=None, maxResults=250, pageToken=None, **kwargs):
+        def operation():
+            filters = privateExtendedProperty or []
+            if isinstance(filters, str):
+                filters = [filters]
+            wanted = dict(f.split("=", 1) for f in filters)
+            start_bound = _parse_time(timeMin) if timeMin else None
+            end_bound = _parse_time(timeMax) if timeMax else None
+            items = []
+            for event in self._service.calendar(calendarId).values():
+                start = _parse_time(event["start"]["dateTime"])
+                end = _parse_time(event["end"]["dateTime"])
+                if start_bound and end <= start_bound:
+                    continue
+                if end_bound and start >= end_bound:
+                    continue
+                private = event.get("extendedProperties", {}).get("private", {})
+                if any(private.get(k) != v for k, v in wanted.items()):
+                    continue
+                items.append(event)
+            items.sort(key=lambda e: e["start"]["dateTime"])
+            return {"items": items[:maxResults]}
+        return _Request(self._service, operation)
+
+    def insert(self, calendarId, body, **kwargs):
+        def operation():
+            event = dict(body, id=f"fake{next(self._service.ids)}")
+            event["htmlLink"] = f"https://calendar.local/event?eid={event['id']}"
+            self._service.calendar(calendarId)[event["id"]] = event
+            return event
+        return _Request(self._service, operation)
+
+    def delete(self, calendarId, eventId, **kwargs):
+        def operation():
+            if self._service.calendar(calendarId).pop(eventId, None) is None:
+                raise FakeCalendarError(f"Evento {eventId} no encontrado")
+            return ""
+        return _Request(self._service, operation)
+
+    def patch(self, calendarId, eventId, body, **kwargs):
+        def operation():
+            event = self._service.calendar(calendarId).get(eventId)
+            if event is None:
+                raise FakeCalendarError(f"Evento {eventId} no encontrado")
+            event.update(body)
+            return event
+        return _Request(self._service, operation)
+
+
+class FakeCalendarService:
+    """Servicio de Google Calendar en memoria (compartido por todos los hilos)."""
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.calls = 0
+        self.errors = 0
+        self.ids = itertools.count(1)
+        self._calendars: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def calendar(self, calendar_id: str) -> Dict[str, Dict[str, Any]]:
+        return self._calendars.setdefault(calendar_id, {})
+
+    def _call(self, operation: Callable[[], Any]):
+        self.calls += 1
+        time.sleep(self.latency.sample_seconds())
+        if self.latency.should_fail():
+            self.errors += 1
+            raise FakeCalendarError("Error simulado de Google Calendar")
+        with self._lock:
+            return operation()
+
+    def events(self) -> _Events:
+        return _Events(self)
+
+    def new_batch_http_request(self, callback=None) -> _Batch:
+        return _Batch(self, callback)
+
+    @property
+    def event_count(self) -> int:
+        return sum(len(events) for events in self._calendars.values())
+
+
+def install_fakes(llm: LLMBackend, calendar: FakeCalendarService) -> None:
+    """Instala el backend del LLM y reemplaza Google Calendar en los módulos que lo usan."""
+    from apps.ai.llm_backends import set_backend
+    from apps.calendar import availability_cache, bulk_operations, calendar_integration
+
+    set_backend(llm)
+    for module in (calendar_integration, availability_cache, bulk_operations):
+        module.get_calendar_service = lambda: calendar
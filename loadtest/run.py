@@ -0,0 +1,306 @@
+"""
+Prueba de carga de extremo a extremo del webhook de WhatsApp.
+
+Envía payloads de formulario como los de Twilio a /whatsapp/webhook con guiones de
+agendamiento de varios turnos para varias empresas (ver loadtest/scenarios.py). Por defecto
+la aplicación corre en el mismo proceso (httpx + ASGITransport) contra la base de datos de
+DATABASE_URL, con Gemini y Google Calendar reemplazados por dobles con latencia y tasa de
+error configurables (loadtest/fakes.py). Con --url se apunta a un servidor ya levantado; en
+ese modo no hay dobles ni conteo de llamadas.
+
+Reporta throughput, latencia p50/p95/p99 por turno, errores y sentencias SQL, llamadas al
+LLM y al calendario por turno. Con --out se guarda el resultado en JSON y con --baseline se
+compara contra otro resultado (p. ej. del commit anterior) y se sale con código 1 si hay una
+regresión mayor a --max-regression.
+
+Uso (con una base de datos local migrada con `alembic upgrade head`):
+    python -m loadtest.run --seed --companies 4 --conversations 200 --concurrency 20
+    python -m loadtest.run --llm-latency 300,900 --llm-errors 0.01 --calendar-latency 120,400
+    python -m loadtest.run --out actual.json --baseline anterior.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import httpx
+
+GENERIC_ERROR_REPLY = "algo salió mal"
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class DBStatementCounter:
+    """Cuenta las sentencias SQL ejecutadas por los engines de la aplicación."""
+
+    def __init__(self, *engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        seen = set()
+        for async_engine in engines:
+            sync_engine = async_engine.sync_engine
+            if id(sync_engine) in seen:
+                continue
+            seen.add(id(sync_engine))
+            event.listen(sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, companies: List[Dict], args):
+        self.client = client
+        self.companies = companies
+        self.args = args
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.turns = 0
+        self.run_id = uuid.uuid4().hex[:6]
+
+    async def send(self, user_phone: str, company_number: str, body: str) -> None:
+        payload = {
+            "From": f"whatsapp:{user_phone}",
+            "To": f"whatsapp:{company_number}",
+            "Body": body,
+            "MessageSid": f"SM{uuid.uuid4().hex}",
+            "AccountSid": "AC" + "0" * 32,
+            "NumMedia": "0",
+        }
+        started = time.perf_counter()
+        try:
+            response = await self.client.post("/whatsapp/webhook", data=payload)
+            ok = response.status_code == 200 and GENERIC_ERROR_REPLY not in response.text
+        except httpx.HTTPError:
+            ok = False
+        self.latencies.append(time.perf_counter() - started)
+        self.turns += 1
+        if not ok:
+            self.errors += 1
+
+    async def conversation(self, index: int, rng: random.Random) -> None:
+        from loadtest.scenarios import booking_script, schedule_question
+
+        company = self.companies[index % len(self.companies)]
+        user_phone = f"+57{self.run_id}{index:06d}"
+        if rng.random() < self.args.booking_ratio:
+            script = booking_script(company["metadata"], rng)
+        else:
+            script = schedule_question()
+        for body in script:
+            await self.send(user_phone, company["number"], body)
+            if self.args.think_time:
+                await asyncio.sleep(rng.uniform(0, self.args.think_time))
+
+    async def run(self) -> float:
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(self.args.conversations):
+            queue.put_nowait(index)
+
+        async def worker(worker_id: int):
+            rng = random.Random(self.args.seed_rng + worker_id)
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self.conversation(index, rng)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(self.args.concurrency)))
+        return time.perf_counter() - started
+
+
+def build_report(test: LoadTest, elapsed: float, db_counter=None, llm=None, calendar=None) -> Dict:
+    ordered = sorted(test.latencies)
+    turns = max(test.turns, 1)
+    report = {
+        "turns": test.turns,
+        "conversations": test.args.conversations,
+        "concurrency": test.args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_turns_s": round(test.turns / elapsed, 2) if elapsed else 0.0,
+        "errors": test.errors,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ordered) * 1000, 2) if ordered else 0.0,
+            "p50": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99": round(percentile(ordered, 0.99) * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        },
+    }
+    if db_counter is not None:
+        report["db_statements_per_turn"] = round(db_counter.count / turns, 2)
+    if llm is not None:
+        report["llm_calls_per_turn"] = round(llm.calls / turns, 3)
+        report["llm_prompt_tokens_per_turn"] = round(llm.prompt_tokens / turns, 1)
+        report["llm_output_tokens_per_turn"] = round(llm.output_tokens / turns, 1)
+        if hasattr(llm, "misses"):
+            report["llm_replay_misses"] = llm.misses
+    if calendar is not None:
+        report["calendar_calls_per_turn"] = round(calendar.calls / turns, 3)
+        report["calendar_events_created"] = calendar.event_count
+    return report
+
+
+def print_report(report: Dict) -> None:
+    latency = report["latency_ms"]
+    print("\n== Prueba de carga del webhook ==")
+    print(f"turnos: {report['turns']} en {report['elapsed_s']} s ({report['throughput_turns_s']} turnos/s), "
+          f"conversaciones: {report['conversations']}, concurrencia: {report['concurrency']}, errores: {report['errors']}")
+    print(f"latencia (ms): media {latency['mean']}  p50 {latency['p50']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  máx {latency['max']}")
+    for key in ("db_statements_per_turn", "llm_calls_per_turn", "llm_prompt_tokens_per_turn",
+                "llm_output_tokens_per_turn", "llm_replay_misses", "calendar_calls_per_turn"):
+        if key in report:
+            print(f"{key}: {report[key]}")
+
+
+# (métrica, ¿más alto es peor?)
+COMPARED_METRICS = (
+    (("latency_ms", "p50"), True),
+    (("latency_ms", "p95"), True),
+    (("latency_ms", "p99"), True),
+    (("throughput_turns_s",), False),
+    (("db_statements_per_turn",), True),
+    (("llm_calls_per_turn",), True),
+    (("llm_prompt_tokens_per_turn",), True),
+    (("calendar_calls_per_turn",), True),
+)
+
+
+def compare(report: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Compara contra un resultado anterior; retorna las regresiones que superan el umbral."""
+    regressions = []
+    print("\n== Comparación con la línea base ==")
+    for path, higher_is_worse in COMPARED_METRICS:
+        current, previous = report, baseline
+        for key in path:
+            current = current.get(key) if isinstance(current, dict) else None
+            previous = previous.get(key) if isinstance(previous, dict) else None
+        if current is None or previous is None:
+            continue
+        name = ".".join(path)
+        change = (current - previous) / previous if previous else 0.0
+        worse = change > max_regression if higher_is_worse else change < -max_regression
+        print(f"{name:<28} {previous:>10} -> {current:>10} ({change:+.1%}){'  REGRESIÓN' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+async def run_in_process(args) -> Dict:
+    from loadtest.fakes import FakeCalendarService, FakeLLM, LatencyModel, install_fakes
+    from loadtest.scenarios import loadtest_company_number, seed_companies
+
+    if args.llm_replay:
+        from apps.ai.llm_backends import ReplayBackend
+
+        llm = ReplayBackend(args.llm_replay, args.llm_replay_latency)
+    else:
+        llm = FakeLLM(LatencyModel.parse(args.llm_latency, args.llm_errors), mode=args.llm_mode)
+    calendar = FakeCalendarService(LatencyModel.parse(args.calendar_latency, args.calendar_errors))
+    install_fakes(llm, calendar)
+
+    from db.database import SessionLocal, engine, read_engine
+    from main import app
+
+    if args.seed:
+        async with SessionLocal() as session:
+            companies = await seed_companies(session, args.companies)
+    else:
+        from loadtest.scenarios import company_templates
+
+        templates = company_templates()
+        companies = [
+            {"number": loadtest_company_number(i), "metadata": templates[i % len(templates)]["company_metadata"]}
+            for i in range(args.companies)
+        ]
+
+    db_counter = DBStatementCounter(engine, read_engine)
+    # El conteo de llamadas empieza después de la siembra.
+    llm.calls = llm.prompt_tokens = llm.output_tokens = calendar.calls = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+        test = LoadTest(client, companies, args)
+        elapsed = await test.run()
+    await engine.dispose()
+    return build_report(test, elapsed, db_counter, llm, calendar)
+
+
+async def run_remote(args) -> Dict:
+    from loadtest.scenarios import company_templates, loadtest_company_number
+
+    templates = company_templates()
+    companies = [
+        {"number": loadtest_company_number(i), "metadata": templates[i % len(templates)]["company_metadata"]}
+        for i in range(args.companies)
+    ]
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        test = LoadTest(client, companies, args)
+        elapsed = await test.run()
+    return build_report(test, elapsed)
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del webhook de WhatsApp.")
+    parser.add_argument("--url", help="servidor ya levantado (sin dobles en proceso)")
+    parser.add_argument("--seed", action="store_true", help="crear/actualizar las empresas de prueba antes de empezar")
+    parser.add_argument("--companies", type=int, default=4)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--booking-ratio", type=float, default=0.8, help="fracción de conversaciones que agendan")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pausa máxima entre mensajes (s)")
+    parser.add_argument("--llm-latency", default="300,900", help="mediana[,p95] en ms")
+    parser.add_argument("--llm-errors", type=float, default=0.0)
+    parser.add_argument("--llm-mode", choices=("blocking", "async"), default="blocking",
+                        help="blocking imita al cliente actual de Gemini, que bloquea el event loop")
+    parser.add_argument("--llm-replay", metavar="ARCHIVO",
+                        help="responder con grabaciones de LLM_BACKEND=record en lugar del doble por reglas")
+    parser.add_argument("--llm-replay-latency", default="original",
+                        help="original, none, scaled:<factor> o fixed:<ms>")
+    parser.add_argument("--calendar-latency", default="120,400", help="mediana[,p95] en ms")
+    parser.add_argument("--calendar-errors", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed-rng", type=int, default=1234)
+    parser.add_argument("--out", help="guardar el resultado en JSON")
+    parser.add_argument("--baseline", help="resultado JSON anterior para comparar")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run_remote(args) if args.url else run_in_process(args))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
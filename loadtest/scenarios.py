@@ -0,0 +1,89 @@
+"""
+Empresas y guiones de conversación para las pruebas de carga.
+
+Las empresas se crean a partir de init_company.EMPRESAS (mismo company_metadata), con
+números, api_key y calendar_email propios de la prueba para no tocar las reales.
+"""
+
+import random
+from copy import deepcopy
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy.future import select
+
+from db.models.company import Company
+
+LOADTEST_NUMBER_PREFIX = "+1555000"
+
+NAMES = (
+    "Juan Pérez", "Laura Gómez", "Andrés Rodríguez", "Camila Torres", "Santiago Díaz",
+    "Valentina Herrera", "Mateo Castro", "Isabella Morales", "Sebastián Rojas", "Daniela Vargas",
+)
+OPENINGS = ("hola", "buenas tardes", "buenos días")
+BOOKING_REQUESTS = ("quiero agendar una cita", "necesito una cita", "quisiera reservar una cita por favor")
+
+
+def loadtest_company_number(index: int) -> str:
+    return f"{LOADTEST_NUMBER_PREFIX}{index:04d}"
+
+
+def company_templates() -> List[Dict]:
+    """Las empresas de init_company.py (importado aquí para no cargar su .env al importar este módulo)."""
+    from init_company import EMPRESAS
+
+    return EMPRESAS
+
+
+async def seed_companies(session, count: int) -> List[Dict]:
+    """
+    Crea (o actualiza) `count` empresas de prueba recorriendo las plantillas de
+    init_company.EMPRESAS. Retorna [{"number", "metadata"}] para armar los guiones.
+    """
+    templates = company_templates()
+    seeded = []
+    for index in range(count):
+        template = templates[index % len(templates)]
+        number = loadtest_company_number(index)
+        metadata = deepcopy(template["company_metadata"])
+        result = await session.execute(select(Company).where(Company.company_number == number))
+        company = result.scalars().first()
+        if company is None:
+            company = Company(
+                name=f"{template['name']} (carga {index})",
+                industry=template["industry"],
+                catalog_url=template["catalog_url"],
+                schedule=template["schedule"],
+                company_number=number,
+                whatsapp_token="loadtest",
+                api_key=f"loadtest-api-key-{index}",
+                calendar_email=f"loadtest-{index}@calendar.local",
+                company_metadata=metadata,
+            )
+            session.add(company)
+        else:
+            company.company_metadata = metadata
+        seeded.append({"number": number, "metadata": metadata})
+    await session.commit()
+    return seeded
+
+
+def booking_script(metadata: Dict, rng: random.Random) -> List[str]:
+    """Conversación de agendamiento completa según los appointment_slots de la empresa."""
+    messages = [rng.choice(OPENINGS), rng.choice(BOOKING_REQUESTS)]
+    for slot in metadata.get("appointment_slots", []):
+        if "options" in slot:
+            messages.append(f"con {rng.choice(slot['options'])}")
+        elif slot["key"] == "name":
+            messages.append(rng.choice(NAMES))
+        elif slot.get("type") == "datetime" or slot["key"] in ("datetime", "fecha", "hora"):
+            day = datetime.now() + timedelta(days=rng.randint(1, 60))
+            messages.append(f"{day:%d/%m/%Y} {rng.randint(8, 18)}:00")
+        else:
+            messages.append("sin preferencia")
+    return messages
+
+
+def schedule_question() -> List[str]:
+    """Conversación corta que no agenda: saludo y pregunta por el horario."""
+    return ["hola", "¿cuál es el horario de atención?"]
@@ -3,14 +3,9 @@ import sys
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-import asyncio
 import logging
 from contextlib import asynccontextmanager
 
-# === Configuración básica de logging ===
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
 # === Agregar la carpeta raíz al PYTHONPATH ===
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
@@ -18,11 +13,27 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 dotenv_path = os.getenv('DOTENV_PATH', '.env')
 load_dotenv(dotenv_path)
 
+# === Configuración de logging (asíncrono, JSON; ver apps/monitoring/log_config.py) ===
+from apps.monitoring.log_config import configure_logging, stop_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # === Importar routers ===
 from apps.whatsapp.twilio_webhook_handler import webhook_router
+from apps.monitoring.metrics import metrics_router
+from apps.dashboard.dashboard_api import router as dashboard_router
+from apps.dashboard.live_feed import start_live_feed, stop_live_feed
+from apps.monitoring.profiler import profiler_router
+from apps.monitoring.tracing import configure_tracing, instrument_engine, shutdown_tracing
+from apps.whatsapp.outbound_sender import start_outbound_worker, status_router, stop_outbound_worker
+from apps.whatsapp.reminder_scheduler import start_reminder_scheduler, stop_reminder_scheduler
+from apps.whatsapp.campaigns import campaign_router, start_campaign_runner, stop_campaign_runner
+from apps.jobs.scheduler import start_job_scheduler, stop_job_scheduler
+from db.database import engine, read_engine
 
-# === Importar el servicio de purga de tareas ===
-from tasks import start_purging_service
+# === Trabajos periódicos (purga de mensajes, etc.) ===
+from tasks import register_jobs
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -31,22 +42,39 @@ async def lifespan(app: FastAPI):
     Aquí se inician tareas en segundo plano y se cierran recursos.
     """
     logger.info("La aplicación se está iniciando (via lifespan)...")
-    print("La aplicación se está iniciando (via lifespan)...")
 
-    # Inicia la tarea de purga de mensajes en segundo plano.
-    # Se ejecutará cada 3600 segundos (1 hora) y borrará mensajes con más de 24 horas.
-    asyncio.create_task(start_purging_service(interval_seconds=3600, max_age_hours=24))
-    logger.info("Servicio de purga de mensajes programado para ejecutarse periódicamente.")
-    print("Servicio de purga de mensajes programado.")
+    # Trazas por turno (desactivadas salvo que TRACE_EXPORTER lo indique).
+    if configure_tracing():
+        instrument_engine(engine)
+        if read_engine is not engine:
+            instrument_engine(read_engine)
+
+    # Trabajos periódicos con elección de líder (ver apps/jobs/scheduler.py y tasks.py):
+    # la purga de mensajes corre en un solo worker/réplica a la vez.
+    start_job_scheduler(register_jobs)
+
+    # Worker de la cola de mensajes salientes (ver apps/whatsapp/outbound_sender.py).
+    start_outbound_worker()
+    # Recordatorios de citas (ver apps/whatsapp/reminder_scheduler.py).
+    start_reminder_scheduler()
+    # Campañas de envío masivo (ver apps/whatsapp/campaigns.py).
+    start_campaign_runner()
+    # Feed en vivo de conversaciones por SSE (ver apps/dashboard/live_feed.py).
+    start_live_feed()
 
     yield # Todo el código ANTES de 'yield' se ejecuta en el 'startup'
 
     logger.info("La aplicación se está apagando (via lifespan)...")
-    print("La aplicación se está apagando (via lifespan)...")
-    # El código después de 'yield' se ejecuta al apagar el servidor.
-    # Nota: No se pueden cancelar directamente las tareas creadas con asyncio.create_task() desde aquí.
-    # Para detener tareas en segundo plano, se deberían usar señales o guardar referencias a las tareas.
-    # En el caso de la purga, se detendrá automáticamente al cerrar el servidor.
+    # El código después de 'yield' se ejecuta al apagar el servidor: cada servicio en segundo
+    # plano deja de tomar trabajo nuevo y espera (con límite) al que tiene en curso.
+    await stop_live_feed()
+    await stop_job_scheduler()
+    await stop_campaign_runner()
+    await stop_reminder_scheduler()
+    await stop_outbound_worker()
+    shutdown_tracing()
+    # Último: vacía la cola de logs; lo que se registre después se escribe directo.
+    stop_logging()
 
 
 
@@ -65,6 +93,11 @@ app.add_middleware(
 
 # === Incluir routers ===
 app.include_router(webhook_router, prefix="/whatsapp", tags=["WhatsApp"])
+app.include_router(status_router, prefix="/whatsapp", tags=["WhatsApp"])
+app.include_router(dashboard_router, prefix="/dashboard", tags=["Dashboard"])
+app.include_router(campaign_router, prefix="/campaigns", tags=["Campañas"])
+app.include_router(metrics_router, tags=["Monitoreo"])
+app.include_router(profiler_router, prefix="/admin", tags=["Administración"])
 
 # === Ruta raíz de prueba ===
 @app.get("/")
@@ -0,0 +1,81 @@
+"""Esquema base: tablas tal como las creaba init_db.py
+
+Para una instalación existente creada con init_db.py, marcarla con
+`alembic stamp 0001` antes de `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "companies",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("industry", sa.String(), nullable=True),
+        sa.Column("catalog_url", sa.String(), nullable=True),
+        sa.Column("schedule", sa.String(), nullable=True),
+        sa.Column("company_number", sa.String(), nullable=False, unique=True),
+        sa.Column("whatsapp_token", sa.String(), nullable=False),
+        sa.Column("api_key", sa.String(), nullable=False, unique=True),
+        sa.Column("calendar_email", sa.String(), nullable=True, unique=True),
+        sa.Column("company_metadata", postgresql.JSONB(), nullable=False),
+    )
+    op.create_index("ix_companies_id", "companies", ["id"])
+
+    op.create_table(
+        "appointments",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("client_phone_number", sa.String(), nullable=False),
+        sa.Column("client_name", sa.String(), nullable=False),
+        sa.Column("company_id", sa.Integer(), sa.ForeignKey("companies.id"), nullable=False),
+        sa.Column("scheduled_for", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+    )
+    op.create_index("ix_appointments_id", "appointments", ["id"])
+    op.create_index("ix_appointments_client_phone_number", "appointments", ["client_phone_number"])
+
+    op.create_table(
+        "chat_sessions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_phone_number", sa.String(), nullable=False),
+        sa.Column("company_id", sa.Integer(), sa.ForeignKey("companies.id"), nullable=False),
+        sa.Column("session_data", postgresql.JSONB(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("last_activity", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_chat_sessions_id", "chat_sessions", ["id"])
+    op.create_index("ix_chat_sessions_user_phone_number", "chat_sessions", ["user_phone_number"])
+
+    op.create_table(
+        "messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("message_sid", sa.String(), nullable=False),
+        sa.Column("body", sa.String(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column("direction", sa.String(), nullable=False),
+        sa.Column("sender_phone_number", sa.String(), nullable=False),
+        sa.Column("company_id", sa.Integer(), sa.ForeignKey("companies.id"), nullable=False),
+        sa.Column("chat_session_id", sa.Integer(), sa.ForeignKey("chat_sessions.id"), nullable=False),
+    )
+    op.create_index("ix_messages_id", "messages", ["id"])
+    op.create_index("ix_messages_message_sid", "messages", ["message_sid"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_table("messages")
+    op.drop_table("chat_sessions")
+    op.drop_table("appointments")
+    op.drop_table("companies")
@@ -0,0 +1,54 @@
+"""Índices compuestos para las consultas del camino caliente
+
+- messages (chat_session_id, timestamp): historial de una sesión.
+- chat_sessions (user_phone_number, company_id, last_activity DESC) WHERE status = 'active':
+  búsqueda de la sesión activa.
+- messages (timestamp): barrido de la purga.
+
+Se crean con CREATE INDEX CONCURRENTLY fuera de transacción, sin bloquear escrituras.
+Si una creación concurrente falla queda un índice INVALID: borrarlo y volver a ejecutar.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_chat_session_id_timestamp",
+            "messages",
+            ["chat_session_id", "timestamp"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_chat_sessions_active_lookup",
+            "chat_sessions",
+            ["user_phone_number", "company_id", sa.text("last_activity DESC")],
+            postgresql_where=sa.text("status = 'active'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_messages_timestamp",
+            "messages",
+            ["timestamp"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_messages_timestamp", table_name="messages", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_chat_sessions_active_lookup", table_name="chat_sessions", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_messages_chat_session_id_timestamp", table_name="messages", postgresql_concurrently=True, if_exists=True)
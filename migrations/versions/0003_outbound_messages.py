@@ -0,0 +1,50 @@
+"""Cola de mensajes salientes de WhatsApp (outbound_messages)
+
+Ver apps/whatsapp/outbound_sender.py. Las filas pendientes se buscan por el índice parcial
+sobre next_attempt_at; provider_sid (SID de Twilio) e idempotency_key son únicos.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "outbound_messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("company_id", sa.Integer(), sa.ForeignKey("companies.id"), nullable=True),
+        sa.Column("from_number", sa.String(), nullable=False),
+        sa.Column("to_number", sa.String(), nullable=False),
+        sa.Column("body", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False, server_default="queued"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+        sa.Column("last_error", sa.String(), nullable=True),
+        sa.Column("error_code", sa.String(), nullable=True),
+        sa.Column("provider_sid", sa.String(), nullable=True, unique=True),
+        sa.Column("idempotency_key", sa.String(), nullable=True, unique=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_outbound_messages_company_id", "outbound_messages", ["company_id"])
+    op.create_index(
+        "ix_outbound_messages_pending",
+        "outbound_messages",
+        ["next_attempt_at"],
+        postgresql_where=sa.text("status IN ('queued', 'retry', 'sending')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_outbound_messages_pending", table_name="outbound_messages")
+    op.drop_index("ix_outbound_messages_company_id", table_name="outbound_messages")
+    op.drop_table("outbound_messages")
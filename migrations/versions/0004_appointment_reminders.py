@@ -0,0 +1,61 @@
+"""Columnas e índices de appointments para los recordatorios
+
+- event_id: evento de Google Calendar, para cancelar o mover la cita desde el calendario.
+- updated_at: marca de agua del programador de recordatorios (se rellena con created_at).
+- reminder_sent_at: recordatorio ya encolado (el envío se reclama con WHERE ... IS NULL).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("appointments", sa.Column("event_id", sa.String(), nullable=True))
+    op.add_column("appointments", sa.Column("reminder_sent_at", sa.DateTime(), nullable=True))
+    op.add_column(
+        "appointments",
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+    )
+    op.execute("UPDATE appointments SET updated_at = created_at")
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_appointments_event_id",
+            "appointments",
+            ["event_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_appointments_updated_at",
+            "appointments",
+            ["updated_at"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_appointments_pending_reminder",
+            "appointments",
+            ["scheduled_for"],
+            postgresql_where=sa.text("status = 'scheduled' AND reminder_sent_at IS NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_appointments_pending_reminder", table_name="appointments", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_appointments_updated_at", table_name="appointments", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_appointments_event_id", table_name="appointments", postgresql_concurrently=True, if_exists=True)
+    op.drop_column("appointments", "updated_at")
+    op.drop_column("appointments", "reminder_sent_at")
+    op.drop_column("appointments", "event_id")
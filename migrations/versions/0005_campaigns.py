@@ -0,0 +1,59 @@
+"""Campañas de envío masivo (campaigns, campaign_recipients)
+
+Ver apps/whatsapp/campaigns.py. Los destinatarios cargados se recorren por id (el índice
+único (campaign_id, phone_number) evita duplicados en la lista).
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "campaigns",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("company_id", sa.Integer(), sa.ForeignKey("companies.id"), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("template", sa.String(), nullable=False),
+        sa.Column("source", sa.String(), nullable=False, server_default="chat_sessions"),
+        sa.Column("status", sa.String(), nullable=False, server_default="draft"),
+        sa.Column("cursor", sa.String(), nullable=True),
+        sa.Column("enqueued", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("skipped", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_error", sa.String(), nullable=True),
+        sa.Column("lease_until", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_campaigns_company_id", "campaigns", ["company_id"])
+    op.create_index(
+        "ix_campaigns_running",
+        "campaigns",
+        ["lease_until"],
+        postgresql_where=sa.text("status = 'running'"),
+    )
+    op.create_table(
+        "campaign_recipients",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("campaign_id", sa.Integer(), sa.ForeignKey("campaigns.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("phone_number", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.UniqueConstraint("campaign_id", "phone_number", name="uq_campaign_recipients_phone"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("campaign_recipients")
+    op.drop_index("ix_campaigns_running", table_name="campaigns")
+    op.drop_index("ix_campaigns_company_id", table_name="campaigns")
+    op.drop_table("campaigns")
@@ -0,0 +1,43 @@
+"""Agregados por hora para el dashboard (conversation_stats_hourly, conversation_latency_hourly)
+
+Ver apps/dashboard/rollups.py. La clave primaria (company_id, hour[, bucket]) es la que usan
+los upserts y las lecturas por rango de horas del dashboard. Las tablas empiezan vacías: los
+mensajes anteriores se purgan a las 24 h y no se reconstruyen.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversation_stats_hourly",
+        sa.Column("company_id", sa.Integer(), sa.ForeignKey("companies.id"), primary_key=True),
+        sa.Column("hour", sa.DateTime(), primary_key=True),
+        sa.Column("messages_in", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("messages_out", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("bookings", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cancellations", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("fallbacks", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("response_ms_sum", sa.BigInteger(), nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "conversation_latency_hourly",
+        sa.Column("company_id", sa.Integer(), sa.ForeignKey("companies.id"), primary_key=True),
+        sa.Column("hour", sa.DateTime(), primary_key=True),
+        sa.Column("bucket", sa.SmallInteger(), primary_key=True),
+        sa.Column("turns", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("conversation_latency_hourly")
+    op.drop_table("conversation_stats_hourly")
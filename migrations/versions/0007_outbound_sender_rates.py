@@ -0,0 +1,28 @@
+"""Límite de envío por remitente compartido entre procesos (outbound_sender_rates)
+
+Ver SenderRateLimiter en apps/whatsapp/outbound_sender.py: una fila por número remitente con
+el instante teórico del siguiente envío (GCRA), que reservan todos los workers y réplicas.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "outbound_sender_rates",
+        sa.Column("from_number", sa.String(), primary_key=True),
+        sa.Column("theoretical_arrival", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("outbound_sender_rates")
@@ -0,0 +1,29 @@
+"""Empresas con el feed en vivo abierto (live_feed_watchers)
+
+Ver apps/dashboard/live_feed.py: con una fila vigente por (empresa, proceso), los turnos solo
+publican con pg_notify cuando alguien mira el feed de la empresa.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "live_feed_watchers",
+        sa.Column("company_id", sa.Integer(), primary_key=True),
+        sa.Column("worker_id", sa.String(), primary_key=True),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("live_feed_watchers")
@@ -0,0 +1,26 @@
+"""conversation_stats_hourly.fallbacks -> llm_fallbacks
+
+La columna contaba los turnos que respondió la regla "fallback" del flujo; ahora cuenta los
+turnos cuya intención se resolvió con el fallback al LLM (ver apps/dashboard/rollups.py). Los
+valores anteriores miden otra cosa y se ponen en cero para no mezclarlos en la tasa.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column("conversation_stats_hourly", "fallbacks", new_column_name="llm_fallbacks")
+    op.execute(sa.text("UPDATE conversation_stats_hourly SET llm_fallbacks = 0 WHERE llm_fallbacks <> 0"))
+
+
+def downgrade() -> None:
+    op.alter_column("conversation_stats_hourly", "llm_fallbacks", new_column_name="fallbacks")
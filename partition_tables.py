@@ -0,0 +1,65 @@
+"""
+Migra en línea chat_sessions y messages al esquema particionado por empresa
+(ver db/partitioning.py). Cada paso es reanudable y se puede ejecutar por separado:
+
+    python partition_tables.py prepare     # tablas sombra + triggers de doble escritura
+    python partition_tables.py backfill    # copia por lotes de las filas existentes
+    python partition_tables.py reconcile   # limpia filas borradas durante la copia
+    python partition_tables.py swap        # intercambio atómico (bloqueo de milisegundos)
+    python partition_tables.py all         # todos los pasos en orden
+"""
+import asyncio
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from db.database import engine
+from db.partitioning import (
+    CHAT_SESSION_COLUMNS,
+    MESSAGE_COLUMNS,
+    backfill_table,
+    is_partitioned,
+    prepare_partitioned_tables,
+    reconcile_table,
+    swap_tables,
+)
+
+STEPS = ("prepare", "backfill", "reconcile", "swap")
+
+async def run(steps):
+    async with engine.connect() as conn:
+        if await is_partitioned(conn, "messages"):
+            print("messages ya está particionada; no hay nada que migrar.")
+            return
+
+    for step in steps:
+        if step == "prepare":
+            async with engine.begin() as conn:
+                await prepare_partitioned_tables(conn)
+        elif step == "backfill":
+            # Primero las sesiones: los mensajes las referencian.
+            copied = await backfill_table(engine, "chat_sessions", CHAT_SESSION_COLUMNS)
+            print(f"chat_sessions: {copied} filas copiadas.")
+            copied = await backfill_table(engine, "messages", MESSAGE_COLUMNS)
+            print(f"messages: {copied} filas copiadas.")
+        elif step == "reconcile":
+            async with engine.begin() as conn:
+                for table in ("messages", "chat_sessions"):
+                    removed = await reconcile_table(conn, table)
+                    print(f"{table}: {removed} filas obsoletas eliminadas de la tabla particionada.")
+        elif step == "swap":
+            async with engine.begin() as conn:
+                await swap_tables(conn)
+            print("Intercambio completado. Las tablas originales quedaron como *_legacy.")
+    await engine.dispose()
+
+if __name__ == "__main__":
+    requested = sys.argv[1] if len(sys.argv) > 1 else ""
+    if requested == "all":
+        asyncio.run(run(STEPS))
+    elif requested in STEPS:
+        asyncio.run(run((requested,)))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,109 @@
+"""
+Etiqueta una sola vez los eventos de Google Calendar creados antes de que create_calendar_event
+escribiera extendedProperties.private (resource_id, company_id, user_phone).
+
+Para cada empresa con calendario, recorre los eventos desde hoy y, a los que no tienen
+resource_id, les asigna el recurso cuyo nombre aparece en summary/description (solo si
+coincide exactamente uno). El teléfono se toma de la cita guardada con ese event_id. Los
+eventos sin coincidencia o ambiguos se listan para revisarlos a mano.
+
+    python tag_calendar_events.py            # etiqueta
+    python tag_calendar_events.py --dry-run  # solo muestra lo que haría
+
+Después del backfill, CALENDAR_UNTAGGED_FALLBACK=false vuelve a filtrar la disponibilidad
+por recurso del lado del servidor.
+"""
+import asyncio
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pytz import timezone as pytz_timezone
+
+load_dotenv()
+
+from sqlalchemy import select
+
+from apps.calendar.calendar_integration import (
+    RESOURCE_MATCH_FIELDS,
+    event_blocks_resource,
+    execute_request,
+    get_calendar_service,
+    resource_key,
+)
+from apps.whatsapp.conversation_flow import compile_flow
+from db.database import get_read_db_session
+from db.models.appointment import Appointment
+from db.models.company import Company
+
+
+def _untagged_events(service, calendar_id: str):
+    page_token = None
+    while True:
+        page = execute_request(service.events().list(
+            calendarId=calendar_id,
+            timeMin=datetime.now(pytz_timezone('America/Bogota')).isoformat(),
+            singleEvents=True,
+            maxResults=250,
+            pageToken=page_token,
+            fields=f"items(id,{RESOURCE_MATCH_FIELDS}),nextPageToken",
+        ), "backfill")
+        for event in page.get("items", []):
+            if not ((event.get("extendedProperties") or {}).get("private") or {}).get("resource_id"):
+                yield event
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def _matching_resources(event: dict, resources) -> list:
+    """Recursos nombrados en el evento, con la misma comparación que event_blocks_resource."""
+    return [name for name in resources if event_blocks_resource(event, name)]
+
+
+async def tag_company(service, company, dry_run: bool) -> dict:
+    flow = compile_flow(company.name, company.company_metadata or {})
+    resources = [option for step in flow.steps if step.kind == "options" for option in step.options]
+    totals = {"tagged": 0, "unmatched": 0, "ambiguous": 0}
+    events = await asyncio.to_thread(lambda: list(_untagged_events(service, company.calendar_email)))
+    if not events:
+        return totals
+
+    async with get_read_db_session() as session:
+        result = await session.execute(
+            select(Appointment.event_id, Appointment.client_phone_number)
+            .where(Appointment.company_id == company.id, Appointment.event_id.in_([e["id"] for e in events]))
+        )
+        phones = dict(result.all())
+
+    for event in events:
+        matches = _matching_resources(event, resources)
+        if len(matches) != 1:
+            totals["unmatched" if not matches else "ambiguous"] += 1
+            print(f"  [{company.id}] sin etiquetar {event['id']}: {event.get('summary', '')!r} ({matches or 'sin recurso'})")
+            continue
+        private = {"resource_id": resource_key(matches[0]), "company_id": str(company.id)}
+        if phones.get(event["id"]):
+            private["user_phone"] = phones[event["id"]]
+        if not dry_run:
+            await asyncio.to_thread(execute_request, service.events().patch(
+                calendarId=company.calendar_email,
+                eventId=event["id"],
+                body={"extendedProperties": {"private": private}},
+                fields="id",
+            ), "backfill")
+        totals["tagged"] += 1
+    return totals
+
+
+async def run(dry_run: bool) -> None:
+    async with get_read_db_session() as session:
+        companies = (await session.execute(select(Company).where(Company.calendar_email.isnot(None)))).scalars().all()
+    service = get_calendar_service()
+    for company in companies:
+        totals = await tag_company(service, company, dry_run)
+        print(f"Empresa {company.id} ({company.name}): {totals}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(dry_run="--dry-run" in sys.argv[1:]))
@@ -1,23 +1,36 @@
-import asyncio
+import os
 from datetime import datetime, timedelta, timezone
 import logging
 
 from sqlalchemy import delete
-from db.database import get_db_session
+from db.archive import archive_expired_messages, storage_from_env
+from db.database import engine, get_db_session
 from db.models.messages import Message
+from db.partitioning import drop_expired_message_partitions, ensure_message_partitions, is_partitioned
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 async def purge_old_messages(max_age_hours: int = 24):
     """
     Borra mensajes de la base de datos que sean más antiguos que max_age_hours.
+    Con ARCHIVE_URL definida, antes los copia a archivos comprimidos por empresa y día
+    (ver db/archive.py) y solo borra lo que quedó archivado y verificado.
     """
-    async with get_db_session() as session:
-        # Calcula la fecha y hora de corte (ej. 24 horas antes de ahora, en UTC)
-        cutoff_datetime_aware = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
-        cutoff_datetime = cutoff_datetime_aware.replace(tzinfo=None)
+    # Calcula la fecha y hora de corte (ej. 24 horas antes de ahora, en UTC)
+    cutoff_datetime_aware = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+    cutoff_datetime = cutoff_datetime_aware.replace(tzinfo=None)
+
+    storage = storage_from_env()
+    if storage is not None:
+        totals = await archive_expired_messages(engine, storage, cutoff_datetime)
+        logger.info(
+            "Tarea de purga: Se archivaron y borraron %s mensajes más antiguos que %s horas (antes de %s) "
+            "en %s grupos empresa/día; %s grupos quedan para el próximo intento.",
+            totals["archived"], max_age_hours, cutoff_datetime.isoformat(), totals["groups"], totals["failed_groups"],
+        )
+        return
 
+    async with get_db_session() as session:
         stmt = delete(Message).where(Message.timestamp < cutoff_datetime)
 
         result = await session.execute(stmt)
@@ -25,17 +38,38 @@ async def purge_old_messages(max_age_hours: int = 24):
 
         await session.commit()
 
-        logger.info(f"Tarea de purga: Se borraron {deleted_count} mensajes más antiguos que {max_age_hours} horas (antes de {cutoff_datetime.isoformat()}).")
-        print(f"Tarea de purga: Se borraron {deleted_count} mensajes más antiguos que {max_age_hours} horas.")
+        logger.info(
+            "Tarea de purga: Se borraron %s mensajes más antiguos que %s horas (antes de %s).",
+            deleted_count, max_age_hours, cutoff_datetime.isoformat()
+        )
+
+async def maintain_message_partitions(max_age_hours: int = 24):
+    """
+    Si messages está particionada por empresa y día (ver db/partitioning.py), crea las
+    particiones de los próximos días y elimina las ya vacías tras la purga.
+    """
+    async with engine.begin() as conn:
+        if not await is_partitioned(conn, "messages"):
+            return
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=max_age_hours)
+        await ensure_message_partitions(conn)
+        await drop_expired_message_partitions(conn, cutoff)
 
-async def start_purging_service(interval_seconds: int = 3600, max_age_hours: int = 24):
-    logger.info(f"Servicio de purga iniciado: borrará mensajes más antiguos de {max_age_hours}h cada {interval_seconds} segundos.")
-    print(f"Servicio de purga iniciado: borrará mensajes más antiguos de {max_age_hours}h cada {interval_seconds} segundos.")
+async def purge_messages_job(max_age_hours: int = 24):
+    await purge_old_messages(max_age_hours)
+    await maintain_message_partitions(max_age_hours)
 
-    while True:
-        try:
-            await purge_old_messages(max_age_hours)
-        except Exception as e:
-            logger.error(f"Error durante la purga de mensajes: {e}")
-            print(f"Error durante la purga de mensajes: {e}")
-        await asyncio.sleep(interval_seconds)
\ No newline at end of file
+def register_jobs(scheduler):
+    """
+    Trabajos periódicos de la aplicación (ver apps/jobs/scheduler.py). Cada uno corre en un
+    solo proceso a la vez (el líder de su advisory lock).
+      PURGE_INTERVAL_SECONDS (3600), PURGE_MAX_AGE_HOURS (24), PURGE_JITTER_SECONDS (60)
+    """
+    max_age_hours = int(os.getenv("PURGE_MAX_AGE_HOURS", "24"))
+    scheduler.add_job(
+        "purge_messages",
+        lambda: purge_messages_job(max_age_hours),
+        interval=float(os.getenv("PURGE_INTERVAL_SECONDS", "3600")),
+        jitter=float(os.getenv("PURGE_JITTER_SECONDS", "60")),
+        run_at_start=True,
+    )
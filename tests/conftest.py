@@ -0,0 +1,6 @@
+import os
+
+# db.database crea el engine al importarse (sin conectarse) y exige DATABASE_URL: los tests
+# unitarios no usan la base, así que basta una URL cualquiera. test_query_plans.py se omite si
+# la base no responde.
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://tests@localhost:5432/tests_sin_base")
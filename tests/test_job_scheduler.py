@@ -0,0 +1,111 @@
+"""Expresiones cron y próxima ejecución de los trabajos de apps/jobs/scheduler.py (sin base)."""
+
+from datetime import datetime
+
+import pytest
+
+from apps.jobs.scheduler import CronSchedule, Job
+
+
+def next_after(expression: str, moment: str) -> datetime:
+    return CronSchedule(expression).next_after(datetime.fromisoformat(moment))
+
+
+async def _noop():
+    pass
+
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    ("@hourly", "2026-10-19 10:30", "2026-10-19 11:00"),
+    ("@daily", "2026-12-31 23:59", "2027-01-01 00:00"),
+    ("@weekly", "2026-10-19 08:00", "2026-10-25 00:00"),
+    ("@monthly", "2026-01-31 12:00", "2026-02-01 00:00"),
+])
+def test_aliases(expression, moment, expected):
+    assert next_after(expression, moment) == datetime.fromisoformat(expected)
+
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    # Estrictamente posterior, aunque el instante ya coincida.
+    ("*/15 9-17 * * 1-5", "2026-10-19 09:00", "2026-10-19 09:15"),
+    ("*/15 9-17 * * 1-5", "2026-10-19 09:07:30", "2026-10-19 09:15"),
+    # Viernes después de la última franja: salta el fin de semana.
+    ("*/15 9-17 * * 1-5", "2026-10-16 17:50", "2026-10-19 09:00"),
+    ("0,30 * * * *", "2026-10-19 10:00", "2026-10-19 10:30"),
+    ("10/20 * * * *", "2026-10-19 10:31", "2026-10-19 10:50"),
+    # 0 y 7 son domingo.
+    ("0 0 * * 7", "2026-10-19 00:00", "2026-10-25 00:00"),
+    ("0 0 * * 0", "2026-10-19 00:00", "2026-10-25 00:00"),
+])
+def test_lists_ranges_and_steps(expression, moment, expected):
+    assert next_after(expression, moment) == datetime.fromisoformat(expected)
+
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    # Día del mes o día de la semana (13 o lunes): gana el primero que llegue.
+    ("0 0 13 * 1", "2026-11-07 00:00", "2026-11-09 00:00"),
+    ("0 0 13 * 1", "2026-11-10 00:00", "2026-11-13 00:00"),
+    # Con uno de los dos en *, manda el otro.
+    ("0 0 13 * *", "2026-10-19 00:00", "2026-11-13 00:00"),
+    ("0 0 * * 5", "2026-10-19 00:00", "2026-10-23 00:00"),
+])
+def test_day_of_month_or_day_of_week(expression, moment, expected):
+    assert next_after(expression, moment) == datetime.fromisoformat(expected)
+
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    ("0 0 29 2 *", "2026-03-01 00:00", "2028-02-29 00:00"),
+    # Abril no tiene 31: pasa a mayo.
+    ("0 12 31 * *", "2026-04-01 00:00", "2026-05-31 12:00"),
+    ("0 0 1 1,7 *", "2026-08-01 00:00", "2027-01-01 00:00"),
+    ("59 23 * * *", "2026-12-31 23:59", "2027-01-01 23:59"),
+])
+def test_leap_day_and_month_rollover(expression, moment, expected):
+    assert next_after(expression, moment) == datetime.fromisoformat(expected)
+
+
+@pytest.mark.parametrize("expression", ["60 * * * *", "* 24 * * *", "5-1 * * * *", "*/0 * * * *", "* * * *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_expression_that_never_matches():
+    with pytest.raises(ValueError):
+        next_after("0 0 31 2 *", "2026-01-01 00:00")
+
+
+def test_interval_next_run_counts_from_previous_start():
+    job = Job("purga", _noop, interval=60)
+    start = datetime(2026, 10, 19, 10, 0, 0)
+
+    assert job.next_run(None, start) == datetime(2026, 10, 19, 10, 1)
+    # La ejecución tardó 5 s: la siguiente no se corre esos 5 s.
+    assert job.next_run(start, datetime(2026, 10, 19, 10, 0, 5)) == datetime(2026, 10, 19, 10, 1)
+    # Si la ejecución se pasó del intervalo, la siguiente es ya.
+    late = datetime(2026, 10, 19, 10, 2, 30)
+    assert job.next_run(start, late) == late
+
+
+def test_interval_next_run_does_not_drift():
+    job = Job("purga", _noop, interval=60)
+    scheduled = datetime(2026, 10, 19, 10, 0)
+    for _ in range(100):
+        # Cada ejecución dura 3 s: contar desde el final correría 5 minutos en 100 ejecuciones.
+        scheduled = job.next_run(scheduled, scheduled.replace(second=3))
+    assert scheduled == datetime(2026, 10, 19, 11, 40)
+
+
+def test_cron_next_run_adds_jitter():
+    job = Job("resumen", _noop, cron=CronSchedule("@hourly"), jitter=30)
+    now = datetime(2026, 10, 19, 10, 59, 59)
+    for _ in range(20):
+        delay = (job.next_run(now, now) - datetime(2026, 10, 19, 11, 0)).total_seconds()
+        assert 0 <= delay <= 30
+
+
+def test_job_needs_interval_or_cron():
+    with pytest.raises(ValueError):
+        Job("sin_programa", _noop)
+    with pytest.raises(ValueError):
+        Job("ambos", _noop, interval=60, cron=CronSchedule("@daily"))
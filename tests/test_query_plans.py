@@ -0,0 +1,74 @@
+"""
+Las consultas del camino caliente (db/query_plans.py) usan su índice.
+
+Necesita una base con las migraciones aplicadas en DATABASE_URL; si no responde (sin
+DATABASE_URL, conftest.py apunta a una base inexistente) o no tiene las migraciones, el test
+se omite. Los datos de prueba y las estadísticas se cargan en una transacción
+que se descarta al terminar.
+"""
+
+import pytest
+import pytest_asyncio
+
+SEED_STATEMENTS = (
+    """
+    INSERT INTO companies (name, company_number, whatsapp_token, api_key, company_metadata)
+    VALUES ('Plan de consultas', '+10000000001', 'token', 'query-plans-test', '{}')
+    """,
+    """
+    INSERT INTO chat_sessions (user_phone_number, company_id, session_data, status, started_at, last_activity)
+    SELECT 'whatsapp:+57' || lpad(n::text, 10, '0'), c.id, '{}',
+           CASE WHEN n % 20 = 0 THEN 'active' ELSE 'closed' END,
+           now() - make_interval(days => n % 90), now() - make_interval(days => n % 90)
+    FROM generate_series(1, 2000) AS n, companies c
+    WHERE c.api_key = 'query-plans-test'
+    """,
+    """
+    INSERT INTO messages (message_sid, body, "timestamp", direction, sender_phone_number, company_id, chat_session_id)
+    SELECT 'SM-query-plans-' || s.id || '-' || n, 'hola', s.started_at + make_interval(mins => n),
+           'inbound', s.user_phone_number, s.company_id, s.id
+    FROM chat_sessions s, generate_series(1, 20) AS n, companies c
+    WHERE s.company_id = c.id AND c.api_key = 'query-plans-test'
+    """,
+    "ANALYZE companies",
+    "ANALYZE chat_sessions",
+    "ANALYZE messages",
+)
+
+
+@pytest_asyncio.fixture
+async def seeded_connection():
+    from sqlalchemy import text
+
+    from db.database import engine
+
+    try:
+        connection = await engine.connect()
+    except Exception as e:
+        await engine.dispose()
+        pytest.skip(f"La base de DATABASE_URL no responde: {e}")
+    if (await connection.execute(text("SELECT to_regclass('alembic_version')"))).scalar() is None:
+        await connection.close()
+        await engine.dispose()
+        pytest.skip("La base de DATABASE_URL no tiene las migraciones aplicadas")
+    await connection.rollback()
+    transaction = await connection.begin()
+    try:
+        for statement in SEED_STATEMENTS:
+            await connection.execute(text(statement))
+        yield connection
+    finally:
+        await transaction.rollback()
+        await connection.close()
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_hot_queries_use_their_index(seeded_connection):
+    from db.query_plans import HOT_QUERIES, check_query_plans
+
+    results = await check_query_plans(seeded_connection)
+
+    assert [result["query"] for result in results] == [name for name, _, _ in HOT_QUERIES]
+    failed = [f"{r['query']}: esperado {r['expected']}, usados {r['used'] or 'ninguno'}" for r in results if not r["ok"]]
+    assert not failed, "\n".join(failed)
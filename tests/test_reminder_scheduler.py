@@ -0,0 +1,218 @@
+"""Heap de recordatorios, reglas de _apply y armado del mensaje (apps/whatsapp/reminder_scheduler.py)."""
+
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from apps.whatsapp import reminder_scheduler
+from apps.whatsapp.reminder_scheduler import DEFAULT_REMINDER_MESSAGE, ReminderHeap, ReminderScheduler, _epoch
+
+NOW = datetime(2026, 10, 19, 12, 0)
+
+
+# === ReminderHeap ===
+
+def test_pop_due_returns_entries_in_send_order_up_to_now():
+    heap = ReminderHeap()
+    heap.schedule(1, 300.0, 1.0)
+    heap.schedule(2, 100.0, 1.0)
+    heap.schedule(3, 200.0, 1.0)
+
+    assert heap.next_send_at() == 100.0
+    assert heap.pop_due(now=250.0, limit=10) == [(100.0, 2, 1.0), (200.0, 3, 1.0)]
+    assert len(heap) == 1
+    assert heap.pop_due(now=250.0, limit=10) == []
+    assert heap.next_send_at() == 300.0
+
+
+def test_pop_due_respects_limit():
+    heap = ReminderHeap()
+    for appointment_id in range(5):
+        heap.schedule(appointment_id, float(appointment_id), 1.0)
+
+    assert [entry[1] for entry in heap.pop_due(now=10.0, limit=2)] == [0, 1]
+    assert [entry[1] for entry in heap.pop_due(now=10.0, limit=10)] == [2, 3, 4]
+
+
+def test_reschedule_replaces_previous_entry():
+    heap = ReminderHeap()
+    heap.schedule(1, 100.0, 1.0)
+    heap.schedule(1, 500.0, 2.0)
+
+    assert len(heap) == 1
+    # La entrada vieja sigue en el heap pero ya no es vigente.
+    assert heap.pop_due(now=200.0, limit=10) == []
+    assert heap.pop_due(now=500.0, limit=10) == [(500.0, 1, 2.0)]
+
+
+def test_schedule_same_version_is_a_noop():
+    heap = ReminderHeap()
+    heap.schedule(1, 100.0, 1.0)
+    heap.schedule(1, 100.0, 1.0)
+
+    assert len(heap._heap) == 1
+
+
+def test_discard_removes_pending_entry():
+    heap = ReminderHeap()
+    heap.schedule(1, 100.0, 1.0)
+    heap.schedule(2, 200.0, 1.0)
+    heap.discard(1)
+    heap.discard(99)
+
+    assert len(heap) == 1
+    assert heap.next_send_at() == 200.0
+    assert heap.pop_due(now=1000.0, limit=10) == [(200.0, 2, 1.0)]
+
+
+def test_compaction_drops_stale_entries():
+    heap = ReminderHeap()
+    # Una sola cita reprogramada muchas veces: el heap crece hasta 2 * vigentes + 1024.
+    for version in range(1026):
+        heap.schedule(1, 1000.0 - version, float(version))
+    assert len(heap._heap) == 1026
+
+    heap.schedule(1, 5.0, 1026.0)
+    assert heap._heap == [(5.0, 1, 1026.0)]
+    assert heap.pop_due(now=1000.0, limit=10) == [(5.0, 1, 1026.0)]
+
+
+# === ReminderScheduler._apply ===
+
+@pytest.fixture
+def scheduler():
+    return ReminderScheduler(session_factory=None, lead_minutes=60)
+
+
+def apply(scheduler, appointment_id=1, scheduled_for=NOW + timedelta(days=2), created_at=NOW - timedelta(days=1),
+          status="scheduled", reminder_sent_at=None, updated_at=NOW):
+    scheduler._apply(appointment_id, scheduled_for, created_at, status, reminder_sent_at, updated_at, now=NOW)
+
+
+def test_apply_schedules_lead_minutes_before(scheduler):
+    apply(scheduler, scheduled_for=NOW + timedelta(days=2))
+
+    assert scheduler.heap.next_send_at() == _epoch(NOW + timedelta(days=2, hours=-1))
+
+
+def test_apply_reschedule_moves_the_reminder(scheduler):
+    apply(scheduler, scheduled_for=NOW + timedelta(days=2), updated_at=NOW)
+    apply(scheduler, scheduled_for=NOW + timedelta(days=3), updated_at=NOW + timedelta(seconds=1))
+
+    assert len(scheduler.heap) == 1
+    assert scheduler.heap.next_send_at() == _epoch(NOW + timedelta(days=3, hours=-1))
+
+
+@pytest.mark.parametrize("changes", [
+    {"status": "cancelled"},
+    {"reminder_sent_at": NOW - timedelta(minutes=5)},
+    {"scheduled_for": NOW - timedelta(minutes=1)},
+])
+def test_apply_removes_reminders_that_no_longer_apply(scheduler, changes):
+    apply(scheduler)
+    apply(scheduler, updated_at=NOW + timedelta(seconds=1), **changes)
+
+    assert len(scheduler.heap) == 0
+    assert scheduler.heap.next_send_at() is None
+
+
+def test_apply_skips_appointments_booked_within_the_lead_window(scheduler):
+    # Agendada 30 minutos antes de la cita, con 60 de anticipación: no hay recordatorio.
+    apply(scheduler, scheduled_for=NOW + timedelta(minutes=30), created_at=NOW)
+
+    assert len(scheduler.heap) == 0
+
+
+# === Mensaje ===
+
+def row(**values):
+    defaults = {
+        "id": 7, "client_phone_number": "+573001112233", "client_name": "Ana María Gómez",
+        "scheduled_for": datetime(2026, 10, 21, 20, 30), "company_id": 3,
+    }
+    return SimpleNamespace(**{**defaults, **values})
+
+
+def company(reminder_message=None):
+    metadata = {"reminder_message": reminder_message} if reminder_message else {}
+    return SimpleNamespace(id=3, name="Clínica Sonríe", company_number="+14155238886", company_metadata=metadata)
+
+
+def test_message_uses_company_template_in_local_time():
+    message = ReminderScheduler._message(row(), company("{name}: {empresa} {fecha} {hora}"))
+
+    assert message == {
+        "to_number": "+573001112233",
+        "body": "Ana: Clínica Sonríe 21/10/2026 15:30",
+        "from_number": "+14155238886",
+        "company_id": 3,
+        "idempotency_key": "reminder:7:20261021T2030",
+    }
+
+
+@pytest.mark.parametrize("template", ["Hola {nombre}", "Cita {0}", "Hola {name", "Hola {name.foo}"])
+def test_message_falls_back_to_default_template(template):
+    message = ReminderScheduler._message(row(), company(template))
+
+    assert message["body"] == DEFAULT_REMINDER_MESSAGE.format(
+        name="Ana", empresa="Clínica Sonríe", fecha="21/10/2026", hora="15:30"
+    )
+
+
+# === dispatch_due ===
+
+class FakeSession:
+    def __init__(self, claimed, companies):
+        self._results = [SimpleNamespace(all=lambda: claimed), companies]
+        self.committed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        return self._results.pop(0)
+
+    async def commit(self):
+        self.committed = True
+
+
+@pytest.mark.asyncio
+async def test_dispatch_with_invalid_template_queues_the_batch(monkeypatch):
+    queued = []
+
+    async def enqueue_messages(session, messages):
+        queued.extend(messages)
+        return len(messages)
+
+    monkeypatch.setattr(reminder_scheduler, "enqueue_messages", enqueue_messages)
+    monkeypatch.setattr(reminder_scheduler, "wake_outbound_worker", lambda: None)
+    session = FakeSession([row(id=1), row(id=2)], [company("Hola {nombre}")])
+    scheduler = ReminderScheduler(session_factory=lambda: session)
+    scheduler.heap.schedule(1, time.time() - 10, 1.0)
+    scheduler.heap.schedule(2, time.time() - 5, 1.0)
+
+    assert await scheduler.dispatch_due() == 2
+    assert session.committed
+    assert [m["idempotency_key"] for m in queued] == ["reminder:1:20261021T2030", "reminder:2:20261021T2030"]
+    assert len(scheduler.heap) == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatch_failure_puts_the_batch_back():
+    class BrokenSession(FakeSession):
+        async def execute(self, statement):
+            raise ConnectionError("sin base")
+
+    scheduler = ReminderScheduler(session_factory=lambda: BrokenSession([], []))
+    due_at = time.time() - 10
+    scheduler.heap.schedule(1, due_at, 1.0)
+
+    with pytest.raises(ConnectionError):
+        await scheduler.dispatch_due()
+    assert len(scheduler.heap) == 1
+    assert scheduler.heap.next_send_at() == due_at
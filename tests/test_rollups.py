@@ -0,0 +1,56 @@
+"""Cubetas de latencia y cuantiles estimados desde el histograma (apps/dashboard/rollups.py)."""
+
+import random
+import statistics
+from collections import Counter
+
+import pytest
+
+from apps.dashboard.rollups import LATENCY_BUCKETS_MS, estimate_quantile, latency_bucket
+
+
+def histogram(samples):
+    return dict(Counter(latency_bucket(ms) for ms in samples))
+
+
+def bucket_width(milliseconds: float) -> float:
+    bucket = latency_bucket(milliseconds)
+    lower = LATENCY_BUCKETS_MS[bucket - 1] if bucket > 0 else 0
+    return LATENCY_BUCKETS_MS[bucket] - lower
+
+
+@pytest.mark.parametrize("milliseconds, bucket", [
+    (0, 0), (100, 0), (101, 1), (250, 1), (999, 3), (60000, 11), (60001, 12), (600000, 12),
+])
+def test_latency_bucket_upper_bounds_are_inclusive(milliseconds, bucket):
+    assert latency_bucket(milliseconds) == bucket
+
+
+@pytest.mark.parametrize("seed, mu, sigma", [(1, 7.0, 0.6), (2, 6.0, 0.3), (3, 8.5, 0.8)])
+def test_median_estimate_within_one_bucket(seed, mu, sigma):
+    # Tiempos de respuesta log-normales (mediana exp(mu): ~1.1 s, ~400 ms y ~4.9 s).
+    rng = random.Random(seed)
+    samples = [rng.lognormvariate(mu, sigma) for _ in range(20000)]
+    true_median = statistics.median(samples)
+
+    estimate = estimate_quantile(histogram(samples))
+
+    assert abs(estimate - true_median) <= bucket_width(true_median)
+
+
+def test_quantile_interpolates_inside_the_bucket():
+    # 10 turnos en (1000, 2000] y 10 en (2000, 3000]: la mediana es el límite entre ambas.
+    buckets = {latency_bucket(1500): 10, latency_bucket(2500): 10}
+
+    assert estimate_quantile(buckets) == 2000
+    assert estimate_quantile(buckets, 0.25) == 1500
+    assert estimate_quantile(buckets, 0.75) == 2500
+
+
+def test_quantile_in_the_open_last_bucket_is_its_lower_bound():
+    assert estimate_quantile({len(LATENCY_BUCKETS_MS): 5}) == LATENCY_BUCKETS_MS[-1]
+
+
+def test_quantile_without_turns():
+    assert estimate_quantile({}) is None
+    assert estimate_quantile({3: 0}) is None